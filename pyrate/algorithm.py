@@ -17,6 +17,7 @@
 This Python module contains a collection of generic algorithms used in PyRate
 """
 import logging
+import numpy as np
 from numpy import sin, cos, unique, histogram, diag, dot
 from scipy.linalg import qr, solve, lstsq
 from pyrate.shared import EpochList, IfgException, PrereadIfg
@@ -242,3 +243,30 @@ def master_slave_ids(dates):
 
     dset = sorted(set(dates))
     return dict([(date_, i) for i, date_ in enumerate(dset)])
+
+
+def pattern_groups(mask):
+    """
+    Groups pixels that share the same pattern of valid observations.
+    Used to factorise a network once and solve all pixels using it together.
+
+    :param ndarray mask: 3D boolean array of shape (nobs, nrows, ncols)
+
+    :return: patterns: 2D boolean array of shape (npatterns, nobs) holding
+        each distinct observation pattern
+    :rtype: ndarray
+    :return: keys: List of packed bytes keys, one per pattern
+    :rtype: list
+    :return: inverse: 1D array of length nrows*ncols with the pattern
+        index of each pixel (row-major order)
+    :rtype: ndarray
+    """
+    nobs = mask.shape[0]
+    flat = np.ascontiguousarray(np.reshape(mask, (nobs, -1)).T, dtype=bool)
+    packed = np.ascontiguousarray(np.packbits(flat, axis=1))
+    # view each packed row as a single opaque item so that np.unique
+    # compares whole patterns
+    rows = packed.view(np.dtype((np.void, packed.shape[1]))).ravel()
+    _, index, inverse = unique(rows, return_index=True, return_inverse=True)
+    keys = [packed[i].tobytes() for i in index]
+    return flat[index], keys, inverse.ravel()
@@ -25,19 +25,26 @@ from copy import deepcopy
 from collections import OrderedDict
 import numpy as np
 from numpy import isnan
-from scipy.fftpack import fft2, ifft2, fftshift, ifftshift
-from scipy.interpolate import griddata
 
 from pyrate import config as cf, mpiops, shared
 from pyrate.covariance import cvd_from_phase, RDist
-from pyrate.algorithm import get_epochs
-from pyrate.scripts.postprocessing import _assemble_tiles
-from pyrate.shared import Ifg
+from pyrate.algorithm import get_epochs, pattern_groups
+from pyrate.compat import rfft2, irfft2, fft_kwargs
 from pyrate import ifgconstants as ifc
 from pyrate.timeseries import time_series
 
 log = logging.getLogger(__name__)
 
+# spatial low pass filter distance grids keyed by image shape and pixel size,
+# and kernels of a fixed cutoff (slpfcutoff != 0) keyed by image shape, pixel
+# size and filter parameters. Each entry is the size of a half spectrum
+_SLP_DISTANCES = {}
+_SLP_KERNELS = {}
+_SLP_CACHE_SIZE = 2
+# Delaunay triangulation of the valid pixels of the last nan mask
+# interpolated, reused by epochs sharing the same mask
+_TRIANGULATION = {}
+
 
 def _wrap_spatio_temporal_filter(ifg_paths, params, tiles, preread_ifgs):
     """
@@ -57,12 +64,18 @@ def _wrap_spatio_temporal_filter(ifg_paths, params, tiles, preread_ifgs):
         log.info('Finished APS correction')
         return  # return if True condition returned
 
-    tsincr = _calc_svd_time_series(ifg_paths, params, preread_ifgs, tiles)
+    # the filters are distributed among the processes by tile, epoch and
+    # interferogram in turn, with intermediate results saved in tmpdir, so
+    # that no process holds the whole time series in memory
+    nvels = _calc_svd_time_series(ifg_paths, params, preread_ifgs, tiles)
+    _temporal_low_pass_filter_tiles(params, preread_ifgs, tiles)
 
-    ifg = Ifg(ifg_paths[0])  # just grab any for parameters in slpfilter
-    ifg.open()
-    spatio_temporal_filter(tsincr, ifg, params, preread_ifgs)
-    ifg.close()
+    # just grab any for parameters in slpfilter
+    ifg = shared.raster_header(ifg_paths[0])
+    _spatial_low_pass_filter_epochs(ifg, params, tiles, nvels)
+    mpiops.run_once(_cumulate_epochs, params, nvels)
+
+    _ts_to_ifgs_epochs(params, preread_ifgs)
 
 
 def spatio_temporal_filter(tsincr, ifg, params, preread_ifgs):
@@ -76,7 +89,6 @@ def spatio_temporal_filter(tsincr, ifg, params, preread_ifgs):
                 (ifg.shape, nepochs-1)
     :param list ifg: List of pyrate.shared.Ifg class objects.
     :param dict params: Dictionary of configuration parameter
-    :param list tiles: List of pyrate.shared.Tile class objects
     :param dict preread_ifgs: Dictionary of shared.PrereadIfg class instances
 
     :return: None, corrected interferograms are saved to disk
@@ -88,13 +100,14 @@ def spatio_temporal_filter(tsincr, ifg, params, preread_ifgs):
     ts_aps = mpiops.run_once(spatial_low_pass_filter, ts_hp, ifg, params)
     tsincr -= ts_aps
 
-    mpiops.run_once(_ts_to_ifgs, tsincr, preread_ifgs)
+    mpiops.run_once(_ts_to_ifgs, tsincr, preread_ifgs, params)
 
 
 def _calc_svd_time_series(ifg_paths, params, preread_ifgs, tiles):
     """
     Helper function to obtain time series for spatio-temporal filter
-    using SVD method
+    using SVD method. The time series tiles are saved in tmpdir and the
+    number of time series epochs is returned.
     """
     # Is there other existing functions that can perform this same job?
     log.info('Calculating time series via SVD method for '
@@ -103,7 +116,7 @@ def _calc_svd_time_series(ifg_paths, params, preread_ifgs, tiles):
     new_params = deepcopy(params)
     new_params[cf.TIME_SERIES_METHOD] = 2  # use SVD method
 
-    process_tiles = mpiops.array_split(tiles)
+    process_tiles = shared.schedule_tiles(tiles, params)
     output_dir = params[cf.TMPDIR]
 
     nvels = None
@@ -118,28 +131,125 @@ def _calc_svd_time_series(ifg_paths, params, preread_ifgs, tiles):
             t.index)), arr=tsincr)
         nvels = tsincr.shape[2]
 
-    nvels = mpiops.comm.bcast(nvels, root=0)
-    # need to assemble tsincr from all processes
-    tsincr_g = mpiops.run_once(_assemble_tsincr, ifg_paths, params,
-                               preread_ifgs, tiles, nvels)
+    # the master process may not have calculated any tile
+    nvels = [n for n in mpiops.comm.allgather(nvels) if n is not None][0]
     log.info('Finished calculating time series for spatio-temporal filter')
-    return tsincr_g
+    return nvels
 
 
-def _assemble_tsincr(ifg_paths, params, preread_ifgs, tiles, nvels):
+def _assemble_epoch(tiles, shape, output_dir, outtype, epoch):
     """
-    Helper function to reconstruct time series images from tiles
+    Helper function to reconstruct the time series image of one epoch from
+    the tiles saved in output_dir
     """
-    shape = preread_ifgs[ifg_paths[0]].shape + (nvels,)
-    tsincr_g = np.empty(shape=shape, dtype=np.float32)
+    image = np.empty(shape=shape, dtype=np.float32)
+    for t in tiles:
+        tile = np.load(os.path.join(output_dir, '{}_{}.npy'.format(
+            outtype, t.index)), mmap_mode='r')
+        image[t.top_left_y:t.bottom_right_y,
+              t.top_left_x:t.bottom_right_x] = tile[:, :, epoch]
+    return image
+
+
+def _temporal_low_pass_filter_tiles(params, preread_ifgs, tiles):
+    """
+    MPI wrapper applying the temporal low pass filter to the time series
+    tiles, distributed by tile among the processes. The high pass filtered
+    time series tiles are saved in tmpdir.
+    """
+    epochlist = get_epochs(preread_ifgs)[0]
+    output_dir = params[cf.TMPDIR]
+    for t in shared.schedule_tiles(tiles, params):
+        tsincr = np.load(os.path.join(output_dir,
+                                      'tsincr_aps_{}.npy'.format(t.index)))
+        ts_hp = tsincr - temporal_low_pass_filter(tsincr, epochlist, params)
+        np.save(file=os.path.join(output_dir, 'tshp_aps_{}.npy'.format(
+            t.index)), arr=ts_hp)
+
+
+def _spatial_low_pass_filter_epochs(ifg, params, tiles, nvels):
+    """
+    MPI wrapper applying the spatial low pass filter to the high pass
+    filtered time series, distributed by epoch among the processes. The APS
+    corrected incremental time series of each epoch is saved in tmpdir.
+    """
+    log.info('Applying spatial low pass filter')
+    output_dir = params[cf.TMPDIR]
+    rdist = RDist(ifg)
+    r_dist, rbins = rdist(), rdist.bins()
+    for i in mpiops.array_split(range(nvels)):
+        ts_hp = _assemble_epoch(tiles, ifg.shape, output_dir, 'tshp_aps', i)
+        ts_aps = _spatial_filter_epoch(ts_hp, ifg, r_dist, params, rbins)
+        tsincr = _assemble_epoch(tiles, ifg.shape, output_dir, 'tsincr_aps',
+                                 i)
+        np.save(file=os.path.join(output_dir, 'tsincr_aps_corrected_{}.npy'.
+                                  format(i)), arr=tsincr - ts_aps)
+    mpiops.comm.barrier()
+    log.info('Finished applying spatial low pass filter')
+
+
+def _cumulate_epochs(params, nvels):
+    """
+    Helper function saving the cumulative sum of the APS corrected incremental
+    time series up to each epoch in tmpdir, so that an interferogram is the
+    difference of two cumulative epochs. NaNs are summed as zero and counted
+    separately, so that only the epochs of an interferogram make it NaN.
+    """
+    output_dir = params[cf.TMPDIR]
+    cum, nans = None, None
     for i in range(nvels):
-        for n, t in enumerate(tiles):
-            _assemble_tiles(i, n, t, tsincr_g[:, :, i], params[cf.TMPDIR],
-                            'tsincr_aps')
-    return tsincr_g
+        tsincr = np.load(os.path.join(
+            output_dir, 'tsincr_aps_corrected_{}.npy'.format(i)))
+        if cum is None:
+            cum = np.zeros(tsincr.shape, dtype=np.float64)
+            nans = np.zeros(tsincr.shape, dtype=np.uint16)
+        nan = isnan(tsincr)
+        nans += nan
+        tsincr[nan] = 0
+        cum += tsincr
+        np.save(file=os.path.join(output_dir, 'tscum_aps_corrected_{}.npy'.
+                                  format(i)), arr=cum)
+        np.save(file=os.path.join(output_dir, 'tscum_aps_nans_{}.npy'.
+                                  format(i)), arr=nans)
+
+
+def _epoch_span_phase(output_dir, master, slave):
+    """
+    Helper function returning the sum of the APS corrected incremental time
+    series from epoch index master up to, but excluding, slave, from the
+    cumulative epochs saved by _cumulate_epochs
+    """
+    def _load(outtype, epoch):
+        return np.load(os.path.join(output_dir, '{}_{}.npy'.format(outtype,
+                                                                  epoch)))
+
+    phase = _load('tscum_aps_corrected', slave - 1)
+    nans = _load('tscum_aps_nans', slave - 1)
+    if master > 0:
+        phase -= _load('tscum_aps_corrected', master - 1)
+        nans -= _load('tscum_aps_nans', master - 1)
+    phase[nans > 0] = np.nan
+    return phase
+
+
+def _ts_to_ifgs_epochs(params, preread_ifgs):
+    """
+    MPI wrapper converting the APS corrected cumulative time series saved
+    by epoch into interferometric phase observations, distributed by
+    interferogram among the processes. See _ts_to_ifgs.
+    """
+    log.info('Converting time series to ifgs')
+    ifgs = list(OrderedDict(sorted(preread_ifgs.items())).values())
+    _, n = get_epochs(ifgs)
+    index_master, index_slave = n[:len(ifgs)], n[len(ifgs):]
+    for i in mpiops.array_split(range(len(ifgs))):
+        phase = _epoch_span_phase(params[cf.TMPDIR], index_master[i],
+                                  index_slave[i])
+        _save_aps_corrected_phase(ifgs[i].path, phase, params)
+    mpiops.comm.barrier()
 
 
-def _ts_to_ifgs(tsincr, preread_ifgs):
+def _ts_to_ifgs(tsincr, preread_ifgs, params):
     """
     Function that converts an incremental displacement time series into
     interferometric phase observations. Used to re-construct an interferogram
@@ -148,6 +258,7 @@ def _ts_to_ifgs(tsincr, preread_ifgs):
     :param ndarray tsincr: incremental time series array of size
                 (ifg.shape, nepochs-1)
     :param dict preread_ifgs: Dictionary of shared.PrereadIfg class instances
+    :param dict params: Dictionary of configuration parameters
 
     :return: None, interferograms are saved to disk
     """
@@ -157,20 +268,19 @@ def _ts_to_ifgs(tsincr, preread_ifgs):
     index_master, index_slave = n[:len(ifgs)], n[len(ifgs):]
     for i, ifg in enumerate(ifgs):
         phase = np.sum(tsincr[:, :, index_master[i]: index_slave[i]], axis=2)
-        _save_aps_corrected_phase(ifg.path, phase)
+        _save_aps_corrected_phase(ifg.path, phase, params)
 
 
-def _save_aps_corrected_phase(ifg_path, phase):
+def _save_aps_corrected_phase(ifg_path, phase, params):
     """
     Save (update) interferogram metadata and phase data after
     spatio-temporal filter (APS) correction.
     """
-    ifg = Ifg(ifg_path)
-    ifg.open(readonly=False)
+    ifg = shared.open_ifg_for_correction(ifg_path, params)
     ifg.phase_data[~np.isnan(ifg.phase_data)] = \
         phase[~np.isnan(ifg.phase_data)]
     # set aps tags after aps error correction
-    ifg.dataset.SetMetadataItem(ifc.PYRATE_APS_ERROR, ifc.APS_REMOVED)
+    ifg.meta_data[ifc.PYRATE_APS_ERROR] = ifc.APS_REMOVED
     ifg.write_modified_phase()
     ifg.close()
 
@@ -191,17 +301,28 @@ def spatial_low_pass_filter(ts_lp, ifg, params):
     :rtype: ndarray
     """
     log.info('Applying spatial low pass filter')
-    if params[cf.SLPF_NANFILL] == 0:
-        ts_lp[np.isnan(ts_lp)] = 0  # need it here for cvd and fft
-    else:  # optionally interpolate, operation is inplace
-        _interpolate_nans(ts_lp, params[cf.SLPF_NANFILL_METHOD])
-    r_dist = RDist(ifg)()
+    rdist = RDist(ifg)
+    r_dist, rbins = rdist(), rdist.bins()
     for i in range(ts_lp.shape[2]):
-        ts_lp[:, :, i] = _slpfilter(ts_lp[:, :, i], ifg, r_dist, params)
+        ts_lp[:, :, i] = _spatial_filter_epoch(ts_lp[:, :, i], ifg, r_dist,
+                                               params, rbins)
     log.info('Finished applying spatial low pass filter')
     return ts_lp
 
 
+def _spatial_filter_epoch(phase, ifg, r_dist, params, rbins=None):
+    """
+    Nan fill (in place) and spatially filter the time series data of one
+    epoch
+    """
+    if params[cf.SLPF_NANFILL] == 0:
+        phase[np.isnan(phase)] = 0  # need it here for cvd and fft
+    else:  # optionally interpolate, operation is inplace
+        _interpolate_nans(phase[:, :, np.newaxis],
+                          params[cf.SLPF_NANFILL_METHOD])
+    return _slpfilter(phase, ifg, r_dist, params, rbins)
+
+
 def _interpolate_nans(arr, method='linear'):
     """
     Fill any NaN values in arr with interpolated values. Nanfill and
@@ -215,13 +336,41 @@ def _interpolate_nans(arr, method='linear'):
 
 def _interpolate_nans_2d(a, rows, cols, method):
     """
-    In-place array interpolation and nanfill
+    In-place array interpolation and nanfill. The 'linear' and 'cubic'
+    methods reuse the triangulation of the valid pixels while the nan mask
+    does not change. The 'edt' method fills each nan with the value of the
+    nearest valid pixel found with a Euclidean distance transform, which is
+    much faster and lighter on memory than a triangulation.
 
     :param ndarray a: 2d ndarray to be interpolated
     :param ndarray rows: 2d ndarray of row indices
     :param ndarray cols: 2d ndarray of col indices
-    :param str method: Method; one of 'nearest', 'linear', and 'cubic'
+    :param str method: Method; one of 'nearest', 'linear', 'cubic' and 'edt'
     """
+    nans = np.isnan(a)
+    if not nans.any():
+        return
+    if nans.all():
+        a[:] = 0
+        return
+    if method == 'edt':
+        from scipy.ndimage import distance_transform_edt
+        index = distance_transform_edt(nans, return_distances=False,
+                                       return_indices=True)
+        a[nans] = a[index[0][nans], index[1][nans]]
+        return
+    # scipy.interpolate is only imported when the nanfill uses it
+    from scipy.interpolate import griddata, LinearNDInterpolator, \
+        CloughTocher2DInterpolator
+    if method in ('linear', 'cubic'):
+        tri = _triangulation(nans, rows, cols)
+        if method == 'linear':
+            interp = LinearNDInterpolator(tri, a[~nans])
+        else:
+            interp = CloughTocher2DInterpolator(tri, a[~nans])
+        a[nans] = interp(rows[nans], cols[nans])
+        a[np.isnan(a)] = 0  # zero fill boundary/edge nans
+        return
     a[np.isnan(a)] = griddata(
         (rows[~np.isnan(a)], cols[~np.isnan(a)]),  # points we know
         a[~np.isnan(a)],  # values we know
@@ -231,48 +380,117 @@ def _interpolate_nans_2d(a, rows, cols, method):
     a[np.isnan(a)] = 0  # zero fill boundary/edge nans
 
 
-def _slpfilter(phase, ifg, r_dist, params):
+def _triangulation(nans, rows, cols):
+    """
+    Delaunay triangulation of the valid (non-nan) pixels, cached for the
+    last nan mask
+    """
+    if 'mask' not in _TRIANGULATION or \
+            not np.array_equal(_TRIANGULATION['mask'], nans):
+        from scipy.spatial import Delaunay
+        _TRIANGULATION.clear()  # release the old triangulation first
+        _TRIANGULATION['tri'] = Delaunay(np.column_stack(
+            (rows[~nans], cols[~nans])))
+        _TRIANGULATION['mask'] = nans.copy()
+    return _TRIANGULATION['tri']
+
+
+def _slpfilter(phase, ifg, r_dist, params, rbins=None):
     """
     Wrapper function for spatial low pass filter
     """
     if np.all(np.isnan(phase)):  # return for nan matrix
         return phase
     cutoff = params[cf.SLPF_CUTOFF]
+    # the same forward fft is used by cvd and the filter
+    spectrum = rfft2(phase, **fft_kwargs(_fft_workers(params)))
 
     if cutoff == 0:
-        _, alpha = cvd_from_phase(phase, ifg, r_dist, calc_alpha=True)
+        _, alpha = cvd_from_phase(phase, ifg, r_dist, calc_alpha=True,
+                                  params=params, spectrum=spectrum,
+                                  rbins=rbins)
         cutoff = 1.0/alpha
     rows, cols = ifg.shape
     return _slp_filter(phase, cutoff, rows, cols,
-                       ifg.x_size, ifg.y_size, params)
+                       ifg.x_size, ifg.y_size, params, spectrum)
 
 
-def _slp_filter(phase, cutoff, rows, cols, x_size, y_size, params):
+def _slp_filter(phase, cutoff, rows, cols, x_size, y_size, params,
+                spectrum=None):
     """
-    Function to perform spatial low pass filter
+    Function to perform spatial low pass filter. The filter is applied to
+    the real fft spectrum of the phase, which is modified in place if given.
     """
-    cx = np.floor(cols/2)
-    cy = np.floor(rows/2)
-    # fft for the input image
-    imf = fftshift(fft2(phase))
-    # calculate distance
-    distfact = 1.0e3  # to convert into meters
-    [xx, yy] = np.meshgrid(range(cols), range(rows))
-    xx = (xx - cx) * x_size  # these are in meters as x_size in meters
-    yy = (yy - cy) * y_size
-    dist = np.sqrt(xx ** 2 + yy ** 2)/distfact  # km
+    workers = _fft_workers(params)
+    if spectrum is None:
+        spectrum = rfft2(phase, **fft_kwargs(workers))
+    # with slpfcutoff = 0 the cutoff is estimated for each epoch, so the
+    # kernel is not reused
+    spectrum *= _slp_kernel(rows, cols, x_size, y_size, cutoff,
+                            params[cf.SLPF_METHOD], params[cf.SLPF_ORDER],
+                            cache=params[cf.SLPF_CUTOFF] != 0)
+    out = irfft2(spectrum, s=(rows, cols), **fft_kwargs(workers))
+    out[np.isnan(phase)] = np.nan
+    return out  # out is units of phase, i.e. mm
 
-    if params[cf.SLPF_METHOD] == 1:  # butterworth low pass filter
-        H = 1. / (1 + ((dist / cutoff) ** (2 * params[cf.SLPF_ORDER])))
+
+def _fft_workers(params):
+    """
+    Number of fft threads
+    """
+    return params[cf.PROCESSES] if params.get(cf.PARALLEL) else 1
+
+
+def _slp_kernel(rows, cols, x_size, y_size, cutoff, method, order,
+                cache=False):
+    """
+    Spatial low pass filter transfer function for the real fft spectrum
+    (unshifted, non-negative x frequencies only), kept for later calls if
+    cache
+    """
+    key = (rows, cols, x_size, y_size, cutoff, method, order)
+    if key in _SLP_KERNELS:
+        return _SLP_KERNELS[key]
+    dist = _slp_distance(rows, cols, x_size, y_size)
+    if method == 1:  # butterworth low pass filter
+        H = 1. / (1 + ((dist / cutoff) ** (2 * order)))
     else:  # Gaussian low pass filter
         H = np.exp(-(dist ** 2) / (2 * cutoff ** 2))
-    outf = imf * H
-    out = np.real(ifft2(ifftshift(outf)))
-    out[np.isnan(phase)] = np.nan
-    return out  # out is units of phase, i.e. mm
+    if cache:
+        _cache_put(_SLP_KERNELS, key, H)
+    return H
+
+
+def _slp_distance(rows, cols, x_size, y_size):
+    """
+    Distance grid of the spatial low pass filter in km, shifted to match the
+    unshifted real fft spectrum
+    """
+    key = (rows, cols, x_size, y_size)
+    if key not in _SLP_DISTANCES:
+        cx = np.floor(cols/2)
+        cy = np.floor(rows/2)
+        distfact = 1.0e3  # to convert into meters
+        [xx, yy] = np.meshgrid(range(cols), range(rows))
+        xx = (xx - cx) * x_size  # these are in meters as x_size in meters
+        yy = (yy - cy) * y_size
+        dist = np.sqrt(xx ** 2 + yy ** 2)/distfact  # km
+        # the distance is centred like a shifted spectrum
+        _cache_put(_SLP_DISTANCES, key,
+                   np.fft.ifftshift(dist)[:, :cols // 2 + 1])
+    return _SLP_DISTANCES[key]
+
+
+def _cache_put(cache, key, value):
+    """
+    Add value to a spatial low pass filter cache, dropping the older entries
+    once it holds _SLP_CACHE_SIZE of them
+    """
+    if len(cache) >= _SLP_CACHE_SIZE:
+        cache.clear()
+    cache[key] = value
 
 
-# TODO: use tiles here and distribute amongst processes
 def temporal_low_pass_filter(tsincr, epochlist, params):
     """
     Filter time series data temporally using either a Gaussian, triangular
@@ -326,15 +544,24 @@ mean_filter = lambda m, yr, cutoff: np.ones(m)
 def _tlpfilter(cols, cutoff, nanmat, rows, span, threshold, tsfilt_incr,
                tsincr, func):
     """
-    Wrapper function for temporal low pass filter
-    """
-    for i in range(rows):
-        for j in range(cols):
-            sel = np.nonzero(nanmat[i, j, :])[0]  # don't select if nan
-            m = len(sel)
-            if m >= threshold:
-                for k in range(m):
-                    yr = span[sel] - span[sel[k]]
-                    wgt = func(m, yr, cutoff)
-                    wgt /= np.sum(wgt)
-                    tsfilt_incr[i, j, sel[k]] = np.sum(tsincr[i, j, sel] * wgt)
+    Wrapper function for temporal low pass filter. The filter weights of all
+    epochs are calculated once for each pattern of valid (non-nan) epochs and
+    applied to all pixels sharing the pattern as a matrix product.
+    """
+    patterns, _, inverse = pattern_groups(np.moveaxis(nanmat, 2, 0))
+    ts = np.reshape(tsincr, (rows * cols, -1))
+    filt = np.reshape(tsfilt_incr, (rows * cols, -1)).copy()
+    order = np.argsort(inverse, kind='mergesort')
+    bounds = np.cumsum(np.bincount(inverse, minlength=len(patterns)))[:-1]
+    for pattern, pixels in zip(patterns, np.split(order, bounds)):
+        sel = np.nonzero(pattern)[0]  # don't select if nan
+        m = len(sel)
+        if m == 0 or m < threshold:
+            continue
+        # row k holds the weights of all selected epochs for epoch sel[k]
+        yr = span[sel][np.newaxis, :] - span[sel][:, np.newaxis]
+        wgt = np.array(np.broadcast_to(func(m, yr, cutoff), yr.shape),
+                       dtype=np.float64)
+        wgt /= np.sum(wgt, axis=1, keepdims=True)
+        filt[np.ix_(pixels, sel)] = ts[np.ix_(pixels, sel)].dot(wgt.T)
+    tsfilt_incr[:] = np.reshape(filt, tsfilt_incr.shape)
@@ -38,6 +38,22 @@ if PY3:
 else:
     import cPickle as pickle
 
+try:
+    from multiprocessing.connection import wait
+except ImportError:
+    def wait(object_list):
+        """
+        Python 2 replacement of multiprocessing.connection.wait for
+        connections: blocks until at least one of them can be read
+        """
+        while True:
+            ready = [c for c in object_list if c.poll(0.001)]
+            if ready:
+                return ready
+
+# fft module, imported at first use as scipy is slow to import
+_FFT = {}
+
 
 class PyAPSException(Exception):
     """
@@ -45,6 +61,48 @@ class PyAPSException(Exception):
     """
 
 
+def _fft():
+    """
+    Convenience function returning the fft module. scipy.fft (scipy >= 1.4)
+    keeps single precision and supports threads, numpy.fft is used otherwise
+    """
+    if 'module' not in _FFT:
+        try:
+            from scipy import fft
+        except ImportError:
+            fft = None
+        # before scipy 1.4 scipy.fft is the fft function, not the module
+        if not hasattr(fft, 'rfft2'):
+            from numpy import fft
+        _FFT['workers'] = fft.__name__ == 'scipy.fft'
+        _FFT['module'] = fft
+    return _FFT['module']
+
+
+def rfft2(a, s=None, **kwargs):
+    """
+    Convenience function for the 2-D real fft of the available fft module
+    """
+    return _fft().rfft2(a, s=s, **kwargs)
+
+
+def irfft2(a, s=None, **kwargs):
+    """
+    Convenience function for the inverse 2-D real fft of the available fft
+    module
+    """
+    return _fft().irfft2(a, s=s, **kwargs)
+
+
+def fft_kwargs(workers):
+    """
+    Convenience function returning the keyword arguments for rfft2/irfft2
+    to use a number of threads where supported
+    """
+    _fft()
+    return {'workers': workers} if _FFT['workers'] else {}
+
+
 def validate_pyaps():
     """
     Convenience function validating PyAPS status
@@ -26,7 +26,6 @@ import os
 from os.path import splitext
 import warnings
 from pyrate import compat
-from pyrate import mpiops
 
 # TODO: add regex column to check if some values are within bounds? Potential
 # problem with the checking being done in the middle of the runs, as bad values
@@ -60,7 +59,8 @@ NO_DATA_AVERAGING_THRESHOLD = 'noDataAveragingThreshold'
 #: BOOL (1/2/3); Re-project data from Line of sight, 1 = vertical,
 # 2 = horizontal, 3 = no conversion
 REPROJECTION = 'prjflag' # NOT CURRENTLY USED
-#: BOOL (0/1); Select MST algorithm, 0 = Matlab Pirate algorithm, 1 = NetworkX
+#: INT (0/1/2); Select MST algorithm, 0 = Matlab Pirate algorithm, 1 = NetworkX,
+# 2 = vectorised NumPy (Kruskal)
 NETWORKX_OR_MATLAB_FLAG = 'networkx_or_matlab'
 #: BOOL (0/1): Convert no data values to Nan
 NAN_CONVERSION = 'nan_conversion'
@@ -124,12 +124,18 @@ LR_NSIG = 'nsig'
 LR_PTHRESH = 'pthr'
 #: REAL; Maximum allowable standard error for pixels in linear rate inversion.
 LR_MAXSIG = 'maxsig'
+#: INT (1/2); Linear rate engine, 1 = pixel-by-pixel, 2 = batched by valid observation pattern
+LR_METHOD = 'lrmethod'
 
 # atmospheric delay errors fitting parameters NOT CURRENTLY USED
 # atmfitmethod = 1: interferogram by interferogram; atmfitmethod = 2, epoch by epoch
 #ATM_FIT = 'atmfit'
 #ATM_FIT_METHOD = 'atmfitmethod'
 
+#: INT (1/2); Method for fitting the exponential decay (alpha) of the
+# covariance function, 1 = Nelder-Mead, 2 = vectorised Gauss-Newton
+COV_ALPHA_METHOD = 'alphamethod'
+
 #: BOOL (0/1) Do spatio-temporal filter
 APSEST = 'apsest'
 
@@ -156,6 +162,9 @@ TIME_SERIES_PTHRESH = 'ts_pthr'
 TIME_SERIES_SM_ORDER = 'smorder'
 #: REAL; Laplacian smoothing factor (values used is 10**smfactor)
 TIME_SERIES_SM_FACTOR = 'smfactor'
+#: INT; Maximum number of distinct observation networks whose time series
+# inversion operators are cached (0 disables the cache)
+TIME_SERIES_CACHE_SIZE = 'ts_cachesize'
 # tsinterp is automatically assigned in the code; not needed in conf file
 #TIME_SERIES_INTERP = 'tsinterp'
 
@@ -163,6 +172,18 @@ TIME_SERIES_SM_FACTOR = 'smfactor'
 PARALLEL = 'parallel'
 #: INT; Number of processes for multi-threading
 PROCESSES = 'processes'
+#: REAL; Memory budget per process in MB used to choose the tile layout when
+# the number of tile rows and columns is not given (0 for a single tile)
+TILE_MEMORY = 'tilemem'
+#: BOOL (0/1); Reuse the preread information, reference pixel, independent
+# orbital and reference phase corrections and maxvar of the previous run for
+# interferograms that have not changed since. The MST, time series and linear
+# rate are computed for the whole stack. Not supported with APS correction or
+# the network orbital correction method
+INCREMENTAL = 'incremental'
+#: BOOL (0/1); Keep the orbital, reference phase and APS corrections in the
+# phase cube and write each interferogram once after the last correction
+FUSED_CORRECTIONS = 'fusedcorrections'
 
 #: BOOL (0/1); Switch for using Luigi to perform prepifg step
 LUIGI = 'use_luigi'
@@ -235,10 +256,13 @@ PARAM_CONVERSION = {
     # pixel thresh based on nepochs? not every project may have 20 epochs
     LR_PTHRESH: (int, 20),
     LR_MAXSIG: (int, 2),
+    LR_METHOD: (int, 1),
 
     #ATM_FIT: (int, 0), NOT CURRENTLY USED
     #ATM_FIT_METHOD: (int, 2),
 
+    COV_ALPHA_METHOD: (int, 1),
+
     APSEST: (int, 0),
     TLPF_METHOD: (int, 1),
     TLPF_CUTOFF: (float, 0.0),
@@ -255,9 +279,13 @@ PARAM_CONVERSION = {
     TIME_SERIES_SM_FACTOR: (float, None),
     TIME_SERIES_SM_ORDER: (int, None),
     TIME_SERIES_METHOD: (int, 2),  # Default to SVD method
+    TIME_SERIES_CACHE_SIZE: (int, 1000),
 
     PARALLEL: (int, 0),
     PROCESSES: (int, 8),
+    TILE_MEMORY: (float, 0),
+    INCREMENTAL: (int, 0),
+    FUSED_CORRECTIONS: (int, 0),
     PROCESSOR: (int, None),
     NETWORKX_OR_MATLAB_FLAG: (int, 1), # Default to NetworkX
     LUIGI: (int, 0),
@@ -300,13 +328,35 @@ def get_config_params(path):
 
     params = _parse_conf_file(txt)
     params[TMPDIR] = os.path.join(os.path.abspath(params[OUT_DIR]), 'tmpdir')
+    from pyrate import mpiops  # mpi4py is slow to import
     if mpiops.size > 1 and params[LUIGI] == 1:
         raise ConfigException('LUIGI with MPI not supported. Please '
                               'turn off LUIGI in config file or '
                               'use LUIGI without MPI')
+    _validate_incremental(params)
     return params
 
 
+def _validate_incremental(params):
+    """
+    Rejects the corrections incremental processing can not apply to the
+    new interferograms only
+    """
+    if not params[INCREMENTAL]:
+        return
+    if params[APSEST]:
+        # the APS filter is estimated from the whole stack, so the APS
+        # corrected ifgs of the previous run can not be reused
+        raise ConfigException('Incremental processing is not supported with '
+                              'APS correction. Please turn off {} or '
+                              '{}'.format(APSEST, INCREMENTAL))
+    if params[ORBITAL_FIT] and params[ORBITAL_FIT_METHOD] == NETWORK_METHOD:
+        # the network method estimates the orbital errors of all ifgs
+        # together and its coefficients are not stored
+        raise ConfigException('Incremental processing is only supported with '
+                              'the independent orbital correction method')
+
+
 def _parse_conf_file(content):
     """
     Parser for converting text content into a dictionary of parameters
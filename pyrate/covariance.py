@@ -20,14 +20,18 @@ are based on functions 'cvdcalc.m' and 'vcmt.m' from
 the Matlab Pirate package.
 """
 from __future__ import print_function
+from collections import namedtuple
 from os.path import basename, join
 import logging
 from numpy import array, where, isnan, real, imag, sqrt, meshgrid
-from numpy import zeros, vstack, ceil, mean, exp, reshape
+from numpy import zeros, vstack, ceil, exp, reshape
 from numpy.linalg import norm
 import numpy as np
-from scipy.fftpack import fft2, ifft2, fftshift
+from scipy.fftpack import fftshift
 from scipy.optimize import fmin
+from scipy.sparse import csr_matrix
+from joblib import Parallel, delayed
+from pyrate.compat import rfft2, irfft2
 
 from pyrate import shared
 from pyrate.shared import PrereadIfg
@@ -39,9 +43,17 @@ from pyrate import config as cf
 # distance division factor of 1000 converts to km and is needed to match
 # Matlab code output
 DISTFACT = 1000
+# Gauss-Newton alpha fit: maximum iterations, step halvings per iteration and
+# relative step size at convergence
+GN_MAX_ITERATIONS = 50
+GN_MAX_HALVINGS = 30
+GN_TOLERANCE = 1e-8
 
 log = logging.getLogger(__name__)
 
+RadialBins = namedtuple('RadialBins', ['keep', 'rbin', 'counts', 'maxbin',
+                                       'bin_width'])
+
 
 def _pendiffexp(alphamod, cvdav):
     """
@@ -68,7 +80,7 @@ def _unique_points(points):  # pragma: no cover
 
 
 def cvd(ifg_path, params, r_dist, calc_alpha=False,
-        write_vals=False, save_acg=False):
+        write_vals=False, save_acg=False, rbins=None):
     """
     Calculate the 1D covariance function of an entire interferogram as the
     radial average of its 2D autocorrelation.
@@ -83,6 +95,8 @@ def cvd(ifg_path, params, r_dist, calc_alpha=False,
                 interferogram metadata
     :param bool save_acg: If True write autocorrelation and radial distance
                 data to numpy array file on disk
+    :param RadialBins rbins: [optional] Radial bins of r_dist (See
+                RDist.bins); computed from r_dist if not provided
 
     :return: maxvar: The maximum variance (at zero lag)
     :rtype: float
@@ -96,24 +110,118 @@ def cvd(ifg_path, params, r_dist, calc_alpha=False,
     else:
         ifg = ifg_path
 
+    maxvar, alpha = cvd_from_phase(_cvd_phase(ifg, params), ifg, r_dist,
+                                   calc_alpha, save_acg=save_acg,
+                                   params=params, rbins=rbins)
+
+    if write_vals:
+        _add_metadata(ifg, maxvar, alpha)
+
+    if isinstance(ifg_path, str):
+        ifg.close()
+
+    return maxvar, alpha
+
+
+def _cvd_phase(ifg, params):
+    """
+    Convenience function returning the phase data used for the covariance
+    calculation, with nans as zeros
+    """
     shared.nan_and_mm_convert(ifg, params)
     # calculate 2D auto-correlation of image using the
     # spectral method (Wiener-Khinchin theorem)
     if ifg.nan_converted:  # if nancoverted earlier, convert nans back to 0's
-        phase = where(isnan(ifg.phase_data), 0, ifg.phase_data)
-    else:
-        phase = ifg.phase_data
+        return where(isnan(ifg.phase_data), 0, ifg.phase_data)
+    return ifg.phase_data
 
-    maxvar, alpha = cvd_from_phase(phase, ifg, r_dist, calc_alpha,
-                                   save_acg=save_acg, params=params)
 
-    if write_vals:
-        _add_metadata(ifg, maxvar, alpha)
+def _cvd_average(ifg_path, params, r_dist, save_acg, rbins):
+    """
+    Convenience function returning the maxvar and the binned covariance
+    function of an interferogram, leaving the alpha fit to the caller
+    """
+    if isinstance(ifg_path, str):
+        ifg = shared.Ifg(ifg_path)
+        ifg.open()
+    else:
+        ifg = ifg_path
+    maxvar, cvdav = _autocovariance(_cvd_phase(ifg, params), ifg, r_dist,
+                                    True, save_acg, params, None, rbins)
+    if isinstance(ifg_path, str):
+        ifg.close()
+    return maxvar, cvdav
+
 
+def _write_metadata(ifg_path, maxvar, alpha):
+    """
+    Convenience function for saving metadata to an ifg file or object
+    """
     if isinstance(ifg_path, str):
+        ifg = shared.Ifg(ifg_path)
+        ifg.open()
+        _add_metadata(ifg, maxvar, alpha)
         ifg.close()
+    else:
+        _add_metadata(ifg_path, maxvar, alpha)
 
-    return maxvar, alpha
+
+def cvd_batch(ifg_paths, params, r_dist, calc_alpha=False,
+              write_vals=False, save_acg=False, rbins=None):
+    """
+    Calculate the 1D covariance function of several interferograms of the
+    same geometry. The interferograms are processed by a pool of threads
+    when parallel processing is enabled; the ffts release the GIL. With the
+    Gauss-Newton alpha method the alpha of all interferograms are fitted at
+    once (See fit_alpha).
+
+    :param list ifg_paths: List of interferogram file paths or
+                pyrate.shared.Ifg class objects
+    :param dict params: Dictionary of configuration parameters
+    :param ndarray r_dist: Array of distance values from the image centre
+                (See Rdist class for more details)
+    :param bool calc_alpha: If True calculate alpha
+    :param bool write_vals: If True write maxvar and alpha values to
+                interferogram metadata
+    :param bool save_acg: If True write autocorrelation and radial distance
+                data to numpy array file on disk
+    :param RadialBins rbins: [optional] Radial bins of r_dist (See
+                RDist.bins); computed once from the first interferogram if
+                not provided
+
+    :return: list of (maxvar, alpha) tuples, one for each interferogram
+    :rtype: list
+    """
+    if not ifg_paths:
+        return []
+    if rbins is None:
+        ifg = ifg_paths[0]
+        if isinstance(ifg, str):
+            ifg = shared.Ifg(ifg)
+            ifg.open()
+            rbins = _radial_bins(r_dist, ifg)
+            ifg.close()
+        else:
+            rbins = _radial_bins(r_dist, ifg)
+    threads = params[cf.PROCESSES] if params.get(cf.PARALLEL) else 1
+    method = _alpha_method(params)
+    if not calc_alpha or method == 1:
+        return Parallel(n_jobs=threads, backend='threading')(
+            delayed(cvd)(i, params, r_dist, calc_alpha, write_vals, save_acg,
+                         rbins) for i in ifg_paths)
+
+    # the Gauss-Newton fit is vectorised over all interferograms
+    stats = Parallel(n_jobs=threads, backend='threading')(
+        delayed(_cvd_average)(i, params, r_dist, save_acg, rbins)
+        for i in ifg_paths)
+    maxvar = [m for m, _ in stats]
+    alpha = fit_alpha(stats[0][1][0], np.array([c[1] for _, c in stats]),
+                      method)
+    if write_vals:
+        Parallel(n_jobs=threads, backend='threading')(
+            delayed(_write_metadata)(i, m, a)
+            for i, m, a in zip(ifg_paths, maxvar, alpha))
+    return list(zip(maxvar, alpha))
 
 
 def _add_metadata(ifg, maxvar, alpha):
@@ -137,7 +245,7 @@ def _save_cvd_data(acg, r_dist, ifg_path, outdir):
 
 
 def cvd_from_phase(phase, ifg, r_dist, calc_alpha, save_acg=False,
-                   params=None):
+                   params=None, spectrum=None, rbins=None):
     """
     A convenience function used to compute radial autocovariance from phase
     data
@@ -151,16 +259,37 @@ def cvd_from_phase(phase, ifg, r_dist, calc_alpha, save_acg=False,
                 data to numpy array file on disk
     :param dict params: [optional] Dictionary of configuration parameters;
                 Must be provided if save_acg=True
+    :param ndarray spectrum: [optional] Real fft (rfft2) of the phase data,
+                reused instead of computing the fft again
+    :param RadialBins rbins: [optional] Radial bins of r_dist (See
+                RDist.bins); computed from r_dist if not provided
 
     :return: maxvar: The maximum variance (at zero lag)
     :rtype: float
     :return: alpha: the exponential length-scale of decay factor
     :rtype: float
     """
+    maxvar, cvdav = _autocovariance(phase, ifg, r_dist, calc_alpha, save_acg,
+                                    params, spectrum, rbins)
+    if calc_alpha:
+        alpha = fit_alpha(cvdav[0], cvdav[1][np.newaxis],
+                          _alpha_method(params))
+        return maxvar, alpha[0]  # alpha unit 1/km
+    else:
+        return maxvar, None
+
+
+def _autocovariance(phase, ifg, r_dist, calc_alpha, save_acg, params,
+                    spectrum, rbins):
+    """
+    Helper function returning the maximum variance and, if calc_alpha, the
+    radially binned covariance function as an array of bin distances and
+    mean variances
+    """
     # pylint: disable=invalid-name
     # pylint: disable=too-many-locals
 
-    autocorr_grid = _get_autogrid(phase)
+    autocorr_grid = _get_autogrid(phase, spectrum)
     acg = reshape(autocorr_grid, phase.size, order='F')
     # Symmetry in image; keep only unique points
     # tmp = _unique_points(zip(acg, r_dist))
@@ -176,51 +305,158 @@ def cvd_from_phase(phase, ifg, r_dist, calc_alpha, save_acg=False,
     # eg. array([x for x in set([(1,1), (2,2), (1,1)])])
     # the above shortens r_dist by some number of cells
 
-    # pick the smallest axis to determine circle search radius
-    if (ifg.x_centre * ifg.x_size) < (ifg.y_centre * ifg.y_size):
-        maxdist = (ifg.x_centre+1) * ifg.x_size / DISTFACT
-    else:
-        maxdist = (ifg.y_centre+1) * ifg.y_size / DISTFACT
+    if rbins is None:
+        rbins = _radial_bins(r_dist, ifg)
 
     # filter out data where the of lag distance is greater than maxdist
-    # r_dist = array([e for e in rorig if e <= maxdist]) #
     # MG: prefers to use all the data
-    # acg = array([e for e in rorig if e <= maxdist])
-    indices_to_keep = r_dist < maxdist
-    acg = acg[indices_to_keep]
+    acg = acg[rbins.keep]
 
     # optionally save acg vs dist observations to disk
     if save_acg:
-        _save_cvd_data(acg, r_dist[indices_to_keep],
+        _save_cvd_data(acg, r_dist[rbins.keep],
                        ifg.data_path, params[cf.TMPDIR])
 
     if calc_alpha:
-        # bin width for collecting data
-        bin_width = max(ifg.x_size, ifg.y_size) * 2 / DISTFACT  # km
-        r_dist = r_dist[indices_to_keep]  # km
-        # classify values of r_dist according to bin number
-        rbin = ceil(r_dist / bin_width).astype(int)
-        maxbin = max(rbin) - 1  # consistent with Matlab code
-
+        maxbin = rbins.maxbin
         cvdav = zeros(shape=(2, maxbin + 1))
 
         # the following stays in numpy land
         # distance instead of bin number
-        cvdav[0, :] = np.multiply(range(maxbin + 1), bin_width)
-        # mean variance for the bins
-        cvdav[1, :] = [mean(acg[rbin == b]) for b in range(maxbin + 1)]
-        # calculate best fit function maxvar*exp(-alpha*r_dist)
-        alphaguess = 2 / (maxbin * bin_width)
-        alpha = fmin(_pendiffexp, x0=alphaguess, args=(cvdav,), disp=False,
-                     xtol=1e-6, ftol=1e-6)
-        log.info("1st guess alpha {}, converged "
-                 "alpha: {}".format(alphaguess, alpha))
+        cvdav[0, :] = np.multiply(range(maxbin + 1), rbins.bin_width)
+        # mean variance for the bins, summed in a single pass over acg
+        cvdav[1, :] = np.bincount(rbins.rbin, weights=acg,
+                                  minlength=maxbin + 1)[:maxbin + 1] / \
+            rbins.counts
         # maximum variance usually at the zero lag: max(acg[:len(r_dist)])
-        return np.max(acg), alpha[0]  # alpha unit 1/km
+        return np.max(acg), cvdav
     else:
         return np.max(acg), None
 
 
+def _alpha_method(params):
+    """
+    Convenience function returning the configured alpha fit method
+    """
+    return params.get(cf.COV_ALPHA_METHOD, 1) if params else 1
+
+
+def fit_alpha(dist, cvdavs, method=1):
+    """
+    Fit the exponential model maxvar*exp(-alpha*r_dist) to radially binned
+    covariance functions, where maxvar is the variance of the first bin.
+
+    :param ndarray dist: Array of bin distances in km, shape (nbins,)
+    :param ndarray cvdavs: Array of binned mean variances of one or more
+                covariance functions sharing the bins, shape (n, nbins)
+    :param int method: 1 = Nelder-Mead simplex for each covariance function
+                (the reference method); 2 = log-linear least squares initial
+                guess refined by Gauss-Newton iterations, vectorised over all
+                covariance functions
+
+    :return: alpha: the exponential length-scale of decay factor of each
+                covariance function (unit 1/km)
+    :rtype: ndarray
+    """
+    # the same first guess as Matlab Pirate
+    alphaguess = 2 / dist[-1]
+    if method == 1:
+        alpha = np.empty(len(cvdavs))
+        for i, cvdav in enumerate(cvdavs):
+            res = fmin(_pendiffexp, x0=alphaguess,
+                       args=(np.vstack([dist, cvdav]),), disp=False,
+                       xtol=1e-6, ftol=1e-6)
+            log.info("1st guess alpha {}, converged "
+                     "alpha: {}".format(alphaguess, res))
+            alpha[i] = res[0]
+        return alpha
+
+    alpha = _gauss_newton_alpha(dist, cvdavs, alphaguess)
+    log.info("Gauss-Newton alpha of {} covariance functions: "
+             "{}".format(len(cvdavs), alpha))
+    return alpha
+
+
+def _gauss_newton_alpha(dist, cvdavs, alphaguess):
+    """
+    Vectorised least squares fit of alpha in maxvar*exp(-alpha*r_dist), with
+    a log-linear initial guess and Gauss-Newton iterations with step halving
+    """
+    # pylint: disable=invalid-name
+    cvdavs = np.atleast_2d(cvdavs)
+    valid = np.isfinite(cvdavs)
+    y = np.where(valid, cvdavs, 0)
+    mx = y[:, :1]  # maxvar usually at zero lag
+    r = np.where(valid, dist, 0)
+
+    # log(y/mx) = -alpha*r for the bins with positive covariance
+    pos = valid & (y > 0) & (mx > 0)
+    logy = np.log(np.where(pos, y, 1) / np.where(mx > 0, mx, 1))
+    rpos = np.where(pos, dist, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        alpha = -np.sum(rpos * logy, axis=1) / np.sum(rpos ** 2, axis=1)
+    alpha = np.where(np.isfinite(alpha) & (alpha > 0), alpha, alphaguess)
+
+    cost = _alpha_cost(alpha, dist, y, mx, valid)
+    # covariance functions still being refined
+    idx = np.arange(len(alpha))
+    for _ in range(GN_MAX_ITERATIONS):
+        yi, mxi, vi = y[idx], mx[idx], valid[idx]
+        e = exp(-alpha[idx, np.newaxis] * dist)
+        res = np.where(vi, yi - mxi * e, 0)
+        jac = mxi * r[idx] * e  # derivative of the residuals wrt alpha
+        jtj = np.sum(jac ** 2, axis=1)
+        step = -np.sum(jac * res, axis=1) / np.where(jtj > 0, jtj, 1)
+        new_cost = _alpha_cost(alpha[idx] + step, dist, yi, mxi, vi)
+        # halve the steps that do not reduce the misfit
+        for _ in range(GN_MAX_HALVINGS):
+            worse = ~(new_cost <= cost[idx])
+            if not worse.any():
+                break
+            step[worse] /= 2
+            new_cost[worse] = _alpha_cost(alpha[idx][worse] + step[worse],
+                                          dist, yi[worse], mxi[worse],
+                                          vi[worse])
+        accept = new_cost <= cost[idx]
+        alpha[idx[accept]] += step[accept]
+        cost[idx[accept]] = new_cost[accept]
+        idx = idx[accept & (np.abs(step) > GN_TOLERANCE * np.abs(alpha[idx]))]
+        if not idx.size:
+            break
+    return alpha
+
+
+def _alpha_cost(alpha, dist, y, mx, valid):
+    """
+    Residual sum of squares of the exponential model of each covariance
+    function
+    """
+    return np.sum(np.where(valid, y - mx * exp(-alpha[:, np.newaxis] * dist),
+                           0) ** 2, axis=1)
+
+
+def _radial_bins(r_dist, ifg):
+    """
+    Helper function returning the lag distances retained for the covariance
+    function and their radial bin numbers, which only depend on the
+    interferogram geometry
+    """
+    # pick the smallest axis to determine circle search radius
+    if (ifg.x_centre * ifg.x_size) < (ifg.y_centre * ifg.y_size):
+        maxdist = (ifg.x_centre+1) * ifg.x_size / DISTFACT
+    else:
+        maxdist = (ifg.y_centre+1) * ifg.y_size / DISTFACT
+    keep = r_dist < maxdist
+
+    # bin width for collecting data
+    bin_width = max(ifg.x_size, ifg.y_size) * 2 / DISTFACT  # km
+    # classify values of r_dist according to bin number
+    rbin = ceil(r_dist[keep] / bin_width).astype(int)
+    maxbin = max(rbin) - 1  # consistent with Matlab code
+    counts = np.bincount(rbin, minlength=maxbin + 1)[:maxbin + 1]
+    return RadialBins(keep, rbin, counts, maxbin, bin_width)
+
+
 class RDist():
     """
     RDist class used for caching r_dist during maxvar/alpha computation
@@ -228,6 +464,7 @@ class RDist():
     # pylint: disable=invalid-name
     def __init__(self, ifg):
         self.r_dist = None
+        self.rbins = None
         self.ifg = ifg
         self.nrows, self.ncols = ifg.shape
 
@@ -250,36 +487,31 @@ class RDist():
 
         return self.r_dist
 
+    def bins(self):
+        """
+        Returns the radial bins of r_dist used to average the
+        autocorrelation, computed once for the interferogram geometry
+        """
+        if self.rbins is None:
+            self.rbins = _radial_bins(self(), self.ifg)
+        return self.rbins
+
 
-def _get_autogrid(phase):
+def _get_autogrid(phase, spectrum=None):
     """
     Helper function to assist with memory re-allocation during FFT calculation
     """
-    autocorr_grid = _calc_autoc_grid(phase)
+    if spectrum is None:
+        spectrum = rfft2(phase)
+    # the power spectrum is symmetric, so the real fft suffices
+    pspec = (real(spectrum) ** 2 + imag(spectrum) ** 2).astype(np.float32)
+    autocorr_grid = irfft2(pspec, s=phase.shape).astype(np.float32)
     nzc = np.sum(np.sum(phase != 0))
-    autocorr_grid = fftshift(real(autocorr_grid)) / nzc
+    autocorr_grid = fftshift(autocorr_grid) / nzc
     return autocorr_grid
 
 
-def _calc_autoc_grid(phase):
-    """
-    Helper function to assist with memory re-allocation during FFT calculation
-    """
-    pspec = _calc_power_spectrum(phase)
-    autocorr_grid = ifft2(pspec)
-    return autocorr_grid.astype(dtype=np.complex64)
-
-
-def _calc_power_spectrum(phase):
-    """
-    Helper function to assist with memory re-allocation during FFT calculation
-    """
-    fft_phase = fft2(phase)
-    pspec = real(fft_phase) ** 2 + imag(fft_phase) ** 2
-    return pspec.astype(dtype=np.float32)
-
-
-def get_vcmt(ifgs, maxvar):
+def get_vcmt(ifgs, maxvar, sparse=False):
     """
     Assembles a temporal variance/covariance matrix using the method
     described by Biggs et al., Geophys. J. Int, 2007. Matrix elements are
@@ -294,9 +526,11 @@ def get_vcmt(ifgs, maxvar):
     :param list ifgs: A list of pyrate.shared.Ifg class objects.
     :param ndarray maxvar: numpy array of maximum variance values for the
                 interferograms.
+    :param bool sparse: If True return a scipy.sparse CSR matrix holding
+                only the pairs of interferograms sharing an epoch
 
     :return: vcm_t: temporal variance-covariance matrix
-    :rtype: ndarray
+    :rtype: ndarray or scipy.sparse.csr_matrix
     """
     # pylint: disable=too-many-locals
     # c=0.5 for common master or slave; c=-0.5 if master
@@ -309,27 +543,49 @@ def get_vcmt(ifgs, maxvar):
         # pylint: disable=redefined-variable-type
         ifgs = ifgs.values()
 
+    ifgs = list(ifgs)
     nifgs = len(ifgs)
-    vcm_pat = zeros((nifgs, nifgs))
 
     dates = [ifg.master for ifg in ifgs] + [ifg.slave for ifg in ifgs]
     ids = master_slave_ids(dates)
+    mas = np.array([ids[ifg.master] for ifg in ifgs], dtype=int)
+    slv = np.array([ids[ifg.slave] for ifg in ifgs], dtype=int)
 
-    for i, ifg in enumerate(ifgs):
-        mas1, slv1 = ids[ifg.master], ids[ifg.slave]
-
-        for j, ifg2 in enumerate(ifgs):
-            mas2, slv2 = ids[ifg2.master], ids[ifg2.slave]
-            if mas1 == mas2 or slv1 == slv2:
-                vcm_pat[i, j] = 0.5
+    # make covariance matrix in time domain
+    std = sqrt(maxvar).reshape((nifgs, 1))
 
-            if mas1 == slv2 or slv1 == mas2:
-                vcm_pat[i, j] = -0.5
+    if sparse:
+        return _sparse_vcmt(mas, slv, len(ids), std)
 
-            if mas1 == mas2 and slv1 == slv2:
-                vcm_pat[i, j] = 1.0  # diagonal elements
+    mas1, mas2 = mas[:, np.newaxis], mas[np.newaxis, :]
+    slv1, slv2 = slv[:, np.newaxis], slv[np.newaxis, :]
+    vcm_pat = zeros((nifgs, nifgs))
+    vcm_pat[(mas1 == mas2) | (slv1 == slv2)] = 0.5
+    vcm_pat[(mas1 == slv2) | (slv1 == mas2)] = -0.5
+    vcm_pat[(mas1 == mas2) & (slv1 == slv2)] = 1.0  # diagonal elements
 
-    # make covariance matrix in time domain
-    std = sqrt(maxvar).reshape((nifgs, 1))
     vcm_t = std * std.transpose()
     return vcm_t * vcm_pat
+
+
+def _sparse_vcmt(mas, slv, nepochs, std):
+    """
+    Helper function assembling the temporal variance/covariance matrix as a
+    sparse matrix from the master and slave epoch ids of the interferograms
+    """
+    nifgs = len(mas)
+    rows = np.arange(nifgs)
+    ones = np.ones(nifgs)
+    # interferogram x epoch incidence of the master and slave epochs
+    inc_mas = csr_matrix((ones, (rows, mas)), shape=(nifgs, nepochs))
+    inc_slv = csr_matrix((ones, (rows, slv)), shape=(nifgs, nepochs))
+    # 0.5 for a common master or slave, 1 when both are common; a master
+    # can not also be the slave of the same interferogram, so the -0.5 pairs
+    # never share an epoch in the same role
+    vcm_pat = 0.5 * (inc_mas.dot(inc_mas.T) + inc_slv.dot(inc_slv.T))
+    opposite = inc_mas.dot(inc_slv.T) + inc_slv.dot(inc_mas.T)
+    opposite.data[:] = -0.5
+    vcm_pat = (vcm_pat + opposite).tocoo()
+    data = std[vcm_pat.row, 0] * std[vcm_pat.col, 0] * vcm_pat.data
+    return csr_matrix((data, (vcm_pat.row, vcm_pat.col)),
+                      shape=(nifgs, nifgs))
@@ -18,8 +18,11 @@ This Python module contains tools for reading GAMMA format input data.
 """
 # coding: utf-8
 
-#import os
+import os
+from os.path import join
+import re
 import datetime
+import glob2
 import numpy as np
 import pyrate.ifgconstants as ifc
 
@@ -36,6 +39,7 @@ GAMMA_FREQUENCY = 'radar_frequency'
 GAMMA_INCIDENCE = 'incidence_angle'
 RADIANS = 'RADIANS'
 GAMMA = 'GAMMA'
+PTN = re.compile(r'\d{8}')  # match 8 digits for the dates
 
 
 def _parse_header(path):
@@ -211,6 +215,26 @@ def manage_headers(dem_header_file, header_paths):
     return combined_header
 
 
+def get_header_paths(input_file, slc_dir=None):
+    """
+    Function that matches input GAMMA file names with GAMMA header file names
+
+    :param str input_file: input GAMMA .unw file.
+    :param str slc_dir: GAMMA SLC header file directory
+
+    :return: list of matching header files
+    :rtype: list
+    """
+    if slc_dir:
+        dir_name = slc_dir
+        _, file_name = os.path.split(input_file)
+    else:  # header file must exist in the same dir as that of .unw
+        dir_name, file_name = os.path.split(input_file)
+    matches = PTN.findall(file_name)
+    return [glob2.glob(join(dir_name, '**/*%s*slc.par' % m))[0]
+            for m in matches]
+
+
 class GammaException(Exception):
     """
     Gamma generic exception class
@@ -17,7 +17,8 @@
 This Python module implements pixel-by-pixel linear rate
 (velocity) estimation using an iterative weighted least-squares
 method. The algorithm is based on the Matlab Pirate package 'stack.m'
-and Matlab 'lscov.m' functions.
+and Matlab 'lscov.m' functions. Pixels sharing the same network of
+valid observations can optionally be solved together in batches.
 """
 # pylint: disable= invalid-name
 # pylint: disable= too-many-locals
@@ -28,6 +29,7 @@ from numpy import nan, isnan, sqrt, diag, delete, array, float32
 import numpy as np
 from joblib import Parallel, delayed
 from pyrate import config as cf
+from pyrate.algorithm import pattern_groups
 
 
 def linear_rate(ifgs, params, vcmt, mst=None):
@@ -50,9 +52,25 @@ def linear_rate(ifgs, params, vcmt, mst=None):
     maxsig, nsig, pthresh, cols, error, mst, obs, parallel, _, \
         rate, rows, samples, span = _linrate_setup(ifgs, mst, params)
 
+    if params[cf.LR_METHOD] == 2:
+        # pixels sharing a valid observation pattern are solved together
+        mst_flat = np.reshape(mst, (mst.shape[0], rows * cols))
+        obs_flat = np.reshape(obs, (obs.shape[0], rows * cols))
+        if parallel:
+            chunks = np.array_split(range(rows * cols), params[cf.PROCESSES])
+            res = Parallel(n_jobs=params[cf.PROCESSES], verbose=50)(
+                delayed(_linear_rate_by_pattern)(mst_flat[:, c], nsig,
+                                                 obs_flat[:, c], pthresh,
+                                                 span, vcmt)
+                for c in chunks)
+            res = [np.concatenate(r) for r in zip(*res)]
+        else:
+            res = _linear_rate_by_pattern(mst_flat, nsig, obs_flat, pthresh,
+                                          span, vcmt)
+        rate, error, samples = [r.reshape(rows, cols) for r in res]
     # pixel-by-pixel calculation.
     # nested loops to loop over the 2 image dimensions
-    if parallel == 1:
+    elif parallel == 1:
 
         res = Parallel(n_jobs=params[cf.PROCESSES], verbose=50)(
             delayed(_linear_rate_by_rows)(r, cols, mst, nsig, obs,
@@ -193,3 +211,74 @@ def _linear_rate_by_pixel(row, col, mst, nsig, obs, pthresh, span, vcmt):
             return v[0], err[0], ifgv.shape[0]
     # dummy return for no change
     return np.nan, np.nan, default_no_samples
+
+
+def _linear_rate_by_pattern(mst, nsig, obs, pthresh, span, vcmt):
+    """
+    Helper function for computing linear rate for a block of pixels.
+    Pixels are grouped by their current pattern of valid observations, the
+    VCM subset of each group is factorised once and all pixels of the group
+    are solved with stacked matrix operations. Pixels failing the nsig test
+    drop their worst observation and are regrouped in the next iteration.
+
+    :param ndarray mst: 2D boolean array of shape (nifgs, npixels)
+    :param int nsig: n-sigma ratio used to threshold residuals
+    :param ndarray obs: 2D array of observations of shape (nifgs, npixels)
+    :param int pthresh: Minimum number of observations for a pixel
+    :param ndarray span: Array of ifg time spans of shape (1, nifgs)
+    :param ndarray vcmt: Temporal variance covariance matrix
+
+    :return: rate, error, samples: 1D arrays of length npixels
+    :rtype: tuple
+    """
+    npix = obs.shape[1]
+    rate = np.empty(npix, dtype=float32) * nan
+    error = np.empty(npix, dtype=float32) * nan
+    active = mst != 0
+    samples = np.sum(active, axis=0).astype(float32)
+    todo = np.nonzero(samples >= pthresh)[0]
+
+    while todo.size:
+        patterns, _, inverse = pattern_groups(active[:, todo])
+        order = np.argsort(inverse, kind='mergesort')
+        groups = np.split(todo[order],
+                          np.cumsum(np.bincount(inverse))[:-1])
+        rejected = []
+        for pattern, pix in zip(patterns, groups):
+            ind = np.nonzero(pattern)[0]
+            ifgv = obs[ind][:, pix]
+            B = span[:, ind]
+            vcm_temp = vcmt[ind, np.vstack(ind)]
+
+            # lscov for all pixels of the group at once
+            T = cholesky(vcm_temp, 1)
+            A = solve(T, B.transpose())
+            b = solve(T, ifgv)
+            Q, R, _ = qr(A, mode='economic', pivoting=True)
+            z = Q.conj().transpose().dot(b)
+            v = solve(R, z)
+
+            # model error is common to all pixels of the group
+            err1 = inv(vcm_temp).dot(B.conj().transpose())
+            err2 = B.dot(err1)
+            err = sqrt(diag(inv(err2)))
+
+            # residuals and ratio to apriori variances, one column per pixel
+            r = (B.transpose() * v) - ifgv
+            w = cholesky(inv(vcm_temp))
+            wr = abs(np.dot(w, r))
+
+            accept = ~(wr.max(axis=0) > nsig)
+            rate[pix[accept]] = v[0, accept]
+            error[pix[accept]] = err[0]
+            samples[pix[accept]] = len(ind)
+
+            # discard the largest outlier and re-do these pixels
+            bad = ~accept
+            active[ind[wr[:, bad].argmax(axis=0)], pix[bad]] = False
+            rejected.append(pix[bad])
+
+        todo = np.concatenate(rejected)
+        todo = todo[np.sum(active[:, todo], axis=0) >= pthresh]
+
+    return rate, error, samples
@@ -14,29 +14,310 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 """
-This Python module contains MPI convenience functions for PyRate
+This Python module contains MPI convenience functions for PyRate. The
+communicator is MPI when launched with mpirun, an in-process serial
+communicator otherwise, or a communicator connecting local processes
+started with run_local.
 """
 # pylint: disable=no-member
 # pylint: disable=invalid-name
+# pylint: disable=global-statement
 import logging
+import multiprocessing
+import operator
+import os
 import pickle
-from mpi4py import MPI
+import time
+from collections import deque
+from functools import reduce
 import numpy as np
+from pyrate.compat import wait
 
 log = logging.getLogger(__name__)
-# We're having trouble with the MPI pickling and 64bit integers
-MPI.pickle.dumps = pickle.dumps
-MPI.pickle.loads = pickle.loads
 
-# module-level MPI 'world' object representing all connected nodes
-comm = MPI.COMM_WORLD
+# environment variables set by the common MPI launchers (Open MPI, MPICH,
+# Intel MPI and PMIx based launchers)
+_MPI_ENV = ['OMPI_COMM_WORLD_SIZE', 'PMI_SIZE', 'PMIX_RANK',
+            'MPI_LOCALNRANKS']
+# environment variable to choose the communicator: 'mpi' or 'serial'
+COMM_ENV = 'PYRATE_COMM'
+
+# source matching any process in recv
+ANY_SOURCE = -1
+
+# message tags used by the task scheduler
+_READY_TAG = 101
+_TASK_TAG = 102
+# message tag used by the collective operations of LocalComm
+_COLLECTIVE_TAG = -1
+
+
+class Status(object):
+    """
+    Status of a received message, the subset of MPI.Status used by PyRate
+    """
+    def __init__(self):
+        self.source = None
+
+    def Get_source(self):
+        """
+        :return: The rank of the process that sent the message
+        :rtype: int
+        """
+        return self.source
+
+
+class SerialComm(object):
+    """
+    In-process communicator of a single process. Collective operations
+    return their input without copying or pickling. There is no other
+    process to exchange messages with, so send/recv are not provided.
+    """
+    def Get_size(self):
+        """Number of processes"""
+        return 1
+
+    def Get_rank(self):
+        """Rank of this process"""
+        return 0
+
+    def barrier(self):
+        """Synchronise all processes"""
+
+    def bcast(self, obj, root=0):
+        """Broadcast obj from root to all processes"""
+        return obj
+
+    def gather(self, obj, root=0):
+        """Gather obj of all processes in a list on root"""
+        return [obj]
+
+    def allgather(self, obj):
+        """Gather obj of all processes in a list on all processes"""
+        return [obj]
+
+    def allreduce(self, obj, op=None):
+        """Reduce obj of all processes (sum by default) on all processes"""
+        return obj
+
+
+class LocalComm(object):
+    """
+    Communicator connecting processes on the local machine with pipes,
+    providing the subset of the mpi4py communicator used by PyRate without
+    an MPI installation. Collective operations go through the process of
+    rank 0. Objects are pickled and Send/Recv buffers copied.
+
+    :param int rank: Rank of this process
+    :param int size: Number of processes
+    :param dict conns: Connection to every other process by rank
+    """
+    def __init__(self, rank, size, conns):
+        self._rank = rank
+        self._size = size
+        self._conns = conns
+        self._ranks = {c: r for r, c in conns.items()}
+        # messages received while waiting for another source or tag
+        self._pending = {r: deque() for r in conns}
+
+    def Get_size(self):
+        """Number of processes"""
+        return self._size
+
+    def Get_rank(self):
+        """Rank of this process"""
+        return self._rank
+
+    def send(self, obj, dest, tag=0):
+        """Send obj to the process of rank dest"""
+        self._conns[dest].send((tag, obj))
+
+    def recv(self, source=ANY_SOURCE, tag=None, status=None):
+        """
+        Receive an object from the process of rank source, or from any
+        process. Messages with another tag are kept for a later recv.
+        """
+        sources = list(self._conns) if source == ANY_SOURCE else [source]
+        while True:
+            for r in sources:
+                for m, (t, obj) in enumerate(self._pending[r]):
+                    if tag is None or t == tag:
+                        del self._pending[r][m]
+                        if status is not None:
+                            status.source = r
+                        return obj
+            for conn in wait([self._conns[r] for r in sources]):
+                try:
+                    self._pending[self._ranks[conn]].append(conn.recv())
+                except EOFError:
+                    raise RuntimeError('Process {} exited'.format(
+                        self._ranks[conn]))
+
+    def Send(self, buf, dest, tag=0):
+        """Send the array buf to the process of rank dest"""
+        self.send(np.asarray(buf), dest, tag)
+
+    def Recv(self, buf, source=ANY_SOURCE, tag=None):
+        """Receive an array from the process of rank source into buf"""
+        buf[...] = self.recv(source, tag)
+
+    def gather(self, obj, root=0):
+        """Gather obj of all processes in a list on root"""
+        if self._rank != root:
+            self.send(obj, root, _COLLECTIVE_TAG)
+            return None
+        return [obj if r == root else self.recv(r, _COLLECTIVE_TAG)
+                for r in range(self._size)]
+
+    def bcast(self, obj, root=0):
+        """Broadcast obj from root to all processes"""
+        if self._rank != root:
+            return self.recv(root, _COLLECTIVE_TAG)
+        for r in self._conns:
+            self.send(obj, r, _COLLECTIVE_TAG)
+        return obj
+
+    def barrier(self):
+        """Synchronise all processes"""
+        self.gather(None)
+        self.bcast(None)
+
+    def allgather(self, obj):
+        """Gather obj of all processes in a list on all processes"""
+        return self.bcast(self.gather(obj))
+
+    def allreduce(self, obj, op=None):
+        """
+        Reduce obj of all processes on all processes with op, a function
+        of two arguments, summing by default
+        """
+        objs = self.gather(obj)
+        if self._rank == 0:
+            obj = reduce(op or operator.add, objs)
+        return self.bcast(obj)
+
+    def close(self):
+        """Close the connections to the other processes"""
+        for conn in self._conns.values():
+            conn.close()
+
+
+def _mpi_comm():
+    """
+    MPI 'world' communicator representing all connected nodes. mpi4py is
+    only imported here as MPI initialisation is slow.
+    """
+    from mpi4py import MPI
+    # We're having trouble with the MPI pickling and 64bit integers
+    MPI.pickle.dumps = pickle.dumps
+    MPI.pickle.loads = pickle.loads
+    return MPI.COMM_WORLD
+
+
+def _default_comm():
+    """
+    MPI when launched with mpirun or chosen with the PYRATE_COMM
+    environment variable, the serial communicator otherwise
+    """
+    choice = os.environ.get(COMM_ENV)
+    if choice == 'mpi' or (choice is None and
+                           any(e in os.environ for e in _MPI_ENV)):
+        return _mpi_comm()
+    return SerialComm()
+
+
+def use(communicator):
+    """
+    Make communicator the communicator of this process
+
+    :param communicator: Communicator, MPI.COMM_WORLD, SerialComm or LocalComm
+    """
+    global comm, size, rank
+    comm = communicator
+    size = comm.Get_size()
+    rank = comm.Get_rank()
+
+
+# module-level communicator object representing all connected processes
+comm = None
 
 # int: the total number of nodes in the MPI world
-size = comm.Get_size()
+size = 1
 
 # int: the index (from zero) of this node in the MPI world. Also known as
 # the rank of the node.
-rank = comm.Get_rank()
+rank = 0
+
+use(_default_comm())
+
+
+def _run_local_process(r, nprocs, ends, f, args, kwargs):
+    """
+    Entry point of the local process of rank r
+    """
+    _close_ends(ends, keep=r)
+    use(LocalComm(r, nprocs, ends[r]))
+    f(*args, **kwargs)
+
+
+def _close_ends(ends, keep):
+    """
+    Close the pipe ends of all processes but keep, so that a process exiting
+    closes its pipes
+    """
+    for r, conns in enumerate(ends):
+        if r != keep:
+            for conn in conns.values():
+                conn.close()
+
+
+def run_local(nprocs, f, *args, **kwargs):
+    """
+    Run f on nprocs processes of the local machine connected by LocalComm,
+    for multi-process runs without MPI. This process becomes the process of
+    rank 0 while f runs.
+
+    :param int nprocs: Number of processes
+    :param function f: The function to be run on every process
+    :param args: Other positional arguments to pass on to f (optional)
+    :param kwargs: Other named arguments to pass on to f (optional)
+
+    :return: The value returned by f on the process of rank 0
+    :rtype: unknown
+    """
+    if nprocs <= 1:
+        return f(*args, **kwargs)
+    if size > 1:
+        raise RuntimeError('run_local can not be used in a run with more '
+                           'than one process')
+    ends = [{} for _ in range(nprocs)]
+    for i in range(nprocs):
+        for j in range(i + 1, nprocs):
+            ends[i][j], ends[j][i] = multiprocessing.Pipe()
+    procs = [multiprocessing.Process(target=_run_local_process,
+                                     args=(r, nprocs, ends, f, args, kwargs))
+             for r in range(1, nprocs)]
+    for p in procs:
+        p.start()
+    _close_ends(ends, keep=0)
+    previous = comm
+    local = LocalComm(0, nprocs, ends[0])
+    use(local)
+    try:
+        result = f(*args, **kwargs)
+    except BaseException:
+        for p in procs:
+            p.terminate()
+        raise
+    finally:
+        use(previous)
+        local.close()
+    for p in procs:
+        p.join()
+    failed = [r for r, p in enumerate(procs, 1) if p.exitcode != 0]
+    if failed:
+        raise RuntimeError('Processes {} failed'.format(failed))
+    return result
 
 
 def run_once(f, *args, **kwargs):
@@ -51,6 +332,8 @@ def run_once(f, *args, **kwargs):
     :return: The value returned by f.
     :rtype: unknown
     """
+    if size == 1:
+        return f(*args, **kwargs)
     if rank == 0:
         f_result = f(*args, **kwargs)
     else:
@@ -72,3 +355,86 @@ def array_split(arr, process=None):
     """
     r = process if process else rank
     return np.array_split(arr, size)[r]
+
+
+def schedule(tasks, costs=None):
+    """
+    Generator handing out tasks to MPI processes on demand, the most costly
+    tasks first. Every task is yielded by exactly one process. When running
+    on more than one process, the master process only hands out tasks and
+    yields none itself. All processes must exhaust the generator, which
+    returns when all tasks are finished and logs the time each process spent
+    busy with its tasks and idle waiting for work.
+
+    :param list tasks: Tasks to be distributed
+    :param list costs: Estimated cost of each task used to order the tasks
+                (optional)
+
+    :return: Tasks to be processed by this process
+    :rtype: generator
+    """
+    if costs is None:
+        order = list(range(len(tasks)))
+    else:
+        order = [int(i) for i in
+                 np.argsort(-np.asarray(costs), kind='mergesort')]
+    busy = idle = 0.0
+
+    if size == 1:
+        for i in order:
+            start = time.time()
+            yield tasks[i]
+            busy += time.time() - start
+    elif rank == 0:  # pragma: no cover
+        pending = deque(order)
+        status = _status()
+        workers = size - 1
+        while workers:
+            start = time.time()
+            comm.recv(source=_any_source(), tag=_READY_TAG,
+                      status=status)
+            idle += time.time() - start
+            task = pending.popleft() if pending else None
+            if task is None:
+                workers -= 1
+            comm.send(task, dest=status.Get_source(), tag=_TASK_TAG)
+    else:  # pragma: no cover
+        while True:
+            start = time.time()
+            comm.send(None, dest=0, tag=_READY_TAG)
+            task = comm.recv(source=0, tag=_TASK_TAG)
+            idle += time.time() - start
+            if task is None:
+                break
+            start = time.time()
+            yield tasks[task]
+            busy += time.time() - start
+
+    start = time.time()
+    comm.barrier()
+    idle += time.time() - start
+    times = comm.gather((busy, idle), root=0)
+    if rank == 0:
+        for r, (b, i) in enumerate(times):
+            log.info('Process {} busy for {:.1f}s and idle for {:.1f}s'.format(
+                r, b, i))
+
+
+def _status():
+    """
+    Status object of the communicator for recv
+    """
+    if isinstance(comm, LocalComm):
+        return Status()
+    from mpi4py import MPI
+    return MPI.Status()
+
+
+def _any_source():
+    """
+    Source matching any process in recv of the communicator
+    """
+    if isinstance(comm, LocalComm):
+        return ANY_SOURCE
+    from mpi4py import MPI
+    return MPI.ANY_SOURCE
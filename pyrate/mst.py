@@ -16,6 +16,10 @@
 """
 This Python module implements the minimum spanning tree
 functionality for selecting interferometric observations.
+
+Two engines are available: the NetworkX engine computes the tree pixel by
+pixel, while the NumPy engine runs a vectorised Kruskal's algorithm for all
+distinct NaN patterns of a block of pixels at once.
 """
 # pylint: disable=invalid-name
 from __future__ import print_function
@@ -23,11 +27,11 @@ import logging
 from itertools import product
 from numpy import array, nan, isnan, float32, empty, sum as nsum
 import numpy as np
-import networkx as nx
 from joblib import Parallel, delayed
 
 from pyrate.algorithm import ifg_date_lookup
 from pyrate.algorithm import ifg_date_index_lookup
+from pyrate.algorithm import pattern_groups
 from pyrate import config as cf
 from pyrate.shared import IfgPart, create_tiles
 np.seterr(invalid='ignore')  # stops RuntimeWarning in nan conversion
@@ -55,7 +59,7 @@ def mst_from_ifgs(ifgs):
     :return: mst_ifgs: Minimum Spanning Tree network of interferograms
     :rtype: list
     """
-
+    import networkx as nx  # networkx is slow to import
     edges_with_weights_for_networkx = [(i.master, i.slave, i.nan_fraction)
                                        for i in ifgs]
     g_nx = _build_graph_networkx(edges_with_weights_for_networkx)
@@ -91,12 +95,13 @@ def mst_parallel(ifgs, params):
     # gdal read is very fast
     ifg_paths = [i.data_path for i in ifgs]
     result = empty(shape=(no_ifgs, no_y, no_x), dtype=np.bool)
+    method = params[cf.NETWORKX_OR_MATLAB_FLAG]
 
     if params[cf.PARALLEL]:
         log.info('Calculating MST using {} tiles in parallel using {} ' \
                  'processes'.format(no_tiles, ncpus))
         t_msts = Parallel(n_jobs=params[cf.PROCESSES], verbose=50)(
-            delayed(mst_multiprocessing)(t, ifg_paths)
+            delayed(mst_multiprocessing)(t, ifg_paths, method=method)
             for t in tiles)
         for k, tile in enumerate(tiles):
             result[:, tile.top_left_y:tile.bottom_right_y,
@@ -106,12 +111,12 @@ def mst_parallel(ifgs, params):
         for k, tile in enumerate(tiles):
             result[:, tile.top_left_y:tile.bottom_right_y,
                    tile.top_left_x: tile.bottom_right_x] = \
-                mst_multiprocessing(tile, ifg_paths)
+                mst_multiprocessing(tile, ifg_paths, method=method)
 
     return result
 
 
-def mst_multiprocessing(tile, ifgs_or_paths, preread_ifgs=None):
+def mst_multiprocessing(tile, ifgs_or_paths, preread_ifgs=None, method=1):
     """
     Wrapper function for calculating MST matrix for a tile
 
@@ -119,6 +124,7 @@ def mst_multiprocessing(tile, ifgs_or_paths, preread_ifgs=None):
     :param list ifgs_or_paths: All interferograms paths of the problem.
         List of strings
     :param dict preread_ifgs: Dictionary of interferogram metadata
+    :param int method: MST engine, 1 = NetworkX, 2 = NumPy
 
     :return: mst_tile: MST matrix tile. An array of booleans representing
         valid ifg connections
@@ -131,28 +137,33 @@ def mst_multiprocessing(tile, ifgs_or_paths, preread_ifgs=None):
     #of interferograms increases
 
     ifg_parts = [IfgPart(p, tile, preread_ifgs) for p in ifgs_or_paths]
-    return mst_boolean_array(ifg_parts)
+    return mst_boolean_array(ifg_parts, method)
 
 
 def _build_graph_networkx(edges_with_weights):
     """
     Convenience graph builder function: returns a new graph object.
     """
+    import networkx as nx
     g = nx.Graph()
     g.add_weighted_edges_from(edges_with_weights)
     return g
 
 
-def mst_boolean_array(ifgs):
+def mst_boolean_array(ifgs, method=1):
     """
     Returns a 3D array of booleans constituting valid interferogram connections
     in the Minimum Spanning Tree matrix.
 
     :param list ifgs: Sequence of interferogram objects
+    :param int method: MST engine, 1 = NetworkX, 2 = NumPy
 
     :return: result: Array of booleans representing valid ifg connections
     :rtype: ndarray
     """
+    if method == 2:
+        return mst_matrix_numpy(ifgs)
+
     #The MSTs are stripped of connecting edge info, leaving just the ifgs.
     nifgs = len(ifgs)
     ny, nx = ifgs[0].phase_data.shape
@@ -220,6 +231,7 @@ def mst_matrix_networkx(ifgs):
     # make default MST to optimise result when no Ifg cells in a stack are nans
     edges_with_weights = [(i.master, i.slave, i.nan_fraction) for i in ifgs]
     edges, g_nx = _minimum_spanning_edges_from_mst(edges_with_weights)
+    import networkx as nx
 
     # TODO: memory efficiencies can be achieved here with tiling
     data_stack = array([i.phase_data for i in ifgs], dtype=float32)
@@ -257,10 +269,79 @@ def mst_matrix_networkx(ifgs):
         yield y, x, nx.minimum_spanning_tree(g_nx).edges()
 
 
+def mst_matrix_numpy(ifgs):
+    """
+    Returns a 3D array of booleans constituting valid interferogram connections
+    in the Minimum Spanning Tree matrix, computed with a vectorised NumPy
+    implementation of Kruskal's algorithm. The tree is computed once for each
+    distinct pattern of NaN values in the stack and shared by all pixels
+    with that pattern.
+
+    Edges are weighted by the ifg NaN fraction as in the NetworkX engine.
+    Where several ifgs have equal weights the two engines may select
+    different, but equally minimal, trees.
+
+    :param list ifgs: Sequence of interferogram objects
+
+    :return: result: Array of booleans representing valid ifg connections
+    :rtype: ndarray
+    """
+    nifgs = len(ifgs)
+    ny, nx = ifgs[0].phase_data.shape
+    valid = empty(shape=(nifgs, ny, nx), dtype=np.bool)
+    for k, i in enumerate(ifgs):
+        valid[k] = ~isnan(i.phase_data)
+
+    dates = [i.master for i in ifgs] + [i.slave for i in ifgs]
+    _, epoch_index = np.unique(array(dates), return_inverse=True)
+    weights = array([i.nan_fraction for i in ifgs], dtype=np.float64).ravel()
+
+    patterns, _, inverse = pattern_groups(valid)
+    log.debug('Calculating MST for {} NaN patterns in {} pixels'.format(
+        len(patterns), ny * nx))
+    trees = _kruskal_masks(patterns, epoch_index[:nifgs],
+                           epoch_index[nifgs:], weights)
+    return np.reshape(trees[inverse].T, (nifgs, ny, nx))
+
+
+def _kruskal_masks(valid, master_index, slave_index, weights):
+    """
+    Kruskal's algorithm for many networks at once. Each row of 'valid'
+    selects the ifgs (edges) available in one network. Connected components
+    are tracked as an array of epoch labels per network; edges are visited in
+    order of increasing weight and kept wherever they join two components.
+
+    :param ndarray valid: (npatterns, nifgs) boolean array of available edges
+    :param ndarray master_index: Epoch index of each ifg master date
+    :param ndarray slave_index: Epoch index of each ifg slave date
+    :param ndarray weights: Edge weight of each ifg
+
+    :return: tree: (npatterns, nifgs) boolean array of MST edges
+    :rtype: ndarray
+    """
+    npatterns, nifgs = valid.shape
+    nepochs = max(master_index.max(), slave_index.max()) + 1
+    labels = np.tile(np.arange(nepochs), (npatterns, 1))
+    tree = np.zeros((npatterns, nifgs), dtype=np.bool)
+
+    for k in np.argsort(weights, kind='mergesort'):
+        master = labels[:, master_index[k]]
+        slave = labels[:, slave_index[k]]
+        join = valid[:, k] & (master != slave)
+        if not join.any():
+            continue
+        tree[join, k] = True
+        # merge the slave component into the master component
+        merge = labels[join] == slave[join, np.newaxis]
+        labels[join] = np.where(merge, master[join, np.newaxis], labels[join])
+    return tree
+
+
 def _minimum_spanning_edges_from_mst(edges):
     """
     Convenience function to determine MST edges
     """
+    import networkx as nx
     g_nx = _build_graph_networkx(edges)
     T = nx.minimum_spanning_tree(g_nx)  # step ifglist_mst in make_mstmat.m
     edges = T.edges()
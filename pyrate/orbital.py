@@ -18,16 +18,16 @@ This Python module implements residual orbital corrections for interferograms.
 """
 # pylint: disable=invalid-name
 import logging
-from collections import OrderedDict
-from numpy import empty, isnan, reshape, float32, squeeze
-from numpy import dot, vstack, zeros, meshgrid
+from collections import OrderedDict, namedtuple
+from numpy import empty, isnan, reshape, float32
+from numpy import dot, zeros, meshgrid
 import numpy as np
 from numpy.linalg import pinv
-# from joblib import Parallel, delayed
-from scipy.linalg import lstsq
+from joblib import Parallel, delayed
+from scipy.linalg import lstsq, qr, solve_triangular
 
 from pyrate.algorithm import master_slave_ids, get_all_epochs
-from pyrate import mst, shared, prepifg
+from pyrate import mst, shared, prepifg, mpiops
 from pyrate.shared import nanmedian, Ifg
 from pyrate import config as cf
 from pyrate import ifgconstants as ifc
@@ -69,8 +69,17 @@ PLANAR = cf.PLANAR
 QUADRATIC = cf.QUADRATIC
 PART_CUBIC = cf.PART_CUBIC
 
+# master and slave dates and nan fraction of an interferogram of the network
+# method, with its index in the list of all interferograms
+_NetworkEdge = namedtuple('_NetworkEdge', ['index', 'master', 'slave',
+                                           'nan_fraction'])
 
-def remove_orbital_error(ifgs, params, preread_ifgs=None):
+# design matrix of the independent method and its QR factorisation, reused
+# by ifgs of the same geometry, with the normal matrix of the last nan mask
+_INDEPENDENT_DM = {}
+
+
+def remove_orbital_error(ifgs, params, preread_ifgs=None, distributed=False):
     """
     Wrapper function for PyRate orbital error removal functionality.
 
@@ -82,17 +91,19 @@ def remove_orbital_error(ifgs, params, preread_ifgs=None):
     :param dict params: Dictionary containing configuration parameters
     :param dict preread_ifgs: Dictionary containing information specifically
         for MPI jobs (optional)
+    :param bool distributed: True if ifgs is this MPI process's share of the
+        interferograms; the network method then combines the shares of all
+        processes (optional)
 
     :return: None - interferogram phase data is updated and saved to disk
     """
 
     ifg_paths = [i.data_path for i in ifgs] \
-        if isinstance(ifgs[0], Ifg) else ifgs
+        if len(ifgs) and isinstance(ifgs[0], Ifg) else ifgs
 
     mlooked = None
 
     # mlooking is not necessary for independent correction
-    # can use multiple procesing if write_to_disc=True
     if params[cf.ORBITAL_FIT_METHOD] == NETWORK_METHOD:
         mlooked_dataset = prepifg.prepare_ifgs(
             ifg_paths,
@@ -100,7 +111,7 @@ def remove_orbital_error(ifgs, params, preread_ifgs=None):
             xlooks=params[cf.ORBITAL_FIT_LOOKS_X],
             ylooks=params[cf.ORBITAL_FIT_LOOKS_Y],
             thresh=params[cf.NO_DATA_AVERAGING_THRESHOLD],
-            write_to_disc=False)
+            write_to_disc=False) if len(ifg_paths) else []
         mlooked = [Ifg(m[1]) for m in mlooked_dataset]
 
         for m in mlooked:
@@ -110,11 +121,11 @@ def remove_orbital_error(ifgs, params, preread_ifgs=None):
             m.convert_to_mm()
 
     _orbital_correction(ifgs, params, mlooked=mlooked,
-                        preread_ifgs=preread_ifgs)
+                        preread_ifgs=preread_ifgs, distributed=distributed)
 
 
 def _orbital_correction(ifgs_or_ifg_paths, params, mlooked=None, offset=True,
-                        preread_ifgs=None):
+                        preread_ifgs=None, distributed=False):
     """
     Convenience function to perform orbital correction.
     """
@@ -133,20 +144,26 @@ def _orbital_correction(ifgs_or_ifg_paths, params, mlooked=None, offset=True,
         if mlooked is None:
             network_orbital_correction(ifgs_or_ifg_paths, degree, offset,
                                        params, m_ifgs=mlooked,
-                                       preread_ifgs=preread_ifgs)
+                                       preread_ifgs=preread_ifgs,
+                                       distributed=distributed)
         else:
             _validate_mlooked(mlooked, ifgs_or_ifg_paths)
             network_orbital_correction(ifgs_or_ifg_paths, degree, offset,
-                                       params, mlooked, preread_ifgs)
+                                       params, mlooked, preread_ifgs,
+                                       distributed)
 
     elif method == INDEPENDENT_METHOD:
-        # not running in parallel
-        # raises swig object pickle error
-        # Parallel(n_jobs=params[cf.PROCESSES], verbose=50)(
-        #     delayed(_independent_correction)(ifg, degree, offset, params)
-        #     for ifg in ifgs)
-        for ifg in ifgs_or_ifg_paths:
-            independent_orbital_correction(ifg, degree, offset, params)
+        # Ifg objects raise a swig object pickle error, so only paths are
+        # corrected in parallel
+        if params.get(cf.PARALLEL) and \
+                all(isinstance(i, str) for i in ifgs_or_ifg_paths):
+            Parallel(n_jobs=params[cf.PROCESSES], verbose=50)(
+                delayed(independent_orbital_correction)(ifg, degree, offset,
+                                                        params)
+                for ifg in ifgs_or_ifg_paths)
+        else:
+            for ifg in ifgs_or_ifg_paths:
+                independent_orbital_correction(ifg, degree, offset, params)
     else:
         msg = "Unknown method: '%s', need INDEPENDENT or NETWORK method"
         raise OrbitalError(msg % method)
@@ -194,25 +211,22 @@ def independent_orbital_correction(ifg, degree, offset, params):
 
     Warning: This will write orbital error corrected phase_data to the ifg.
 
-    :param Ifg class instance ifg: the interferogram to be corrected
+    :param Ifg class instance ifg: the interferogram, or its path, to be
+        corrected
     :param str degree: model to fit (PLANAR / QUADRATIC / PART_CUBIC)
     :param bool offset: True to calculate the model using an offset
     :param dict params: dictionary of configuration parameters
 
     :return: None - interferogram phase data is updated and saved to disk
     """
-    ifg = shared.Ifg(ifg) if isinstance(ifg, str) else ifg
-    if not ifg.is_open:
+    if isinstance(ifg, str):
+        ifg = shared.open_ifg_for_correction(ifg, params)
+    elif not ifg.is_open:
         ifg.open()
     shared.nan_and_mm_convert(ifg, params)
     # vectorise, keeping NODATA
     vphase = reshape(ifg.phase_data, ifg.num_cells)
-    dm = get_design_matrix(ifg, degree, offset)
-
-    # filter NaNs out before getting model
-    clean_dm = dm[~isnan(vphase)]
-    data = vphase[~isnan(vphase)]
-    model = lstsq(clean_dm, data)[0]  # first arg is the model params
+    dm, model = _independent_fit(ifg, degree, offset, vphase)
 
     # calculate forward model & morph back to 2D
     if offset:
@@ -229,8 +243,63 @@ def independent_orbital_correction(ifg, degree, offset, params):
         ifg.close()
 
 
+def _independent_fit(ifg, degree, offset, vphase):
+    """
+    Convenience function returning the cached design matrix for the
+    geometry of the ifg and the least squares model fitted to the valid
+    cells of vphase.
+
+    The design matrix dm = Q R is factorised once per geometry. The valid
+    rows of dm then have the normal matrix R^T G R, where the small matrix G
+    is computed from whichever of the valid or NaN rows are fewer, so the fit
+    only needs one pass over dm for each ifg.
+
+    The cached dm stays float32 like get_design_matrix; R is computed from a
+    transient float64 copy and only the row subsets used are cast to float64.
+    """
+    key = (ifg.shape, ifg.x_size, ifg.y_size, degree, offset)
+    if _INDEPENDENT_DM.get('key') != key:
+        _INDEPENDENT_DM.clear()
+        dm = get_design_matrix(ifg, degree, offset)
+        r = qr(np.asfortranarray(dm, dtype=np.float64), mode='r',
+               overwrite_a=True)[0][:dm.shape[1]]
+        _INDEPENDENT_DM.update(key=key, dm=dm, r=r)
+    dm, r = _INDEPENDENT_DM['dm'], _INDEPENDENT_DM['r']
+
+    valid = ~isnan(vphase)
+    if not np.array_equal(_INDEPENDENT_DM.get('mask'), valid):
+        if 2 * np.count_nonzero(valid) >= valid.size:
+            w = solve_triangular(r, dm[~valid].T.astype(np.float64),
+                                 trans='T')
+            gram = np.eye(len(r)) - w.dot(w.T)
+        else:
+            w = solve_triangular(r, dm[valid].T.astype(np.float64),
+                                 trans='T')
+            gram = w.dot(w.T)
+        _INDEPENDENT_DM.update(mask=valid, gram=gram,
+                               cond=np.linalg.cond(gram))
+    gram = _INDEPENDENT_DM['gram']
+
+    if _INDEPENDENT_DM['cond'] > 1e10:  # too few valid cells, rank deficient
+        return dm, lstsq(dm[valid], vphase[valid])[0]
+    rhs = solve_triangular(r, _dm_t_dot(dm, np.where(valid, vphase, 0)),
+                           trans='T')
+    return dm, solve_triangular(r, np.linalg.solve(gram, rhs))
+
+
+def _dm_t_dot(dm, vec, rows=65536):
+    """
+    Convenience function returning dm.T.dot(vec) accumulated in float64, a
+    block of rows of the float32 design matrix at a time
+    """
+    out = np.zeros(dm.shape[1], dtype=np.float64)
+    for i in range(0, dm.shape[0], rows):
+        out += dm[i:i + rows].T.astype(np.float64).dot(vec[i:i + rows])
+    return out
+
+
 def network_orbital_correction(ifgs, degree, offset, params, m_ifgs=None,
-                               preread_ifgs=None):
+                               preread_ifgs=None, distributed=False):
     """
     This algorithm implements a network inversion to determine orbital
     corrections for a set of interferograms forming a connected network.
@@ -246,39 +315,58 @@ def network_orbital_correction(ifgs, degree, offset, params, m_ifgs=None,
         (sequence must be multilooked versions of 'ifgs' arg)
     :param dict preread_ifgs: Dictionary containing information specifically
         for MPI jobs (optional)
+    :param bool distributed: True if ifgs and m_ifgs are this MPI process's
+        share of the interferograms. The normal equations of the shares are
+        summed over all processes and each process corrects its own share.
 
     :return: None - interferogram phase data is updated and saved to disk
     """
     # pylint: disable=too-many-locals, too-many-arguments
     src_ifgs = ifgs if m_ifgs is None else m_ifgs
-    src_ifgs = mst.mst_from_ifgs(src_ifgs)[3]  # use networkx mst
-
-    vphase = vstack([i.phase_data.reshape((i.num_cells, 1)) for i in src_ifgs])
-    vphase = squeeze(vphase)
-
-    B = get_network_design_matrix(src_ifgs, degree, offset)
 
-    # filter NaNs out before getting model
-    B = B[~isnan(vphase)]
-    orbparams = dot(pinv(B, 1e-6), vphase[~isnan(vphase)])
+    # the network of all interferograms, in process order when distributed
+    edges = [(i.master, i.slave, i.nan_fraction) for i in src_ifgs]
+    first = 0
+    if distributed:
+        all_edges = mpiops.comm.allgather(edges)
+        first = sum(len(e) for e in all_edges[:mpiops.rank])
+        edges = [e for process_edges in all_edges for e in process_edges]
+    edges = [_NetworkEdge(k, *e) for k, e in enumerate(edges)]
+    mst_edges = mst.mst_from_ifgs(edges)[3]  # use networkx mst
+    # this process's ifgs in the mst and their position in the mst
+    mst_ifgs = [(src_ifgs[e.index - first], k) for k, e in enumerate(mst_edges)
+                if first <= e.index < first + len(src_ifgs)]
+
+    # minimum norm least squares solution of the network design matrix
+    # B via the normal equations: pinv(B) = pinv(B^T B) B^T, where the
+    # singular values of B^T B are squared
+    BTB, BTd = _network_normal_equations(mst_ifgs, mst_edges, degree, offset)
+    if distributed:
+        BTB = mpiops.comm.allreduce(BTB)
+        BTd = mpiops.comm.allreduce(BTd)
+    orbparams = dot(pinv(BTB, 1e-6 ** 2), BTd)
+    if distributed:
+        orbparams = mpiops.comm.bcast(orbparams, root=0)
 
     ncoef = _get_num_params(degree)
     if preread_ifgs:
         temp_ifgs = OrderedDict(sorted(preread_ifgs.items())).values()
         ids = master_slave_ids(get_all_epochs(temp_ifgs))
     else:
-        ids = master_slave_ids(get_all_epochs(ifgs))
+        ids = master_slave_ids(get_all_epochs(edges))
     coefs = [orbparams[i:i+ncoef] for i in
              range(0, len(set(ids)) * ncoef, ncoef)]
 
+    if not len(ifgs):
+        return
+
     # create full res DM to expand determined coefficients into full res
     # orbital correction (eg. expand coarser model to full size)
 
     if preread_ifgs:
-        temp_ifg = Ifg(ifgs[0])  # ifgs here are paths
-        temp_ifg.open()
-        dm = get_design_matrix(temp_ifg, degree, offset=False)
-        temp_ifg.close()
+        # ifgs here are paths
+        dm = get_design_matrix(shared.raster_header(ifgs[0]), degree,
+                               offset=False)
     else:
         dm = get_design_matrix(ifgs[0], degree, offset=False)
 
@@ -286,8 +374,7 @@ def network_orbital_correction(ifgs, degree, offset, params, m_ifgs=None,
         # open if not Ifg instance
         if isinstance(i, str):  # pragma: no cover
             # are paths
-            i = Ifg(i)
-            i.open(readonly=False)
+            i = shared.open_ifg_for_correction(i, params)
             shared.nan_and_mm_convert(i, params)
         _remove_network_orb_error(coefs, dm, i, ids, offset)
 
@@ -315,7 +402,7 @@ def _save_orbital_error_corrected_phase(ifg):
     orbital fit correction
     """
     # set orbfit tags after orbital error correction
-    ifg.dataset.SetMetadataItem(ifc.PYRATE_ORBITAL_ERROR, ifc.ORB_REMOVED)
+    ifg.meta_data[ifc.PYRATE_ORBITAL_ERROR] = ifc.ORB_REMOVED
     ifg.write_modified_phase()
     ifg.close()
 
@@ -429,6 +516,91 @@ def get_network_design_matrix(ifgs, degree, offset):
     return netdm
 
 
+def get_network_normal_equations(ifgs, degree, offset):
+    """
+    Returns the normal equations B^T B and B^T d of the network orbital error
+    inversion, where B is the network design matrix with the rows of NaN
+    cells removed (See get_network_design_matrix) and d the observed phase.
+    The equations are accumulated one interferogram at a time, so memory
+    scales with the number of model parameters rather than the number of
+    observations.
+
+    :param list ifgs: List of Ifg class objects
+    :param str degree: model to fit (PLANAR / QUADRATIC / PART_CUBIC)
+    :param bool offset: True to include offset parameters, otherwise False.
+
+    :return: BTB: normal matrix, shape (nparams, nparams)
+    :rtype: ndarray
+    :return: BTd: right hand side, shape (nparams,)
+    :rtype: ndarray
+    """
+    return _network_normal_equations(list(zip(ifgs, range(len(ifgs)))), ifgs,
+                                     degree, offset)
+
+
+def _network_normal_equations(ifgs, network, degree, offset):
+    # pylint: disable=too-many-locals
+    """
+    Accumulates the normal equations of a subset of the network ifgs, given
+    as (ifg, position in network) pairs. The network is the full list of
+    ifgs (or objects with their master and slave dates) defining the
+    parameters.
+    """
+    if degree not in [PLANAR, QUADRATIC, PART_CUBIC]:
+        raise OrbitalError("Invalid degree argument")
+
+    nifgs = len(network)
+    if nifgs < 1:
+        # can feasibly do correction on a single Ifg/2 epochs
+        raise OrbitalError("Invalid number of Ifgs: %s" % nifgs)
+
+    nepochs = len(set(get_all_epochs(network)))
+    ncoef = _get_num_params(degree)
+    nparams = ncoef * nepochs + (nifgs if offset else 0)
+    BTB = zeros((nparams, nparams))
+    BTd = zeros(nparams)
+    if not ifgs:
+        return BTB, BTd
+
+    dates = [ifg.master for ifg in network] + [ifg.slave for ifg in network]
+    ids = master_slave_ids(dates)
+    offset_col = nepochs * ncoef  # base offset for the offset cols
+    # same float32 design matrix as the network design matrix blocks
+    tmpdm = get_design_matrix(ifgs[0][0], degree, offset=False).astype(
+        np.float64)
+
+    for ifg, i in ifgs:
+        vphase = ifg.phase_data.reshape(ifg.num_cells)
+        valid = ~isnan(vphase)
+        dm = tmpdm[valid]
+        data = vphase[valid].astype(np.float64)
+        m = slice(ids[ifg.master] * ncoef, (ids[ifg.master] + 1) * ncoef)
+        s = slice(ids[ifg.slave] * ncoef, (ids[ifg.slave] + 1) * ncoef)
+
+        # this ifg's rows of B are -dm under the master coefficients and dm
+        # under the slave coefficients
+        dtd = dm.T.dot(dm)
+        BTB[m, m] += dtd
+        BTB[s, s] += dtd
+        BTB[m, s] -= dtd
+        BTB[s, m] -= dtd
+        dtdata = dm.T.dot(data)
+        BTd[m] -= dtdata
+        BTd[s] += dtdata
+
+        if offset:
+            o = offset_col + i
+            dsum = dm.sum(axis=0)
+            BTB[o, o] += np.count_nonzero(valid)
+            BTB[m, o] -= dsum
+            BTB[o, m] -= dsum
+            BTB[s, o] += dsum
+            BTB[o, s] += dsum
+            BTd[o] += data.sum()
+
+    return BTB, BTd
+
+
 class OrbitalError(Exception):
     """
     Generic class for errors in orbital correction.
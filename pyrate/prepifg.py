@@ -35,7 +35,8 @@ from osgeo import gdal
 from pyrate import config as cf
 from pyrate import gdal_python as gdalwarp
 from pyrate import ifgconstants as ifc
-from pyrate.shared import Ifg, DEM
+from pyrate.shared import Ifg, DEM, RasterBase, raster_header, \
+    raster_headers
 
 CustomExts = namedtuple('CustExtents', ['xfirst', 'yfirst', 'xlast', 'ylast'])
 
@@ -55,7 +56,8 @@ def get_analysis_extent(crop_opt, rasters, xlooks, ylooks, user_exts):
     Function checks prepifg parameters and returns extents/bounding box.
 
     :param int crop_opt: Cropping option
-    :param list rasters: List of either Ifg or DEM class objects
+    :param list rasters: List of either Ifg, DEM or RasterHeader class
+        objects
     :param int xlooks: Number of multi-looks in x
     :param int ylooks: Number of multi-looks in y
     :param tuple user_exts: Tuple of user defined cropping coordinates
@@ -77,7 +79,7 @@ def get_analysis_extent(crop_opt, rasters, xlooks, ylooks, user_exts):
                 raise PreprocessError('Custom extents must be 4 numbers')
 
     for raster in rasters:
-        if not raster.is_open:
+        if isinstance(raster, RasterBase) and not raster.is_open:
             raster.open()
 
     _check_looks(xlooks, ylooks)
@@ -213,9 +215,8 @@ def prepare_ifgs(raster_data_paths, crop_opt, xlooks, ylooks, thresh=0.5,
     :return: out_ds: destination gdal dataset object
     :rtype: gdal.Dataset
     """
-    # use metadata check to check whether it's a dem or ifg
-    rasters = [dem_or_ifg(r) for r in raster_data_paths]
-    exts = get_analysis_extent(crop_opt, rasters, xlooks, ylooks, user_exts)
+    exts = get_analysis_extent(crop_opt, raster_headers(raster_data_paths),
+                               xlooks, ylooks, user_exts)
 
     return [prepare_ifg(d, xlooks, ylooks, exts, thresh, crop_opt,
                         write_to_disc)
@@ -231,9 +232,8 @@ def dem_or_ifg(data_path):
     :return: Interferogram or DEM object from input file
     :rtype: Ifg or DEM class object
     """
-    ds = gdal.Open(data_path)
-    md = ds.GetMetadata()
-    if 'DATE' in md:  # ifg
+    # use metadata check to check whether it's a dem or ifg
+    if 'DATE' in raster_header(data_path).meta_data:  # ifg
         return Ifg(data_path)
     else:
         return DEM(data_path)
@@ -401,7 +401,7 @@ def _get_same_bounds(ifgs):
     Check and return bounding box for ALREADY_SAME_SIZE option.
     """
 
-    tfs = [i.dataset.GetGeoTransform() for i in ifgs]
+    tfs = [tuple(i.geotransform) for i in ifgs]
     equal = [t == tfs[0] for t in tfs[1:]]
     if not all(equal):
         msg = 'Ifgs do not have the same bounding box for crop option: %s'
@@ -21,8 +21,6 @@ import sys
 import traceback
 import warnings
 
-from pyrate import mpiops
-
 
 def configure(verbosity):
     """
@@ -45,6 +43,7 @@ class _MPIStreamHandler(logging.StreamHandler):
     Only logs messages from Node 0
     """
     def emit(self, record):
+        from pyrate import mpiops  # mpi4py is slow to import
         if mpiops.rank == 0:
             super(_MPIStreamHandler, self).emit(record)
 
@@ -17,16 +17,13 @@
 This Python module implements an algorithm to search for the location
 of the interferometric reference pixel
 """
-import os
-from os.path import join
 import logging
 from itertools import product
 import numpy as np
-from numpy import isnan, std, mean, sum as nsum
-from joblib import Parallel, delayed
+from numpy import isnan
 
 import pyrate.config as cf
-from pyrate.shared import Ifg
+from pyrate.shared import Ifg, raster_header
 
 log = logging.getLogger(__name__)
 
@@ -50,20 +47,10 @@ def ref_pixel(ifgs, params):
     :rtype: tuple
     """
     half_patch_size, thresh, grid = ref_pixel_setup(ifgs, params)
-    parallel = params[cf.PARALLEL]
-    if parallel:
-        phase_data = [i.phase_data for i in ifgs]
-        mean_sds = Parallel(n_jobs=params[cf.PROCESSES], verbose=50)(
-            delayed(_ref_pixel_multi)(g, half_patch_size, phase_data,
-                                     thresh, params) for g in grid)
-        refy, refx = find_min_mean(mean_sds, grid)
-    else:
-        phase_data = [i.phase_data for i in ifgs]
-        mean_sds = []
-        for g in grid:
-            mean_sds.append(_ref_pixel_multi(
-                g, half_patch_size, phase_data, thresh, params))
-        refy, refx = find_min_mean(mean_sds, grid)
+    sd_sum, n_invalid = ref_pixel_sums([i.phase_data for i in ifgs], grid,
+                                       half_patch_size, thresh, params)
+    mean_sds = ref_pixel_means(sd_sum, n_invalid, len(ifgs))
+    refy, refx = find_min_mean(mean_sds, grid)
 
     if refy and refx:
         return refy, refx
@@ -89,8 +76,7 @@ def find_min_mean(mean_sds, grid):
 
 def ref_pixel_setup(ifgs_or_paths, params):
     """
-    Sets up the grid for reference pixel computation and saves numpy files
-    to disk for later use during ref pixel computation.
+    Sets up the grid for reference pixel computation.
         
     :param list ifgs_or_paths: List of interferogram filenames or Ifg objects
     :param dict params: Dictionary of configuration parameters
@@ -112,8 +98,7 @@ def ref_pixel_setup(ifgs_or_paths, params):
         raise RefPixelError(msg)
 
     if isinstance(ifgs_or_paths[0], str):
-        head = Ifg(ifgs_or_paths[0])
-        head.open(readonly=True)
+        head = raster_header(ifgs_or_paths[0])
     else:
         head = ifgs_or_paths[0]
 
@@ -134,77 +119,106 @@ def ref_pixel_setup(ifgs_or_paths, params):
     return half_patch_size, thresh, list(product(ysteps, xsteps))
 
 
-def save_ref_pixel_blocks(grid, half_patch_size, ifg_paths, params):
+def ref_pixel_sums(phase_data_or_ifg_paths, grid, half_patch_size, thresh,
+                   params):
     """
-    Save reference pixel grid blocks to numpy array files on disk
-
-    :param list grid: List of tuples (y, x) corresponding to ref pixel grids
+    Accumulate the chip standard deviations of every reference pixel
+    candidate over the given interferograms. Each interferogram is read once
+    and reduced to summed-area tables, so the statistics of every chip are
+    O(1) lookups regardless of the chip size or the number of candidates.
+    The returned partial sums of separate interferogram subsets (e.g. on
+    different MPI processes) can simply be added together.
+
+    :param list phase_data_or_ifg_paths: List of phase data arrays or
+        interferogram paths
+    :param list grid: List of tuples (y, x) of candidate pixels
     :param int half_patch_size: patch size in pixels
-    :param list ifg_paths: list of interferogram paths
+    :param float thresh: Minimum number of valid pixels in a chip
     :param dict params: Dictionary of configuration parameters
 
-    :return: None, file saved to disk
+    :return: sd_sum: sum of the chip standard deviations per candidate
+    :rtype: ndarray
+    :return: n_invalid: number of interferograms in which each candidate
+        chip has too few valid pixels
+    :rtype: ndarray
     """
-    log.info('Saving ref pixel blocks')
-    outdir = params[cf.TMPDIR]
-    for pth in ifg_paths:
-        ifg = Ifg(pth)
-        ifg.open(readonly=True)
-        ifg.nodata_value = params[cf.NO_DATA_VALUE]
-        ifg.convert_to_nans()
-        ifg.convert_to_mm()
-        for y, x in grid:
-            data = ifg.phase_data[y - half_patch_size:y + half_patch_size + 1,
-                                  x - half_patch_size:x + half_patch_size + 1]
-
-            data_file = join(outdir, 'ref_phase_data_{b}_{y}_{x}.npy'.format(
-                    b=os.path.basename(pth).split('.')[0], y=y, x=x))
-            np.save(file=data_file, arr=data)
-        ifg.close()
-    log.info('Saved ref pixel blocks')
-
-
-def _ref_pixel_mpi(process_grid, half_patch_size, ifgs, thresh, params):
+    ys, xs = np.array(grid, dtype=np.int64).reshape(-1, 2).T
+    sd_sum = np.zeros(len(ys), dtype=np.float64)
+    n_invalid = np.zeros(len(ys), dtype=np.int64)
+    if not len(ys):
+        return sd_sum, n_invalid
+    # the tables only cover the bounding box of the chips
+    y0 = max(ys.min() - half_patch_size, 0)
+    x0 = max(xs.min() - half_patch_size, 0)
+    window = (slice(y0, ys.max() + half_patch_size + 1),
+              slice(x0, xs.max() + half_patch_size + 1))
+    for data in phase_data_or_ifg_paths:
+        if isinstance(data, str):
+            ifg = Ifg(data)
+            ifg.open(readonly=True)
+            ifg.nodata_value = params[cf.NO_DATA_VALUE]
+            ifg.convert_to_nans()
+            ifg.convert_to_mm()
+            data = ifg.phase_data
+            ifg.close()
+        count, total, total_sq = _chip_sums(_integral_images(data[window]),
+                                            ys - y0, xs - x0,
+                                            half_patch_size)
+        valid = count > thresh
+        count[~valid] = 1  # avoid dividing by zero for rejected chips
+        chip_mean = total / count
+        sd = np.sqrt(np.maximum(total_sq / count - chip_mean ** 2, 0))
+        sd_sum += np.where(valid, sd, 0)
+        n_invalid += ~valid
+    return sd_sum, n_invalid
+
+
+def ref_pixel_means(sd_sum, n_invalid, n_ifgs):
     """
-    Convenience function for MPI-enabled ref pixel calculation
+    Mean chip standard deviation of each reference pixel candidate. Candidates
+    with too few valid pixels in any interferogram are set to nan.
+
+    :param ndarray sd_sum: Sum of the chip standard deviations per candidate
+    :param ndarray n_invalid: Number of interferograms in which each
+        candidate is rejected
+    :param int n_ifgs: Total number of interferograms
+
+    :return: mean_sds: mean standard deviation per candidate
+    :rtype: ndarray
     """
-    log.info('Ref pixel calculation started')
-    mean_sds = []
-    for g in process_grid:
-        mean_sds.append(_ref_pixel_multi(g, half_patch_size, ifgs, thresh,
-                                        params))
-    return mean_sds
+    return np.where(n_invalid == 0, sd_sum / n_ifgs, np.nan)
 
 
-def _ref_pixel_multi(g, half_patch_size, phase_data_or_ifg_paths,
-                    thresh, params):
+def _integral_images(phase_data):
     """
-    Convenience function for ref pixel optimisation
+    Summed-area tables of the valid pixel count, the phase and the squared
+    phase, padded with a leading row and column of zeros. The phase is
+    centred on its mean first, which leaves the chip standard deviations
+    unchanged but keeps the variance computation well conditioned.
     """
-    # pylint: disable=invalid-name
-    # phase_data_or_ifg is list of ifgs
-    y, x, = g
-    if isinstance(phase_data_or_ifg_paths[0], str):
-        # this consumes a lot less memory
-        # one ifg.phase_data in memory at any time
-        data = []
-        output_dir = params[cf.TMPDIR]
-        for p in phase_data_or_ifg_paths:
-            data_file = os.path.join(output_dir,
-                                     'ref_phase_data_{b}_{y}_{x}.npy'.format(
-                                         b=os.path.basename(p).split('.')[0],
-                                         y=y, x=x))
-            data.append(np.load(file=data_file))
-    else:  # phase_data_or_ifg is phase_data list
-        data = [p[y - half_patch_size:y + half_patch_size + 1,
-                  x - half_patch_size:x + half_patch_size + 1]
-                for p in phase_data_or_ifg_paths]
-    valid = [nsum(~isnan(d)) > thresh for d in data]
-    if all(valid):  # ignore if 1+ ifgs have too many incoherent cells
-        sd = [std(i[~isnan(i)]) for i in data]
-        return mean(sd)
-    else:
-        return np.nan
+    valid = ~isnan(phase_data)
+    rows, cols = phase_data.shape
+    tables = np.zeros((rows + 1, cols + 1, 3), dtype=np.float64)
+    tables[1:, 1:, 0] = valid
+    data = tables[1:, 1:, 1]
+    data[valid] = phase_data[valid]
+    if valid.any():
+        data[valid] -= data[valid].mean()
+    np.square(data, out=tables[1:, 1:, 2])
+    np.cumsum(tables, axis=0, out=tables)
+    np.cumsum(tables, axis=1, out=tables)
+    return tables
+
+
+def _chip_sums(tables, ys, xs, half_patch_size):
+    """
+    Valid pixel count, sum and sum of squares of the chips centred on
+    (ys, xs), looked up from the summed-area tables.
+    """
+    y0, y1 = ys - half_patch_size, ys + half_patch_size + 1
+    x0, x1 = xs - half_patch_size, xs + half_patch_size + 1
+    sums = tables[y1, x1] - tables[y0, x1] - tables[y1, x0] + tables[y0, x0]
+    return sums[:, 0].round(), sums[:, 1], sums[:, 2]
 
 
 def _step(dim, ref, radius):
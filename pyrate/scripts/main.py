@@ -24,11 +24,16 @@ import json
 import click
 from pyrate import pyratelog as pylog
 from pyrate import config as cf
-from pyrate.scripts import run_prepifg, run_pyrate, postprocessing
 from pyrate import __version__
 
 log = logging.getLogger(__name__)
 
+# option running a command on local processes without MPI
+nprocs_option = click.option(
+    '-n', '--nprocs', type=int, default=1,
+    help='run on this many local processes without MPI. Use mpirun '
+         'instead for runs across nodes')
+
 
 def version_msg():
     """
@@ -52,49 +57,73 @@ def cli(verbosity):
 
 @cli.command()
 @click.argument('config_file')
-def prepifg(config_file):
+@nprocs_option
+def prepifg(config_file, nprocs):
     """
     Convert input files to geotiff and perform multilooking
     (resampling) and/or cropping
     """
+    from pyrate.scripts import run_prepifg  # command modules load on use
+    from pyrate import mpiops
     config_file = abspath(config_file)
     params = cf.get_config_params(config_file)
     log.info('This job was run with the following parameters:')
     log.info(json.dumps(params, indent=4, sort_keys=True))
     if params[cf.LUIGI]:
+        if nprocs > 1:
+            raise cf.ConfigException('LUIGI with multiple processes not '
+                                     'supported')
         run_prepifg.main()
     else:
-        run_prepifg.main(params)
+        mpiops.run_local(nprocs, run_prepifg.main, params)
 
 
 @cli.command()
 @click.argument('config_file')
-@click.option('-r', '--rows', type=int, default=1,
-              help='divide ifgs into this many rows')
-@click.option('-c', '--cols', type=int, default=1,
-              help='divide ifgs into this many columns')
-def linrate(config_file, rows, cols):
+@click.option('-r', '--rows', type=int, default=None,
+              help='divide ifgs into this many rows. Chosen with the '
+                   'columns from the tilemem memory budget if neither is '
+                   'given, 1 if only the columns are given')
+@click.option('-c', '--cols', type=int, default=None,
+              help='divide ifgs into this many columns. Chosen with the '
+                   'rows from the tilemem memory budget if neither is '
+                   'given, 1 if only the rows are given')
+@click.option('--resume', is_flag=True,
+              help='skip stages and tiles completed by a previous run '
+                   'with the same configuration')
+@nprocs_option
+def linrate(config_file, rows, cols, resume, nprocs):
     """
     Main PyRate workflow including time series and linear rate computation
     """
+    from pyrate.scripts import run_pyrate
+    from pyrate import mpiops
     config_file = abspath(config_file)
     _, dest_paths, params = cf.get_ifg_paths(config_file)
     log.info('This job was run with the following parameters:')
     log.info(json.dumps(params, indent=4, sort_keys=True))
-    run_pyrate.process_ifgs(sorted(dest_paths), params, rows, cols)
+    mpiops.run_local(nprocs, run_pyrate.process_ifgs, sorted(dest_paths),
+                     params, rows, cols, resume=resume)
 
 
 @cli.command()
 @click.argument('config_file')
-@click.option('-r', '--rows', type=int, default=1,
+@click.option('-r', '--rows', type=int, default=None,
               help='divide ifgs into this many rows. Must be same as '
-                   'number of rows used previously in main workflow')
-@click.option('-c', '--cols', type=int, default=1,
+                   'number of rows used previously in main workflow. '
+                   'The stored layout of the main workflow is used if '
+                   'neither rows nor cols are given')
+@click.option('-c', '--cols', type=int, default=None,
               help='divide ifgs into this many columns. Must be same as '
-                   'number of cols used previously in main workflow')
-def postprocess(config_file, rows, cols):
+                   'number of cols used previously in main workflow. '
+                   'The stored layout of the main workflow is used if '
+                   'neither rows nor cols are given')
+@nprocs_option
+def postprocess(config_file, rows, cols, nprocs):
     """
     Reassemble PyRate output tiles and save as geotiffs
     """
+    from pyrate.scripts import postprocessing
+    from pyrate import mpiops
     config_file = abspath(config_file)
-    postprocessing.main(config_file, rows, cols)
+    mpiops.run_local(nprocs, postprocessing.main, config_file, rows, cols)
@@ -38,7 +38,7 @@ log = logging.getLogger(__name__)
 MASTER_PROCESS = 0
 
 
-def main(config_file, rows, cols):
+def main(config_file, rows=None, cols=None):
     """
     PyRate post-processing main function. Assembles product tiles in to
     single geotiff files
@@ -63,7 +63,7 @@ def _postprocess_linrate(rows, cols, params):
     # load previously saved prepread_ifgs dict
     preread_ifgs_file = join(params[cf.TMPDIR], 'preread_ifgs.pk')
     ifgs = cp.load(open(preread_ifgs_file, 'rb'))
-    tiles = shared.get_tiles(dest_tifs[0], rows, cols)
+    tiles = _get_tiles(dest_tifs[0], rows, cols, params)
 
     # linrate aggregation
     if mpiops.size >= 3:
@@ -76,6 +76,17 @@ def _postprocess_linrate(rows, cols, params):
              for t in ['linrate', 'linerror', 'linsamples']]
 
 
+def _get_tiles(dest_tif, rows, cols, params):
+    """
+    Tiles of the main workflow outputs. The tile layout stored with the phase
+    cube is used if neither rows nor cols are given, a missing one of them
+    defaults to 1 otherwise.
+    """
+    if rows is None and cols is None:
+        return shared.PhaseCube.load(params[cf.TMPDIR]).tiles
+    return shared.get_tiles(dest_tif, rows or 1, cols or 1)
+
+
 def _save_linrate(ifgs_dict, params, tiles, out_type):
     """
     Save linear rate outputs
@@ -125,7 +136,7 @@ def _postprocess_timeseries(rows, cols, params):
     epochlist = ifgs['epochlist']
     ifgs = [v for v in ifgs.values() if isinstance(v, PrereadIfg)]
 
-    tiles = shared.get_tiles(dest_tifs[0], rows, cols)
+    tiles = _get_tiles(dest_tifs[0], rows, cols, params)
 
     # load the first tsincr file to determine the number of time series tifs
     tsincr_file = os.path.join(output_dir, 'tsincr_0.npy')
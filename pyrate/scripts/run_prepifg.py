@@ -21,19 +21,19 @@ interferograms into geotiffs and applies optional multilooking and cropping.
 from __future__ import print_function
 import sys
 import os
+import glob
+import hashlib
 import logging
-import luigi
+import pickle as cp
 from joblib import Parallel, delayed
 import numpy as np
 
-from pyrate.tasks.utils import pythonify_config
-from pyrate.tasks.prepifg import PrepareInterferograms
 from pyrate import prepifg
 from pyrate import config as cf
 from pyrate import roipac
 from pyrate import gamma
-from pyrate.shared import write_geotiff, mkdir_p, output_tiff_filename
-from pyrate.tasks import gamma as gamma_task
+from pyrate.shared import write_geotiff, mkdir_p, output_tiff_filename, \
+    raster_headers
 import pyrate.ifgconstants as ifc
 from pyrate import mpiops
 
@@ -42,6 +42,8 @@ log = logging.getLogger(__name__)
 ROI_PAC_HEADER_FILE_EXT = 'rsc'
 GAMMA = 1
 ROIPAC = 0
+# prepifg work manifest, one file per MPI process in tmpdir
+MANIFEST_FILE = 'prepifg_manifest_{}.pk'
 
 
 def main(params=None):
@@ -84,6 +86,10 @@ def main(params=None):
             base_ifg_paths.append(params[cf.APS_ELEVATION_MAP])
 
     if use_luigi:
+        # luigi is only imported when used as it is slow to import
+        import luigi
+        from pyrate.tasks.utils import pythonify_config
+        from pyrate.tasks.prepifg import PrepareInterferograms
         log.info("Running prepifg using luigi")
         luigi.configuration.LuigiConfigParser.add_config_path(
             pythonify_config(raw_config_file))
@@ -104,7 +110,8 @@ def main(params=None):
 def roipac_prepifg(base_ifg_paths, params):
     """
     Prepare ROI_PAC interferograms which combines both conversion to geotiff
-    and multilooking/cropping operations.
+    and multilooking/cropping operations. Files whose outputs are up to date
+    according to the prepifg manifest are skipped.
 
     :param list base_ifg_paths: List of unwrapped interferograms
     :param dict params: Parameters dictionary corresponding to config file
@@ -112,10 +119,6 @@ def roipac_prepifg(base_ifg_paths, params):
     log.info("Preparing ROI_PAC format interferograms")
     parallel = params[cf.PARALLEL]
 
-    if parallel:
-        log.info("Parallel prepifg is not implemented for ROI_PAC")
-
-    log.info("Running prepifg in serial")
     xlooks, ylooks, crop = cf.transform_params(params)
     rsc_file = os.path.join(params[cf.DEM_HEADER_FILE])
     if rsc_file is not None:
@@ -128,52 +131,108 @@ def roipac_prepifg(base_ifg_paths, params):
                                    os.path.basename(q).split('.')[1] + '.tif')
                       for q in base_ifg_paths]
 
-    for b, d in zip(base_ifg_paths, dest_base_ifgs):
-        header_file = "%s.%s" % (b, ROI_PAC_HEADER_FILE_EXT)
-        header = roipac.manage_header(header_file, projection)
-        write_geotiff(header, b, d, nodata=params[cf.NO_DATA_VALUE])
-    prepifg.prepare_ifgs(
-        dest_base_ifgs, crop_opt=crop, xlooks=xlooks, ylooks=ylooks)
+    manifest = _load_manifest(params)
+    config = _config_hash(*[params[k] for k in _CONVERSION_PARAMS])
+    jobs = [(d, [b, "%s.%s" % (b, ROI_PAC_HEADER_FILE_EXT), rsc_file])
+            for b, d in zip(base_ifg_paths, dest_base_ifgs)]
+    stale = _stale_jobs(manifest, jobs, config)
+    if parallel:
+        log.info("Running prepifg in parallel with {} "
+                 "processes".format(params[cf.PROCESSES]))
+        Parallel(n_jobs=params[cf.PROCESSES], verbose=50)(
+            delayed(_roipac_multiprocessing)(inputs[0], d, projection, params)
+            for d, inputs in stale)
+    else:
+        log.info("Running prepifg in serial")
+        for d, inputs in stale:
+            _roipac_multiprocessing(inputs[0], d, projection, params)
+    _update_manifest(manifest, stale, config)
+
+    _prepare_ifgs(dest_base_ifgs, params, manifest, thresh=0.5, user_exts=None)
+    _save_manifest(params, manifest)
+
+
+def _roipac_multiprocessing(ifg_path, dest, projection, params):
+    """
+    Multiprocessing wrapper for ROI_PAC geotiff conversion
+    """
+    header_file = "%s.%s" % (ifg_path, ROI_PAC_HEADER_FILE_EXT)
+    header = roipac.manage_header(header_file, projection)
+    write_geotiff(header, ifg_path, dest, nodata=params[cf.NO_DATA_VALUE])
+    return dest
 
 
 def gamma_prepifg(base_unw_paths, params):
     """
     Prepare GAMMA interferograms which combines both conversion to geotiff
-    and multilooking/cropping operations.
+    and multilooking/cropping operations. Files whose outputs are up to date
+    according to the prepifg manifest are skipped.
 
     :param list base_unw_paths: List of unwrapped interferograms
     :param dict params: Parameters dictionary corresponding to config file
     """
-    # pylint: disable=expression-not-assigned
     log.info("Preparing GAMMA format interferograms")
     parallel = params[cf.PARALLEL]
 
+    manifest = _load_manifest(params)
+    config = _config_hash(*[params[k] for k in _CONVERSION_PARAMS])
+    jobs = [_gamma_job(b, params) for b in base_unw_paths]
+    stale = _stale_jobs(manifest, jobs, config)
+
     # dest_base_ifgs: location of geo_tif's
     if parallel:
         log.info("Running prepifg in parallel with {} "
                  "processes".format(params[cf.PROCESSES]))
-        dest_base_ifgs = Parallel(n_jobs=params[cf.PROCESSES], verbose=50)(
-            delayed(_gamma_multiprocessing)(p, params)
-            for p in base_unw_paths)
+        Parallel(n_jobs=params[cf.PROCESSES], verbose=50)(
+            delayed(_gamma_multiprocessing)(inputs[0], params)
+            for _, inputs in stale)
     else:
         log.info("Running prepifg in serial")
-        dest_base_ifgs = [_gamma_multiprocessing(b, params)
-                          for b in base_unw_paths]
+        for _, inputs in stale:
+            _gamma_multiprocessing(inputs[0], params)
+    _update_manifest(manifest, stale, config)
+
+    dest_base_ifgs = [d for d, _ in jobs]
+    _prepare_ifgs(dest_base_ifgs, params, manifest,
+                  thresh=params[cf.NO_DATA_AVERAGING_THRESHOLD],
+                  user_exts=(params[cf.IFG_XFIRST], params[cf.IFG_YFIRST],
+                             params[cf.IFG_XLAST], params[cf.IFG_YLAST]))
+    _save_manifest(params, manifest)
 
-    ifgs = [prepifg.dem_or_ifg(p) for p in dest_base_ifgs]
+
+def _prepare_ifgs(dest_base_ifgs, params, manifest, thresh, user_exts):
+    """
+    Multilook and crop the converted geotiffs in parallel or serial,
+    skipping outputs that are up to date according to the manifest
+    """
+    # pylint: disable=expression-not-assigned
+    headers = raster_headers(dest_base_ifgs, params[cf.TMPDIR])
     xlooks, ylooks, crop = cf.transform_params(params)
-    user_exts = (params[cf.IFG_XFIRST], params[cf.IFG_YFIRST],
-                 params[cf.IFG_XLAST], params[cf.IFG_YLAST])
-    exts = prepifg.get_analysis_extent(crop, ifgs, xlooks, ylooks,
+    exts = prepifg.get_analysis_extent(crop, headers, xlooks, ylooks,
                                        user_exts=user_exts)
-    thresh = params[cf.NO_DATA_AVERAGING_THRESHOLD]
-    if parallel:
+    config = _config_hash(xlooks, ylooks, crop, exts, thresh)
+    jobs = [(cf.mlooked_path(d, looks=ylooks, crop_out=crop), [d])
+            for d in dest_base_ifgs]
+    stale = _stale_jobs(manifest, jobs, config)
+    if params[cf.PARALLEL]:
         Parallel(n_jobs=params[cf.PROCESSES], verbose=50)(
-            delayed(prepifg.prepare_ifg)(p, xlooks, ylooks, exts, thresh, crop)
-            for p in dest_base_ifgs)
+            delayed(prepifg.prepare_ifg)(inputs[0], xlooks, ylooks, exts,
+                                         thresh, crop)
+            for _, inputs in stale)
     else:
-        [prepifg.prepare_ifg(i, xlooks, ylooks, exts,
-                             thresh, crop) for i in dest_base_ifgs]
+        [prepifg.prepare_ifg(inputs[0], xlooks, ylooks, exts,
+                             thresh, crop) for _, inputs in stale]
+    _update_manifest(manifest, stale, config)
+
+
+def _gamma_job(unw_path, params):
+    """
+    Returns the geotiff destination and the input files it depends on
+    """
+    header_paths = gamma.get_header_paths(unw_path,
+                                          slc_dir=params[cf.SLC_DIR])
+    dest = output_tiff_filename(unw_path, params[cf.OUT_DIR])
+    return dest, [unw_path, params[cf.DEM_HEADER_FILE]] + list(header_paths)
 
 
 def _gamma_multiprocessing(unw_path, params):
@@ -183,7 +242,7 @@ def _gamma_multiprocessing(unw_path, params):
     dem_hdr_path = params[cf.DEM_HEADER_FILE]
     slc_dir = params[cf.SLC_DIR]
     mkdir_p(params[cf.OUT_DIR])
-    header_paths = gamma_task.get_header_paths(unw_path, slc_dir=slc_dir)
+    header_paths = gamma.get_header_paths(unw_path, slc_dir=slc_dir)
     combined_headers = gamma.manage_headers(dem_hdr_path, header_paths)
 
     dest = output_tiff_filename(unw_path, params[cf.OUT_DIR])
@@ -195,3 +254,100 @@ def _gamma_multiprocessing(unw_path, params):
     write_geotiff(combined_headers, unw_path, dest,
                   nodata=params[cf.NO_DATA_VALUE])
     return dest
+
+
+# parameters affecting the geotiff conversion of a file
+_CONVERSION_PARAMS = [cf.PROCESSOR, cf.NO_DATA_VALUE, cf.APS_INCIDENCE_EXT,
+                      cf.APS_ELEVATION_EXT]
+
+
+def _config_hash(*args):
+    """
+    Hash of the configuration values an output depends on
+    """
+    return hashlib.md5(repr(args).encode('utf-8')).hexdigest()
+
+
+def _file_stat(path):
+    """
+    Path, size and modification time of a file
+    """
+    stat = os.stat(path)
+    return path, stat.st_size, stat.st_mtime
+
+
+def _manifest_entry(output, inputs, config):
+    """
+    Manifest entry recording the state of an output and its inputs
+    """
+    return {'inputs': [_file_stat(p) for p in inputs],
+            'config': config,
+            'output': _file_stat(output)}
+
+
+def _stale_jobs(manifest, jobs, config):
+    """
+    Returns the (output, inputs) jobs whose output is missing or was not
+    produced from the current inputs and configuration
+    """
+    stale = []
+    for output, inputs in jobs:
+        if output in manifest and os.path.exists(output) and \
+                manifest[output] == _manifest_entry(output, inputs, config):
+            continue
+        stale.append((output, inputs))
+    if len(stale) < len(jobs):
+        log.info('Skipping {} of {} files already up to date'.format(
+            len(jobs) - len(stale), len(jobs)))
+    return stale
+
+
+def _update_manifest(manifest, jobs, config):
+    """
+    Record the (output, inputs) jobs that have been run in the manifest
+    """
+    for output, inputs in jobs:
+        manifest[output] = _manifest_entry(output, inputs, config)
+
+
+def _load_manifest(params):
+    """
+    Read and merge the prepifg manifests of all processes
+    """
+    manifest = {}
+    tmpdir = os.path.join(params[cf.OUT_DIR], cf.TMPDIR)
+    for path in glob.glob(os.path.join(tmpdir, MANIFEST_FILE.format('*'))):
+        with open(path, 'rb') as f:
+            entries = cp.load(f)
+        for output, entry in entries.items():
+            # keep the most recent entry for each output
+            if output not in manifest or \
+                    entry['output'][2] > manifest[output]['output'][2]:
+                manifest[output] = entry
+    return manifest
+
+
+def _save_manifest(params, manifest):
+    """
+    Save the prepifg manifest of this process
+    """
+    tmpdir = os.path.join(params[cf.OUT_DIR], cf.TMPDIR)
+    mkdir_p(tmpdir)
+    path = os.path.join(tmpdir, MANIFEST_FILE.format(mpiops.rank))
+    with open(path, 'wb') as f:
+        cp.dump(manifest, f)
+
+
+def refresh_manifest(params, outputs):
+    """
+    Record the current state of outputs that have been modified in place
+    after prepifg (e.g. by corrections in the main workflow) as up to date.
+
+    :param dict params: Parameters dictionary corresponding to config file
+    :param list outputs: List of prepifg output paths
+    """
+    manifest = _load_manifest(params)
+    for output in outputs:
+        if output in manifest:
+            manifest[output]['output'] = _file_stat(output)
+    _save_manifest(params, manifest)
@@ -18,10 +18,12 @@ This Python module runs the main PyRate processing workflow
 """
 from __future__ import print_function
 
+import hashlib
 import logging
 import os
 from os.path import join
 import pickle as cp
+import shutil
 from collections import OrderedDict
 import numpy as np
 
@@ -40,12 +42,17 @@ from pyrate import covariance as vcm_module
 from pyrate.aps import _wrap_spatio_temporal_filter
 #from pyrate.compat import PyAPS_INSTALLED
 from pyrate.config import ConfigException
-from pyrate.shared import Ifg, PrereadIfg, get_tiles
+from pyrate.scripts import run_prepifg
+from pyrate.shared import PrereadIfg, get_tiles
 
 #if PyAPS_INSTALLED:  # pragma: no cover
 #    from pyrate.pyaps import check_aps_ifgs, aps_delay_required
 
 MASTER_PROCESS = 0
+# results of the previous run used for incremental processing
+INCREMENTAL_STATE_FILE = 'incremental_state.pk'
+# directory in tmpdir holding the completion records of stages and tiles
+CHECKPOINT_DIR = 'checkpoints'
 log = logging.getLogger(__name__)
 
 
@@ -59,15 +66,17 @@ def _join_dicts(dicts):
     return assembled_dict
 
 
-def _create_ifg_dict(dest_tifs, params, tiles):
+def _create_ifg_dict(dest_tifs, params, tiles, cached_preread=None):
     """
-    1. Convert ifg phase data into numpy binary files.
+    1. Save ifg phase data to the memory-mapped phase cube.
     2. Save the preread_ifgs dict with information about the ifgs that are
     later used for fast loading of Ifg files in IfgPart class
 
     :param list dest_tifs: List of destination tifs
     :param dict params: Config dictionary
     :param list tiles: List of all Tile instances
+    :param dict cached_preread: PrereadIfg instances of a previous run to
+        reuse, keyed by ifg path (optional)
 
     :return: preread_ifgs: Dictionary containing information regarding
                 interferograms that are used later in workflow
@@ -77,6 +86,9 @@ def _create_ifg_dict(dest_tifs, params, tiles):
     process_tifs = mpiops.array_split(dest_tifs)
     shared.save_numpy_phase(dest_tifs, tiles, params)
     for d in process_tifs:
+        if cached_preread and d in cached_preread:
+            ifgs_dict[d] = cached_preread[d]
+            continue
         ifg = shared._prep_ifg(d, params)
         ifgs_dict[d] = PrereadIfg(path=d,
                                   nan_fraction=ifg.nan_fraction,
@@ -110,11 +122,11 @@ def _create_ifg_dict(dest_tifs, params, tiles):
     return preread_ifgs
 
 
-def _mst_calc(dest_tifs, params, tiles, preread_ifgs):
+def _mst_calc(dest_tifs, params, tiles, preread_ifgs, checkpoint=None):
     """
     MPI wrapper function for MST calculation
     """
-    process_tiles = mpiops.array_split(tiles)
+    process_tiles = shared.schedule_tiles(tiles, params)
 
     def _save_mst_tile(tile, i, preread_ifgs):
         """
@@ -124,18 +136,26 @@ def _mst_calc(dest_tifs, params, tiles, preread_ifgs):
             log.info('Calculating minimum spanning tree matrix '
                      'using NetworkX method')
             mst_tile = mst.mst_multiprocessing(tile, dest_tifs, preread_ifgs)
+        elif params[cf.NETWORKX_OR_MATLAB_FLAG] == 2:
+            log.info('Calculating minimum spanning tree matrix '
+                     'using NumPy method')
+            mst_tile = mst.mst_multiprocessing(tile, dest_tifs, preread_ifgs,
+                                               method=2)
         elif params[cf.NETWORKX_OR_MATLAB_FLAG] == 0:
             raise ConfigException('Matlab-style MST not supported')
         else:
-            raise ConfigException('Only NetworkX MST is supported')
-            # mst_tile = mst.mst_multiprocessing(tile, dest_tifs, preread_ifgs)
+            raise ConfigException('Only NetworkX and NumPy MST are supported')
         # locally save the mst_mat
         mst_file_process_n = join(
             params[cf.TMPDIR], 'mst_mat_{}.npy'.format(i))
         np.save(file=mst_file_process_n, arr=mst_tile)
 
     for t in process_tiles:
+        if checkpoint and checkpoint.done('mst', t.index):
+            continue
         _save_mst_tile(t, t.index, preread_ifgs)
+        if checkpoint:
+            checkpoint.mark('mst', t.index)
     log.info('finished mst calculation for process {}'.format(mpiops.rank))
     mpiops.comm.barrier()
 
@@ -147,8 +167,7 @@ def _ref_pixel_calc(ifg_paths, params):
     # unlikely, but possible the refpixel can be (0,0)
     # check if there is a pre-specified reference pixel coord
     refx = params[cf.REFX]
-    ifg = Ifg(ifg_paths[0])
-    ifg.open(readonly=True)
+    ifg = shared.raster_header(ifg_paths[0])
     if refx > ifg.ncols - 1:
         msg = ('Supplied reference pixel X coordinate is greater than '
                'the number of ifg columns: {}').format(refx)
@@ -165,14 +184,12 @@ def _ref_pixel_calc(ifg_paths, params):
 
         half_patch_size, thresh, grid = refpixel.ref_pixel_setup(ifg_paths, 
                                                                  params)
-        process_grid = mpiops.array_split(grid)
-        refpixel.save_ref_pixel_blocks(process_grid, half_patch_size,
-                                       ifg_paths, params)
-        mean_sds = refpixel._ref_pixel_mpi(process_grid, half_patch_size,
-                                           ifg_paths, thresh, params)
-        mean_sds = mpiops.comm.gather(mean_sds, root=0)
-        if mpiops.rank == MASTER_PROCESS:
-            mean_sds = np.hstack(mean_sds)
+        process_ifgs = mpiops.array_split(ifg_paths)
+        sd_sum, n_invalid = refpixel.ref_pixel_sums(
+            process_ifgs, grid, half_patch_size, thresh, params)
+        sd_sum = mpiops.comm.allreduce(sd_sum)
+        n_invalid = mpiops.comm.allreduce(n_invalid)
+        mean_sds = refpixel.ref_pixel_means(sd_sum, n_invalid, len(ifg_paths))
 
         refy, refx = mpiops.run_once(refpixel.find_min_mean, mean_sds, grid)
         log.info('Selected reference pixel coordinate: '
@@ -180,7 +197,6 @@ def _ref_pixel_calc(ifg_paths, params):
     else:  # pragma: no cover
         log.info('Reusing reference pixel from config file: '
                  '({}, {})'.format(refx, refy))
-    ifg.close()
     return refx, refy
 
 
@@ -197,22 +213,27 @@ def _orb_fit_calc(ifg_paths, params, preread_ifgs=None):
     if preread_ifgs:  # don't check except for mpi tests
         # perform some general error/sanity checks
         log.info('Checking Orbital error correction status')
-        if mpiops.run_once(shared.check_correction_status, preread_ifgs,
-                           ifc.PYRATE_ORBITAL_ERROR):
+        if params[cf.INCREMENTAL]:
+            # only the independent method, see config
+            ifg_paths = _uncorrected_paths(ifg_paths, preread_ifgs,
+                                           ifc.PYRATE_ORBITAL_ERROR)
+            if not ifg_paths:
+                log.info('Finished Orbital error correction')
+                return
+        elif mpiops.run_once(shared.check_correction_status, preread_ifgs,
+                             ifc.PYRATE_ORBITAL_ERROR):
             log.info('Finished Orbital error correction')
             return  # return if True condition returned
 
     if params[cf.ORBITAL_FIT_METHOD] == 1:
         prcs_ifgs = mpiops.array_split(ifg_paths)
-        orbital.remove_orbital_error(prcs_ifgs, params, preread_ifgs)
+        if len(prcs_ifgs) > 0:
+            orbital.remove_orbital_error(prcs_ifgs, params, preread_ifgs)
     else:
-        # Here we do all the multilooking in one process, but in memory
-        # can use multiple processes if we write data to disc during
-        # remove_orbital_error step
-        # A performance comparison should be made for saving multilooked
-        # files on disc vs in memory single process multilooking
-        if mpiops.rank == MASTER_PROCESS:
-            orbital.remove_orbital_error(ifg_paths, params, preread_ifgs)
+        # each process multilooks and corrects its share of the ifgs, the
+        # network inversion combines the shares of all processes
+        orbital.remove_orbital_error(mpiops.array_split(ifg_paths), params,
+                                     preread_ifgs, distributed=True)
     mpiops.comm.barrier()
     log.info('Finished Orbital error correction')
 
@@ -225,18 +246,25 @@ def _ref_phase_estimation(ifg_paths, params, refpx, refpy, preread_ifgs=None):
     # perform some checks on existing ifgs
     #if preread_ifgs and mpiops.rank == MASTER_PROCESS:
     #TODO: implement MPI capability into ref_phs_est module and remove here
+    all_ifg_paths = ifg_paths
     if preread_ifgs:
         log.info('Checking reference phase estimation status')
-        if mpiops.run_once(shared.check_correction_status, preread_ifgs,
-                           ifc.PYRATE_REF_PHASE):
+        if params[cf.INCREMENTAL]:
+            ifg_paths = _uncorrected_paths(ifg_paths, preread_ifgs,
+                                           ifc.PYRATE_REF_PHASE)
+            if not ifg_paths:
+                log.info('Finished reference phase estimation')
+                return
+        elif mpiops.run_once(shared.check_correction_status, preread_ifgs,
+                             ifc.PYRATE_REF_PHASE):
             log.info('Finished reference phase estimation')
             return  # return if True condition returned
 
     if params[cf.REF_EST_METHOD] == 1:
         # calculate phase sum for later use in ref phase method 1
-        comp = _phase_sum(ifg_paths, params)
+        comp = _phase_sum(all_ifg_paths, params)
         log.info('Computing reference phase via method 1')
-        process_ref_phs = _ref_phs_method1(ifg_paths, comp)
+        process_ref_phs = _ref_phs_method1(ifg_paths, params, comp)
     elif params[cf.REF_EST_METHOD] == 2:
         log.info('Computing reference phase via method 2')
         process_ref_phs = _ref_phs_method2(ifg_paths, params, refpx, refpy)
@@ -268,15 +296,11 @@ def _phase_sum(ifg_paths, params):
     Save phase data and phase sum used in the reference phase estimation
     """
     p_paths = mpiops.array_split(ifg_paths)
-    ifg = Ifg(p_paths[0])
-    ifg.open(readonly=True)
-    shape = ifg.shape
+    shape = shared.raster_header(p_paths[0]).shape
     phs_sum = np.zeros(shape=shape, dtype=np.float64)
-    ifg.close()
 
     for d in p_paths:
-        ifg = Ifg(d)
-        ifg.open()
+        ifg = shared.open_ifg_for_correction(d, params, readonly=True)
         ifg.nodata_value = params[cf.NO_DATA_VALUE]
         phs_sum += ifg.phase_data
         ifg.close()
@@ -312,8 +336,7 @@ def _ref_phs_method2(ifg_paths, params, refpx, refpy):
         """
         Convenient inner loop
         """
-        ifg = Ifg(ifg_path)
-        ifg.open(readonly=False)
+        ifg = shared.open_ifg_for_correction(ifg_path, params)
         phase_data = ifg.phase_data
         ref_ph = rpe._est_ref_phs_method2(phase_data,
                                          half_chip_size,
@@ -330,7 +353,7 @@ def _ref_phs_method2(ifg_paths, params, refpx, refpy):
     return ref_phs
 
 
-def _ref_phs_method1(ifg_paths, comp):
+def _ref_phs_method1(ifg_paths, params, comp):
     """
     MPI wrapper for reference phase computation using method 1.
     Refer to documentation for ref_est_phs.est_ref_phase_method1.
@@ -339,8 +362,7 @@ def _ref_phs_method1(ifg_paths, comp):
         """
         Convenient inner loop
         """
-        ifg = Ifg(ifg_path)
-        ifg.open(readonly=False)
+        ifg = shared.open_ifg_for_correction(ifg_path, params)
         phase_data = ifg.phase_data
         ref_phase = rpe._est_ref_phs_method1(phase_data, comp)
         phase_data -= ref_phase
@@ -355,14 +377,18 @@ def _ref_phs_method1(ifg_paths, comp):
     return ref_phs
 
 
-def process_ifgs(ifg_paths, params, rows, cols):
+def process_ifgs(ifg_paths, params, rows, cols, resume=False):
     """
     Top level function to perform PyRate workflow on given interferograms
 
     :param list ifg_paths: List of interferogram paths
     :param dict params: Dictionary of configuration parameters
-    :param int rows: Number of sub-tiles in y direction
-    :param int cols: Number of sub-tiles in x direction
+    :param int rows: Number of sub-tiles in y direction. Chosen with cols
+        from the tile memory budget if both are None, 1 if only rows is None
+    :param int cols: Number of sub-tiles in x direction. Chosen with rows
+        from the tile memory budget if both are None, 1 if only cols is None
+    :param bool resume: Skip the stages and tiles completed by a previous
+        run with the same configuration (optional)
     
     :return: refpt: tuple of reference pixel x and y position
     :rtype: tuple
@@ -371,52 +397,116 @@ def process_ifgs(ifg_paths, params, rows, cols):
     :return: vcmt: Variance-covariance matrix array
     :rtype: ndarray
     """
+    if rows is None and cols is None:
+        rows, cols = mpiops.run_once(_tile_layout, ifg_paths, params)
+    rows, cols = rows or 1, cols or 1
+
+    checkpoint = _Checkpoint(ifg_paths, params, rows, cols, resume)
+
     if mpiops.size > 1:  # turn of multiprocessing during mpi jobs
         params[cf.PARALLEL] = False
 
     tiles = mpiops.run_once(get_tiles, ifg_paths[0], rows, cols)
 
-    preread_ifgs = _create_ifg_dict(ifg_paths, params=params, tiles=tiles)
+    cached = {}
+    if params[cf.INCREMENTAL]:
+        config = _incremental_config(params)
+        cached = _load_incremental_state(ifg_paths, params)
+        if cached['refpixel'] is not None:
+            params[cf.REFX], params[cf.REFY] = cached['refpixel']
+
+    preread_ifgs = _create_ifg_dict(ifg_paths, params=params, tiles=tiles,
+                                    cached_preread=cached.get('preread'))
 
 #    _mst_calc(ifg_paths, params, tiles, preread_ifgs)
 
-    refpx, refpy = _ref_pixel_calc(ifg_paths, params)
+    refpx, refpy = checkpoint.run('refpixel', _ref_pixel_calc, ifg_paths,
+                                  params)
 
     # TODO: remove weather model derived APS delay here (pyaps.py)
 
     # remove non ifg keys
     _ = [preread_ifgs.pop(k) for k in ['gt', 'epochlist', 'md', 'wkt']]
 
-    _orb_fit_calc(ifg_paths, params, preread_ifgs)
+    if params[cf.FUSED_CORRECTIONS]:
+        # the corrections held in the phase cube are lost if the run is
+        # interrupted before they are written, so they are completed together
+        checkpoint.run('corrections', _correction_calc, ifg_paths, params,
+                       refpx, refpy, tiles, preread_ifgs, checkpoint)
+    else:
+        checkpoint.run('orbfit', _orb_fit_calc, ifg_paths, params,
+                       preread_ifgs)
 
-    _ref_phase_estimation(ifg_paths, params, refpx, refpy, preread_ifgs)
+        checkpoint.run('refphase', _ref_phase_estimation, ifg_paths, params,
+                       refpx, refpy, preread_ifgs)
 
-    _mst_calc(ifg_paths, params, tiles, preread_ifgs)
+        _mst_calc(ifg_paths, params, tiles, preread_ifgs, checkpoint)
 
-    # spatio-temporal aps filter
-    _wrap_spatio_temporal_filter(ifg_paths, params, tiles, preread_ifgs)
+        # spatio-temporal aps filter
+        checkpoint.run('aps', _wrap_spatio_temporal_filter, ifg_paths,
+                       params, tiles, preread_ifgs)
+
+    maxvar, vcmt = checkpoint.run('vcm', _maxvar_vcm_calc, ifg_paths, params,
+                                  preread_ifgs, cached.get('maxvar'))
 
-    maxvar, vcmt = _maxvar_vcm_calc(ifg_paths, params, preread_ifgs)
+    # corrections above have been written back to the phase cube in place,
+    # so timeseries and linrate read the corrected phase data
 
-    # save phase data tiles as numpy array for timeseries and linrate calc
-    shared.save_numpy_phase(ifg_paths, tiles, params)
+    _timeseries_calc(ifg_paths, params, vcmt, tiles, preread_ifgs, checkpoint)
 
-    _timeseries_calc(ifg_paths, params, vcmt, tiles, preread_ifgs)
+    _linrate_calc(ifg_paths, params, vcmt, tiles, preread_ifgs, checkpoint)
 
-    _linrate_calc(ifg_paths, params, vcmt, tiles, preread_ifgs)
+    if params[cf.INCREMENTAL]:
+        _save_incremental_state(ifg_paths, params, config, (refpx, refpy),
+                                maxvar, preread_ifgs, cached['hashes'])
 
     log.info('PyRate workflow completed')
     return (refpx, refpy), maxvar, vcmt
 
 
-def _linrate_calc(ifg_paths, params, vcmt, tiles, preread_ifgs):
+def _correction_calc(ifg_paths, params, refpx, refpy, tiles, preread_ifgs,
+                     checkpoint=None):
+    """
+    Apply the orbital, reference phase and APS corrections to the phase cube
+    and write each interferogram once after the last correction
+    """
+    _orb_fit_calc(ifg_paths, params, preread_ifgs)
+    _ref_phase_estimation(ifg_paths, params, refpx, refpy, preread_ifgs)
+    mpiops.comm.barrier()
+    _mst_calc(ifg_paths, params, tiles, preread_ifgs, checkpoint)
+    _wrap_spatio_temporal_filter(ifg_paths, params, tiles, preread_ifgs)
+    mpiops.comm.barrier()
+    shared.write_corrected_ifgs(ifg_paths, params)
+
+
+def _tile_layout(ifg_paths, params):
+    """
+    Number of tile rows and columns fitting the tile memory budget
+    """
+    if not params[cf.TILE_MEMORY]:
+        return 1, 1
+    shape = shared.raster_header(ifg_paths[0]).shape
+    # the number of epochs is at most one more than the number of ifgs
+    # in a connected network
+    rows, cols = shared.auto_tile_layout(shape, len(ifg_paths),
+                                         len(ifg_paths) + 1,
+                                         params[cf.TILE_MEMORY])
+    log.info('Using {} x {} tiles for a memory budget of {} MB'.format(
+        rows, cols, params[cf.TILE_MEMORY]))
+    return rows, cols
+
+
+def _linrate_calc(ifg_paths, params, vcmt, tiles, preread_ifgs,
+                  checkpoint=None):
     """
     MPI wrapper for linrate calculation
     """
-    process_tiles = mpiops.array_split(tiles)
+    process_tiles = shared.schedule_tiles(tiles, params)
     log.info('Calculating linear rate map')
     output_dir = params[cf.TMPDIR]
     for t in process_tiles:
+        if checkpoint and checkpoint.done('linrate', t.index):
+            continue
         log.info('Calculating linear rate of tile {}'.format(t.index))
         ifg_parts = [shared.IfgPart(p, t, preread_ifgs) for p in ifg_paths]
         mst_grid_n = np.load(os.path.join(output_dir,
@@ -433,36 +523,38 @@ def _linrate_calc(ifg_paths, params, vcmt, tiles, preread_ifgs):
         np.save(file=os.path.join(output_dir,
                                   'linsamples_{}.npy'.format(t.index)),
                 arr=samples)
+        if checkpoint:
+            checkpoint.mark('linrate', t.index)
     mpiops.comm.barrier()
 
 
-def _maxvar_vcm_calc(ifg_paths, params, preread_ifgs):
+def _maxvar_vcm_calc(ifg_paths, params, preread_ifgs, cached_maxvar=None):
     """
-    MPI wrapper for maxvar and vcmt computation
+    MPI wrapper for maxvar and vcmt computation. The maxvar of ifgs in
+    cached_maxvar (keyed by ifg path) is reused rather than recalculated.
     """
     log.info('Calculating maxvar and vcm')
     process_indices = mpiops.array_split(range(len(ifg_paths)))
 
     def _get_r_dist(ifg_path):
         """
-        Get RDIst class object
+        Get r_dist and its radial bins
         """
-        ifg = Ifg(ifg_path)
-        ifg.open()
-        r_dist = vcm_module.RDist(ifg)()
-        ifg.close()
-        return r_dist
+        rdist = vcm_module.RDist(shared.raster_header(ifg_path))
+        return rdist(), rdist.bins()
 
-    r_dist = mpiops.run_once(_get_r_dist, ifg_paths[0])
+    r_dist, rbins = mpiops.run_once(_get_r_dist, ifg_paths[0])
     prcs_ifgs = mpiops.array_split(ifg_paths)
-    process_maxvar = []
-    for n, i in enumerate(prcs_ifgs):
-        log.info('Calculating maxvar for {} of process ifgs {} of '
-                 'total {}'.format(n+1, len(prcs_ifgs), len(ifg_paths)))
-        process_maxvar.append(vcm_module.cvd(i, params, r_dist,
-                                             calc_alpha=True,
-                                             write_vals=True,
-                                             save_acg=True)[0])
+    cached_maxvar = cached_maxvar or {}
+    calc_ifgs = [i for i in prcs_ifgs if i not in cached_maxvar]
+    log.info('Calculating maxvar for {} of process ifgs {} of '
+             'total {}'.format(len(calc_ifgs), len(prcs_ifgs), len(ifg_paths)))
+    calc_maxvar = dict(zip(calc_ifgs, [
+        m for m, _ in vcm_module.cvd_batch(calc_ifgs, params, r_dist,
+                                           calc_alpha=True, write_vals=True,
+                                           save_acg=True, rbins=rbins)]))
+    process_maxvar = [cached_maxvar[i] if i in cached_maxvar
+                      else calc_maxvar[i] for i in prcs_ifgs]
     if mpiops.rank == MASTER_PROCESS:
         maxvar = np.empty(len(ifg_paths), dtype=np.float64)
         maxvar[process_indices] = process_maxvar
@@ -482,7 +574,8 @@ def _maxvar_vcm_calc(ifg_paths, params, preread_ifgs):
     return maxvar, vcmt
 
 
-def _timeseries_calc(ifg_paths, params, vcmt, tiles, preread_ifgs):
+def _timeseries_calc(ifg_paths, params, vcmt, tiles, preread_ifgs,
+                     checkpoint=None):
     """
     MPI wrapper for time series calculation.
     """
@@ -496,8 +589,10 @@ def _timeseries_calc(ifg_paths, params, vcmt, tiles, preread_ifgs):
         log.info('Calculating time series using SVD method')
 
     output_dir = params[cf.TMPDIR]
-    process_tiles = mpiops.array_split(tiles)
+    process_tiles = shared.schedule_tiles(tiles, params)
     for t in process_tiles:
+        if checkpoint and checkpoint.done('timeseries', t.index):
+            continue
         log.info('Calculating time series for tile {}'.format(t.index))
         ifg_parts = [shared.IfgPart(p, t, preread_ifgs) for p in ifg_paths]
         mst_tile = np.load(os.path.join(output_dir,
@@ -508,4 +603,195 @@ def _timeseries_calc(ifg_paths, params, vcmt, tiles, preread_ifgs):
                 arr=tsincr)
         np.save(file=os.path.join(output_dir, 'tscuml_{}.npy'.format(t.index)),
                 arr=tscum)
+        if checkpoint:
+            checkpoint.mark('timeseries', t.index)
+    mpiops.comm.barrier()
+
+
+def _uncorrected_paths(ifg_paths, preread_ifgs, meta):
+    """
+    Returns the ifgs for which a correction has not been performed yet
+    """
+    paths = [p for p in ifg_paths if meta not in preread_ifgs[p].metadata]
+    log.info('{} of {} interferograms require correction'.format(
+        len(paths), len(ifg_paths)))
+    return paths
+
+
+def _ifg_hashes(ifg_paths, known=None):
+    """
+    MPI wrapper returning the modification stamp and content hash of each
+    ifg file keyed by path. Files whose stamp matches the one in known, a
+    dictionary of earlier results, keep their hash without being reread.
+    """
+    def _hash(path):
+        """
+        md5 hash of a file read in chunks
+        """
+        md5 = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**20), b''):
+                md5.update(chunk)
+        return md5.hexdigest()
+
+    known = known or {}
+    process_hashes = {}
+    for p in mpiops.array_split(ifg_paths):
+        stamp = shared._file_stamp(p)
+        if p in known and known[p][0] == stamp:
+            process_hashes[p] = known[p]
+        else:
+            process_hashes[p] = (stamp, _hash(p))
+    return _join_dicts(mpiops.comm.allgather(process_hashes))
+
+
+def _incremental_config(params):
+    """
+    Configuration values the stored per-ifg results depend on
+    """
+    return [params[k] for k in [cf.NO_DATA_VALUE, cf.NAN_CONVERSION, cf.REFX,
+                                cf.REFY, cf.REFNX, cf.REFNY, cf.REF_CHIP_SIZE,
+                                cf.REF_MIN_FRAC]]
+
+
+def _load_incremental_state(ifg_paths, params):
+    """
+    Returns the results of the previous run for the ifgs whose files have not
+    changed since, as a dictionary with the preread ifgs and maxvar keyed by
+    ifg path, and the reference pixel.
+    """
+    cached = {'preread': {}, 'maxvar': {}, 'refpixel': None, 'hashes': {}}
+    state_file = join(params[cf.TMPDIR], INCREMENTAL_STATE_FILE)
+    if not os.path.exists(state_file):
+        log.info('No previous results found for incremental processing')
+        return cached
+    with open(state_file, 'rb') as f:
+        state = cp.load(f)
+    # only ifgs modified since the previous run are hashed
+    cached['hashes'] = state.get('hashes', {})
+    if state['config'] != _incremental_config(params):
+        log.info('Configuration changed, previous results are not reused')
+        return cached
+    cached['hashes'] = _ifg_hashes(ifg_paths, cached['hashes'])
+    for path in ifg_paths:
+        ifg_hash = cached['hashes'][path][1]
+        if ifg_hash in state['ifgs']:
+            preread = state['ifgs'][ifg_hash]['preread']
+            preread.path = path
+            cached['preread'][path] = preread
+            cached['maxvar'][path] = state['ifgs'][ifg_hash]['maxvar']
+    cached['refpixel'] = state['refpixel']
+    log.info('Reusing previous results for {} of {} interferograms'.format(
+        len(cached['preread']), len(ifg_paths)))
+    return cached
+
+
+def _save_incremental_state(ifg_paths, params, config, refpt, maxvar,
+                            preread_ifgs, hashes=None):
+    """
+    Save the per-ifg results of this run for incremental processing, keyed
+    by the content hash of the ifg files as left by this run. hashes are the
+    stamps and hashes found by _load_incremental_state, so that only the ifg
+    files rewritten by this run are hashed again.
+    """
+    hashes = _ifg_hashes(ifg_paths, hashes)
+
+    # corrections have updated the ifg metadata since the ifgs were preread
+    process_metadata = {}
+    for p in mpiops.array_split(ifg_paths):
+        process_metadata[p] = dict(shared.raster_header(p).meta_data)
+    metadata = _join_dicts(mpiops.comm.allgather(process_metadata))
+
+    if mpiops.rank == MASTER_PROCESS:
+        state = {'config': config,
+                 'refpixel': refpt,
+                 'hashes': hashes,
+                 'ifgs': {}}
+        for i, path in enumerate(ifg_paths):
+            preread = preread_ifgs[path]
+            preread.metadata = metadata[path]
+            state['ifgs'][hashes[path][1]] = {'preread': preread,
+                                              'maxvar': maxvar[i]}
+        with open(join(params[cf.TMPDIR], INCREMENTAL_STATE_FILE), 'wb') as f:
+            cp.dump(state, f)
+        # the corrected ifgs are still up to date outputs of prepifg
+        run_prepifg.refresh_manifest(params, ifg_paths)
     mpiops.comm.barrier()
+
+
+class _Checkpoint(object):
+    """
+    Atomic completion records of the workflow stages and of the tiles within
+    them, used to resume an interrupted run. A record is only valid for runs
+    with the same configuration, interferograms and tiling.
+    """
+    # parameters that do not change the results
+    _RUNTIME_PARAMS = [cf.PARALLEL, cf.PROCESSES]
+
+    def __init__(self, ifg_paths, params, rows, cols, resume=False):
+        self.resume = resume
+        self.dir = join(params[cf.TMPDIR], CHECKPOINT_DIR)
+        config = sorted((k, v) for k, v in params.items()
+                        if k not in self._RUNTIME_PARAMS)
+        self.hash = hashlib.md5(repr((config, [str(p) for p in ifg_paths],
+                                      rows, cols)).encode()).hexdigest()
+        if mpiops.rank == MASTER_PROCESS:
+            if not resume:
+                shutil.rmtree(self.dir, ignore_errors=True)
+            shared.mkdir_p(self.dir)
+        mpiops.comm.barrier()
+
+    def _path(self, stage, tile=None):
+        """
+        Path of the completion record of a stage or tile
+        """
+        name = stage if tile is None else '{}_{}'.format(stage, tile)
+        return join(self.dir, name + '.pk')
+
+    def load(self, stage, tile=None):
+        """
+        Returns the completion record of a stage or tile if it is valid for
+        this run, otherwise None
+        """
+        path = self._path(stage, tile)
+        if not (self.resume and os.path.exists(path)):
+            return None
+        with open(path, 'rb') as f:
+            record = cp.load(f)
+        return record if record['hash'] == self.hash else None
+
+    def done(self, stage, tile=None):
+        """
+        Returns True if the stage or tile was completed previously
+        """
+        if self.load(stage, tile) is None:
+            return False
+        log.info('Skipping completed {}{}'.format(
+            stage, '' if tile is None else ' tile {}'.format(tile)))
+        return True
+
+    def mark(self, stage, tile=None, data=None):
+        """
+        Atomically write the completion record of a stage or tile
+        """
+        path = self._path(stage, tile)
+        tmp_path = '{}.{}.tmp'.format(path, mpiops.rank)
+        with open(tmp_path, 'wb') as f:
+            cp.dump({'hash': self.hash, 'data': data}, f)
+        os.rename(tmp_path, path)
+
+    def run(self, stage, func, *args):
+        """
+        Run a stage on all processes unless it was completed previously.
+        The result of the stage is stored with its completion record.
+        """
+        record = self.load(stage)
+        if record is not None:
+            log.info('Skipping completed {}'.format(stage))
+            return record['data']
+        result = func(*args)
+        mpiops.comm.barrier()
+        if mpiops.rank == MASTER_PROCESS:
+            self.mark(stage, data=result)
+        mpiops.comm.barrier()
+        return result
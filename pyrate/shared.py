@@ -24,14 +24,12 @@ import logging
 import math
 from math import floor
 import os
-from os.path import basename, dirname, join
-import struct
+from os.path import basename, dirname, join, exists, getmtime
+import pickle as cp
 from datetime import date
 from itertools import product
 import numpy as np
 from numpy import where, nan, isnan, sum as nsum, isclose
-import pyproj
-import pkg_resources
 
 from pyrate import ifgconstants as ifc, mpiops
 from pyrate import config as cf
@@ -60,6 +58,26 @@ GDAL_Y_CELLSIZE = 5
 GDAL_X_FIRST = 0
 GDAL_Y_FIRST = 3
 
+# approximate size of row blocks streamed between raw files and GeoTIFFs
+BLOCK_BYTES = 64 * 2**20
+
+# memory-mapped phase cube file names in tmpdir
+PHASE_CUBE_DATA = 'phase_cube.dat'
+PHASE_CUBE_HEADER = 'phase_cube.pk'
+# metadata of corrections held in the phase cube but not yet written to the
+# interferogram, see write_corrected_ifgs
+PHASE_CUBE_PENDING = 'phase_cube_pending_{}.pk'
+# raster header index file name in tmpdir, see raster_headers
+HEADER_INDEX = 'raster_headers.pk'
+
+# header indices loaded in this process by file path, with their file stamp
+_HEADER_INDICES = {}
+# cell sizes by (lat, lon, x_step, y_step)
+_CELL_SIZES = {}
+
+# numpy major and minor version
+_NUMPY_VERSION = tuple(int(i) for i in np.__version__.split('.')[:2])
+
 
 def mkdir_p(path):
     """
@@ -135,6 +153,8 @@ class RasterBase(object):
         """
         Determine and add geographic data to object
         """
+        # the geotransform is read once, the properties below derive from it
+        self.geotransform = self.dataset.GetGeoTransform()
         # add some geographic data
         self.x_centre = int(self.ncols / 2)
         self.y_centre = int(self.nrows / 2)
@@ -163,21 +183,21 @@ class RasterBase(object):
         """
         Raster pixel size in X (easting) dimension
         """
-        return float(self.dataset.GetGeoTransform()[GDAL_X_CELLSIZE])
+        return float(self.geotransform[GDAL_X_CELLSIZE])
 
     @property
     def y_step(self):
         """
         Raster pixel size in Y (northing) dimension
         """
-        return float(self.dataset.GetGeoTransform()[GDAL_Y_CELLSIZE])
+        return float(self.geotransform[GDAL_Y_CELLSIZE])
 
     @property
     def x_first(self):
         """
         Raster western bounding coordinate
         """
-        return float(self.dataset.GetGeoTransform()[GDAL_X_FIRST])
+        return float(self.geotransform[GDAL_X_FIRST])
 
     @property
     def x_last(self):
@@ -191,7 +211,7 @@ class RasterBase(object):
         """
         Raster northern bounding coordinate
         """
-        return float(self.dataset.GetGeoTransform()[GDAL_Y_FIRST])
+        return float(self.geotransform[GDAL_Y_FIRST])
 
     @property
     def y_last(self):
@@ -276,6 +296,7 @@ class Ifg(RasterBase):
         self.wavelength = None
         self._nodata_value = None
         self.time_span = None
+        self._deferred_cube = None
 
     def open(self, readonly=None):
         """
@@ -439,11 +460,30 @@ class Ifg(RasterBase):
                                         self._nodata_value, atol=1e-6))
         return nan_count / float(self.num_cells)
 
+    def defer_writes(self, cube):
+        """
+        Take the phase data and metadata of this interferogram from the
+        phase cube, including corrections not yet written to the file.
+        write_modified_phase then only updates the phase cube.
+
+        :param PhaseCube cube: Phase cube containing this interferogram
+        """
+        self._deferred_cube = cube
+        self.phase_data = cube.read_full(self.data_path)
+        pending = cube.pending_meta(self.data_path)
+        if pending:
+            self.meta_data.update(pending)
+            self.nan_converted = \
+                self.meta_data.get(ifc.NAN_STATUS) == ifc.NAN_CONVERTED
+            self.mm_converted = \
+                self.meta_data.get(ifc.DATA_UNITS) == MILLIMETRES
+
     def write_modified_phase(self, data=None):
         """
-        Write updated phase data to file on disk.
+        Write updated phase data to file on disk, or only to the phase cube
+        if writes are deferred (see defer_writes).
         """
-        if self.is_read_only:
+        if self._deferred_cube is None and self.is_read_only:
             raise IOError("Cannot write to read only Ifg")
 
         # keep this block
@@ -458,11 +498,34 @@ class Ifg(RasterBase):
             data_r, data_c = data.shape
             assert data_r == self.nrows and data_c == self.ncols
             self.phase_data = data
+        if self._deferred_cube is not None:
+            self._deferred_cube.write(self.data_path, self.phase_data,
+                                      meta_data=self.meta_data)
+            return
+        self._write_dataset()
+        self._update_phase_cube()
+
+    def _write_dataset(self):
+        """
+        Write the phase data and metadata to the file on disk.
+        """
         self.phase_band.WriteArray(self.phase_data)
         for k, v in self.meta_data.items():
             self.dataset.SetMetadataItem(k, v)
         self.dataset.FlushCache()
 
+    def _update_phase_cube(self):
+        """
+        Write the phase data back to the memory-mapped phase cube in place,
+        if a cube containing this interferogram exists.
+        """
+        tmpdir = join(dirname(self.data_path), cf.TMPDIR)
+        if not exists(join(tmpdir, PHASE_CUBE_HEADER)):
+            return
+        cube = PhaseCube.load(tmpdir)
+        if self.data_path in cube:
+            cube.write(self.data_path, self.phase_data)
+
 # Is this functionality used?
 #    def save_numpy_phase(self, numpy_file):
 #        """
@@ -494,10 +557,8 @@ class IfgPart(object):
             self.master = ifg.master
             self.slave = ifg.slave
             self.time_span = ifg.time_span
-            phase_file = 'phase_data_{}_{}.npy'.format(
-                basename(ifg_or_path).split('.')[0], tile.index)
-            self.phase_data = np.load(join(dirname(ifg_or_path), cf.TMPDIR,
-                                           phase_file))
+            cube = PhaseCube.load(join(dirname(ifg_or_path), cf.TMPDIR))
+            self.phase_data = cube.read(ifg_or_path, tile)
         else:
             # check if Ifg was sent.
             if isinstance(ifg_or_path, Ifg):
@@ -544,6 +605,224 @@ class IfgPart(object):
         return self.c_end - self.c_start
 
 
+class PhaseCube(object):
+    """
+    Memory-mapped 3-D phase data store (ifg x row x col) on disk. The phase
+    data are stored tile by tile so that a tile of all interferograms is
+    contiguous and can be opened without copying. Processes on the same node
+    share the data through the operating system page cache.
+    """
+    # open cubes by header file, reused until the header changes on disk
+    _cache = {}
+
+    def __init__(self, tmpdir, ifg_names, tiles):
+        """
+        Phase cube constructor.
+
+        :param str tmpdir: Directory containing the phase cube files
+        :param list ifg_names: Interferogram names in cube order
+        :param list tiles: List of pyrate.shared.Tile instances
+        """
+        self.data_path = join(tmpdir, PHASE_CUBE_DATA)
+        self.header_path = join(tmpdir, PHASE_CUBE_HEADER)
+        self.ifg_names = list(ifg_names)
+        self.index = {n: i for i, n in enumerate(self.ifg_names)}
+        self.tiles = sorted(tiles, key=lambda t: t.index)
+        self._offsets = {}
+        offset = 0
+        for t in self.tiles:
+            self._offsets[t.index] = offset
+            offset += len(self.ifg_names) * _tile_size(t)
+        self.size = offset  # number of float32 values
+        self.shape = (max(t.bottom_right_y for t in self.tiles),
+                      max(t.bottom_right_x for t in self.tiles))
+        self._tmpdir = tmpdir
+        self._valid_counts = None
+
+    def __contains__(self, ifg_path):
+        return _ifg_name(ifg_path) in self.index
+
+    @classmethod
+    def create(cls, tmpdir, ifg_paths, tiles):
+        """
+        Create an empty phase cube and its header in tmpdir.
+
+        :param str tmpdir: Directory to save the phase cube files
+        :param list ifg_paths: List of interferogram paths
+        :param list tiles: List of pyrate.shared.Tile instances
+
+        :return: cube: PhaseCube instance
+        :rtype: PhaseCube
+        """
+        cube = cls(tmpdir, [_ifg_name(p) for p in ifg_paths], tiles)
+        for p in ifg_paths:  # the new cube holds no corrections yet
+            cube.clear_pending(p)
+        with open(cube.data_path, 'wb') as f:
+            f.truncate(cube.size * np.dtype(np.float32).itemsize)
+        header = {'ifg_names': cube.ifg_names,
+                  'tiles': [(t.index, t.top_left, t.bottom_right)
+                            for t in cube.tiles]}
+        with open(cube.header_path, 'wb') as f:
+            cp.dump(header, f)
+        return cube
+
+    @classmethod
+    def load(cls, tmpdir):
+        """
+        Open an existing phase cube in tmpdir.
+
+        :param str tmpdir: Directory containing the phase cube files
+
+        :return: cube: PhaseCube instance
+        :rtype: PhaseCube
+        """
+        header_path = join(tmpdir, PHASE_CUBE_HEADER)
+        mtime = getmtime(header_path)
+        if header_path in cls._cache and \
+                cls._cache[header_path][0] == mtime:
+            return cls._cache[header_path][1]
+        with open(header_path, 'rb') as f:
+            header = cp.load(f)
+        tiles = [Tile(*t) for t in header['tiles']]
+        cube = cls(tmpdir, header['ifg_names'], tiles)
+        cls._cache[header_path] = (mtime, cube)
+        return cube
+
+    def tile_data(self, tile, mode='c'):
+        """
+        Memory-map the phase data of all interferograms in a tile.
+
+        :param Tile tile: Tile instance
+        :param str mode: numpy.memmap mode. The default copy-on-write mode
+            leaves the phase cube on disk unchanged
+
+        :return: data: (nifgs, nrows, ncols) array
+        :rtype: numpy.memmap
+        """
+        t = self.tiles[tile.index]
+        shape = (len(self.ifg_names), t.bottom_right_y - t.top_left_y,
+                 t.bottom_right_x - t.top_left_x)
+        return np.memmap(self.data_path, dtype=np.float32, mode=mode,
+                         offset=self._offsets[t.index] *
+                         np.dtype(np.float32).itemsize,
+                         shape=shape)
+
+    def valid_counts(self):
+        """
+        Return the number of valid (non-NaN) phase values of all
+        interferograms in each tile, in tile index order.
+
+        :return: counts: 1-D array of valid value counts
+        :rtype: ndarray
+        """
+        if self._valid_counts is None:
+            self._valid_counts = np.array(
+                [np.count_nonzero(~np.isnan(self.tile_data(t, mode='r')))
+                 for t in self.tiles])
+        return self._valid_counts
+
+    def read(self, ifg_path, tile):
+        """
+        Return the phase data of one interferogram in a tile without copying.
+
+        :param str ifg_path: Interferogram path
+        :param Tile tile: Tile instance
+
+        :return: phase_data: 2-D array
+        :rtype: numpy.memmap
+        """
+        return self.tile_data(tile)[self.index[_ifg_name(ifg_path)]]
+
+    def read_full(self, ifg_path):
+        """
+        Return a copy of the full phase data of one interferogram.
+
+        :param str ifg_path: Interferogram path
+
+        :return: phase_data: 2-D array
+        :rtype: ndarray
+        """
+        phase_data = np.empty(self.shape, dtype=np.float32)
+        for t in self.tiles:
+            phase_data[t.top_left_y:t.bottom_right_y,
+                       t.top_left_x:t.bottom_right_x] = self.read(ifg_path, t)
+        return phase_data
+
+    def pending_meta(self, ifg_path):
+        """
+        Return the metadata of the corrections of one interferogram held in
+        the cube but not yet written to its file, None if there are none.
+
+        :param str ifg_path: Interferogram path
+
+        :return: meta_data: Interferogram metadata dictionary
+        :rtype: dict
+        """
+        path = self._pending_path(ifg_path)
+        if not exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return cp.load(f)
+
+    def clear_pending(self, ifg_path):
+        """
+        Discard the pending metadata of one interferogram.
+
+        :param str ifg_path: Interferogram path
+        """
+        if exists(self._pending_path(ifg_path)):
+            os.remove(self._pending_path(ifg_path))
+
+    def _pending_path(self, ifg_path):
+        """
+        File holding the pending metadata of an interferogram
+        """
+        return join(self._tmpdir,
+                    PHASE_CUBE_PENDING.format(_ifg_name(ifg_path)))
+
+    def write(self, ifg_path, phase_data, meta_data=None):
+        """
+        Write the full phase data of one interferogram into the cube in place.
+
+        :param str ifg_path: Interferogram path
+        :param ndarray phase_data: 2-D phase data array
+        :param dict meta_data: Metadata of the corrections applied to the
+            phase data, written to the interferogram file later by
+            write_corrected_ifgs (optional)
+        """
+        k = self.index[_ifg_name(ifg_path)]
+        nifgs = len(self.ifg_names)
+        data = np.memmap(self.data_path, dtype=np.float32, mode='r+',
+                         shape=(self.size,))
+        for t in self.tiles:
+            start = self._offsets[t.index]
+            block = data[start:start + nifgs * _tile_size(t)]
+            block = block.reshape((nifgs, t.bottom_right_y - t.top_left_y,
+                                   t.bottom_right_x - t.top_left_x))
+            block[k] = phase_data[t.top_left_y:t.bottom_right_y,
+                                  t.top_left_x:t.bottom_right_x]
+        data.flush()
+        del data
+        if meta_data is not None:
+            with open(self._pending_path(ifg_path), 'wb') as f:
+                cp.dump(dict(meta_data), f)
+
+
+def _ifg_name(ifg_path):
+    """
+    Interferogram name used as key in the phase cube
+    """
+    return basename(ifg_path).split('.')[0]
+
+
+def _tile_size(tile):
+    """
+    Number of pixels in a tile
+    """
+    return (tile.bottom_right_y - tile.top_left_y) * \
+        (tile.bottom_right_x - tile.top_left_x)
+
+
 class Incidence(RasterBase):   # pragma: no cover
     """
     Class for storing viewing geometry data.
@@ -676,15 +955,13 @@ def nanmedian(x):
     :rtype: float
     """
     # pylint: disable=no-member
-    version = [int(i) for i in
-               pkg_resources.get_distribution("numpy").version.split('.')[:2]]
-    if version[0] == 1 and version[1] > 9:
+    if _NUMPY_VERSION > (1, 9):
         return np.nanmedian(x)
     else:   # pragma: no cover
         return np.median(x[~np.isnan(x)])
 
 
-def write_geotiff(header, data_path, dest, nodata):
+def write_geotiff(header, data_path, dest, nodata, creation_options=None):
     # pylint: disable=too-many-statements
     """
     Creates a copy of input image data (interferograms, DEM, incidence maps
@@ -694,6 +971,8 @@ def write_geotiff(header, data_path, dest, nodata):
     :param str data_path: Input file
     :param str dest: Output destination file
     :param float nodata: No-data value
+    :param list creation_options: GDAL GTiff creation options,
+        e.g. ['COMPRESS=LZW', 'TILED=YES']
 
     :return: None, file saved to disk
     """
@@ -704,18 +983,17 @@ def write_geotiff(header, data_path, dest, nodata):
     ifg_proc = header[ifc.PYRATE_INSAR_PROCESSOR]
     ncols = header[ifc.PYRATE_NCOLS]
     nrows = header[ifc.PYRATE_NROWS]
-    bytes_per_col, fmtstr = _data_format(ifg_proc, is_ifg, ncols)
-    if is_ifg and ifg_proc == ROIPAC:
-        # roipac ifg has 2 bands
-        _check_raw_data(bytes_per_col*2, data_path, ncols, nrows)
-    else:
-        _check_raw_data(bytes_per_col, data_path, ncols, nrows)
+    bytes_per_col, raw_dtype = _data_format(ifg_proc, is_ifg)
+    # roipac ifg has 2 row interleaved bands, phase is the second band
+    nbands = 2 if (is_ifg and ifg_proc == ROIPAC) else 1
+    _check_raw_data(bytes_per_col*nbands, data_path, ncols, nrows)
 
     _check_pixel_res_mismatch(header)
 
     driver = gdal.GetDriverByName("GTiff")
     dtype = gdal.GDT_Float32 if (is_ifg or is_incidence) else gdal.GDT_Int16
-    ds = driver.Create(dest, ncols, nrows, 1, dtype)
+    ds = driver.Create(dest, ncols, nrows, 1, dtype,
+                       options=creation_options or [])
 
     # write pyrate parameters to headers
     if is_ifg:
@@ -749,43 +1027,43 @@ def write_geotiff(header, data_path, dest, nodata):
     band = ds.GetRasterBand(1)
     band.SetNoDataValue(nodata)
 
-    row_bytes = ncols * bytes_per_col
-
-    with open(data_path, 'rb') as f:
-        for y in range(nrows):
-            if ifg_proc == ROIPAC:
-                if is_ifg:
-                    f.seek(row_bytes, 1)  # skip interleaved band 1
-
-            data = struct.unpack(fmtstr, f.read(row_bytes))
-            #else: # GAMMA
-            #    data = struct.unpack(fmtstr, f.read(ncols * 4))
-
-            band.WriteArray(np.array(data).reshape(1, ncols), yoff=y)
+    raw = np.memmap(data_path, dtype=raw_dtype, mode='r',
+                    shape=(nrows, nbands, ncols))
+    block_rows = _block_rows(ncols * nbands * bytes_per_col)
+    for y in range(0, nrows, block_rows):
+        # convert block to native byte order for GDAL
+        data = raw[y:y + block_rows, -1, :].astype(
+            raw_dtype.newbyteorder('='))
+        band.WriteArray(data, yoff=y)
+    del raw
 
     # Needed? Only in ROIPAC code
     ds = None  # manual close
     del ds
 
 
-def _data_format(ifg_proc, is_ifg, ncols):
+def _block_rows(row_bytes):
     """
-    Convenience function to determine the bytesize and format of input files
+    Convenience function to determine the number of rows in a block
+    """
+    return max(1, BLOCK_BYTES // row_bytes)
+
+
+def _data_format(ifg_proc, is_ifg):
+    """
+    Convenience function to determine the bytesize and dtype of input files
     """
     if ifg_proc == GAMMA:
-        fmtstr = '!' + ('f' * ncols)  # data format is big endian float32s
-        bytes_per_col = 4
+        dtype = np.dtype('>f4')  # data format is big endian float32s
     elif ifg_proc == ROIPAC:
         if is_ifg:
-            fmtstr = '<' + ('f' * ncols)  # roipac ifgs are little endian float32s
-            bytes_per_col = 4
+            dtype = np.dtype('<f4')  # roipac ifgs are little endian float32s
         else:
-            fmtstr = '<' + ('h' * ncols)  # roipac DEM is little endian signed int16
-            bytes_per_col = 2
+            dtype = np.dtype('<i2')  # roipac DEM is little endian signed int16
     else:  # pragma: no cover
         msg = 'Unrecognised InSAR Processor: %s' % ifg_proc
         raise GeotiffException(msg)
-    return bytes_per_col, fmtstr
+    return dtype.itemsize, dtype
 
 
 def _check_raw_data(bytes_per_col, data_path, ncols, nrows):
@@ -827,21 +1105,27 @@ def write_unw_from_data_or_geotiff(geotif_or_data, dest_unw, ifg_proc):
     """
     if ifg_proc != 1:
         raise NotImplementedError('only supports GAMMA format for now')
+    ds = None
     if isinstance(geotif_or_data, str):
         assert os.path.exists(geotif_or_data), 'make sure geotif exists'
         ds = gdal.Open(geotif_or_data)
-        data = ds.ReadAsArray()
-        ds = None
+        band = ds.GetRasterBand(1)
+        nrows, ncols = ds.RasterYSize, ds.RasterXSize
     else:
         data = geotif_or_data
+        nrows, ncols = data.shape
 
-    nrows, ncols = data.shape
-    fmtstr = '!' + ('f' * ncols)  # data format is big endian float32s
-
+    block_rows = _block_rows(ncols * 4)
     with open(dest_unw, 'wb') as f:
-        for y in range(nrows):
-            col_data = struct.pack(fmtstr, *data[y, :])
-            f.write(col_data)
+        for y in range(0, nrows, block_rows):
+            nblock = min(block_rows, nrows - y)
+            if ds is not None:
+                block = band.ReadAsArray(0, y, ncols, nblock)
+            else:
+                block = data[y:y + nblock, :]
+            # data format is big endian float32s
+            np.asarray(block, dtype='>f4').tofile(f)
+    ds = None
 
 
 def write_output_geotiff(md, gt, wkt, data, dest, nodata):
@@ -887,9 +1171,9 @@ class GeotiffException(Exception):
 def create_tiles(shape, nrows=2, ncols=2):
     """
     Return a list of tiles containing nrows x ncols with each tile preserving
-    the physical layout of original array. The number of rows can be changed
-    (increased) such that the resulting tiles with float32's do not exceed
-    500MB in memory. When the array shape (rows, columns) are not divisible
+    the physical layout of original array. See auto_tile_layout for choosing
+    nrows and ncols that fit a memory budget. When the array shape
+    (rows, columns) are not divisible
     by (nrows, ncols) then some of the array dimensions can change according
     to numpy.array_split.
 
@@ -914,6 +1198,38 @@ def create_tiles(shape, nrows=2, ncols=2):
             for i, (r, c) in enumerate(product(row_arr, col_arr))]
 
 
+def auto_tile_layout(shape, nifgs, nepochs, memory, dtype=np.float32):
+    """
+    Return the number of rows and columns of tiles such that the working set
+    of the time series and linear rate calculation of each tile (phase data,
+    MST and time series arrays) fits in the memory budget. Tiles span the
+    full interferogram width where possible.
+
+    :param tuple shape: Shape tuple (2-element) of interferogram.
+    :param int nifgs: Number of interferograms
+    :param int nepochs: Number of epochs
+    :param float memory: Memory budget per process in MB
+    :param dtype: Data type of the phase data (optional)
+
+    :return: rows: Number of rows of tiles
+    :rtype: int
+    :return: cols: Number of columns of tiles
+    :rtype: int
+    """
+    itemsize = np.dtype(dtype).itemsize
+    # tile phase data and its stacked copy, boolean MST and the incremental,
+    # cumulative and velocity time series arrays
+    pixel_bytes = 2 * nifgs * itemsize + nifgs + \
+        3 * (nepochs - 1) * itemsize
+    max_pixels = max(int(memory * 2**20 // pixel_bytes), 1)
+    no_y, no_x = shape
+    tile_rows = max_pixels // no_x
+    if tile_rows:
+        return int(np.ceil(no_y / float(tile_rows))), 1
+    # a single interferogram row does not fit, split the rows as well
+    return no_y, int(np.ceil(no_x / float(max_pixels)))
+
+
 def get_tiles(ifg_path, rows, cols):
     """
     Break up the interferograms into smaller tiles based on user supplied
@@ -926,11 +1242,8 @@ def get_tiles(ifg_path, rows, cols):
     :return: tiles: List of shared.Tile instances
     :rtype: list
     """
-    ifg = Ifg(ifg_path)
-    ifg.open(readonly=True)
-    tiles = create_tiles(ifg.shape, nrows=rows, ncols=cols)
-    ifg.close()
-    return tiles
+    return create_tiles(raster_header(ifg_path).shape, nrows=rows,
+                        ncols=cols)
 
 
 class Tile():
@@ -996,15 +1309,21 @@ def cell_size(lat, lon, x_step, y_step):
         msg = "No UTM zone for polar region: > 84 degrees N or < 80 degrees S"
         raise ValueError(msg)
 
-    zone = _utm_zone(lon)
-    p0 = pyproj.Proj(proj='latlong', ellps='WGS84')
-    p1 = pyproj.Proj(proj='utm', zone=zone, ellps='WGS84')
-    assert p0.is_latlong()
-    assert not p1.is_latlong()
+    # interferograms of a stack share their geometry, so the projections
+    # are only set up once
+    key = (lat, lon, x_step, y_step)
+    if key not in _CELL_SIZES:
+        import pyproj  # pyproj is slow to import
+        zone = _utm_zone(lon)
+        p0 = pyproj.Proj(proj='latlong', ellps='WGS84')
+        p1 = pyproj.Proj(proj='utm', zone=zone, ellps='WGS84')
+        assert p0.is_latlong()
+        assert not p1.is_latlong()
 
-    x0, y0 = pyproj.transform(p0, p1, lon, lat)
-    x1, y1 = pyproj.transform(p0, p1, lon + x_step, lat + y_step)
-    return tuple(abs(e) for e in (x1 - x0, y1 - y0))
+        x0, y0 = pyproj.transform(p0, p1, lon, lat)
+        x1, y1 = pyproj.transform(p0, p1, lon + x_step, lat + y_step)
+        _CELL_SIZES[key] = tuple(abs(e) for e in (x1 - x0, y1 - y0))
+    return _CELL_SIZES[key]
 
 
 def _utm_zone(longitude):
@@ -1037,6 +1356,136 @@ class PrereadIfg():
         self.metadata = metadata
 
 
+class RasterHeader(object):
+    """
+    Geometry and metadata of a raster file, with the same attributes as an
+    opened RasterBase (and the dates and wavelength of an opened Ifg), for
+    use where the raster data are not needed. See raster_headers.
+    """
+    # pylint: disable=too-many-instance-attributes
+    _ATTRS = ['nrows', 'ncols', 'x_step', 'y_step', 'x_first', 'y_first',
+              'x_last', 'y_last', 'x_centre', 'y_centre', 'lat_centre',
+              'long_centre', 'x_size', 'y_size', 'geotransform']
+    _IFG_ATTRS = ['master', 'slave', 'time_span', 'wavelength']
+
+    def __init__(self, path):
+        """
+        Read the header of a raster file.
+
+        :param str path: Raster file path
+        """
+        self.data_path = path
+        self.stamp = _file_stamp(path)
+        dataset = gdal.Open(path)
+        if dataset is None:
+            raise RasterException("Error opening %s" % path)
+        self.meta_data = dataset.GetMetadata()
+        self.projection = dataset.GetProjection()
+        self.nodata_value = dataset.GetRasterBand(PHASE_BAND).GetNoDataValue()
+        if ifc.MASTER_DATE in self.meta_data:
+            raster = Ifg(dataset)
+            raster.initialize()
+            attrs = self._ATTRS + self._IFG_ATTRS
+        else:
+            raster = RasterBase(dataset)
+            attrs = self._ATTRS
+        for attr in attrs:
+            setattr(self, attr, getattr(raster, attr))
+        dataset = None  # close dataset
+
+    def __repr__(self):
+        return "RasterHeader('%s')" % self.data_path
+
+    @property
+    def shape(self):
+        """
+        Returns tuple of (Y,X) shape of the raster (as per numpy.shape).
+        """
+        return self.nrows, self.ncols
+
+    @property
+    def num_cells(self):
+        """
+        Total number of pixels in raster
+        """
+        return self.nrows * self.ncols
+
+
+def raster_headers(paths, tmpdir=None):
+    """
+    Return the headers of the given rasters without opening them, from the
+    header index file in tmpdir. The index is loaded once per process and
+    the headers of rasters that are new or modified since they were indexed
+    (by file modification time in ns and size) are read and saved to the
+    index.
+
+    :param list paths: List of raster file paths
+    :param str tmpdir: Directory of the header index, by default the tmpdir
+        next to the rasters. The index is kept in memory only if the
+        directory does not exist.
+
+    :return: headers: List of RasterHeader instances
+    :rtype: list
+    """
+    if not len(paths):
+        return []
+    if tmpdir is None:
+        tmpdir = join(dirname(paths[0]), cf.TMPDIR)
+    index_path = join(tmpdir, HEADER_INDEX)
+    index = _load_header_index(index_path)
+    stale = [p for p in paths
+             if p not in index or index[p].stamp != _file_stamp(p)]
+    for p in stale:
+        index[p] = RasterHeader(p)
+    if stale and exists(tmpdir):
+        tmp_path = '{}.{}.tmp'.format(index_path, mpiops.rank)
+        with open(tmp_path, 'wb') as f:
+            cp.dump(index, f)
+        os.rename(tmp_path, index_path)
+        _HEADER_INDICES[index_path] = (_file_stamp(index_path), index)
+    return [index[p] for p in paths]
+
+
+def raster_header(path, tmpdir=None):
+    """
+    Return the header of a raster without opening it. See raster_headers.
+
+    :param str path: Raster file path
+    :param str tmpdir: Directory of the header index (optional)
+
+    :return: header: RasterHeader instance
+    :rtype: RasterHeader
+    """
+    return raster_headers([path], tmpdir)[0]
+
+
+def _file_stamp(path):
+    """
+    Modification time in ns and size of a file. The size detects changes
+    within one timestamp tick on file systems with coarse timestamps.
+    """
+    st = os.stat(path)
+    # Python 2 has no st_mtime_ns
+    return getattr(st, 'st_mtime_ns', st.st_mtime), st.st_size
+
+
+def _load_header_index(index_path):
+    """
+    Header index in index_path, reloaded if it was saved by another process
+    """
+    stamp = _file_stamp(index_path) if exists(index_path) else None
+    if index_path in _HEADER_INDICES:
+        cached_stamp, index = _HEADER_INDICES[index_path]
+        if stamp is None or stamp == cached_stamp:
+            return index
+    index = {}
+    if stamp is not None:
+        with open(index_path, 'rb') as f:
+            index = cp.load(f)
+    _HEADER_INDICES[index_path] = (stamp, index)
+    return index
+
+
 def _prep_ifg(ifg_path, params):
     """
     Wrapper for reading an interferogram file and creating an Ifg object
@@ -1056,7 +1505,9 @@ def _prep_ifg(ifg_path, params):
 
 def save_numpy_phase(ifg_paths, tiles, params):
     """
-    Save interferogram phase data as numpy array file on disk.
+    Save interferogram phase data to the memory-mapped phase cube on disk.
+    Subsequent corrections written with Ifg.write_modified_phase update the
+    cube in place.
 
     :param list ifg_paths: List of strings for interferogram paths
     :param list tiles: List of pyrate.shared.Tile instances
@@ -1066,21 +1517,106 @@ def save_numpy_phase(ifg_paths, tiles, params):
     """
     process_ifgs = mpiops.array_split(ifg_paths)
     outdir = params[cf.TMPDIR]
-    if not os.path.exists(outdir):
-        mkdir_p(outdir)
+    if mpiops.rank == 0:
+        if not os.path.exists(outdir):
+            mkdir_p(outdir)
+        PhaseCube.create(outdir, ifg_paths, tiles)
+    mpiops.comm.barrier()
+    cube = PhaseCube.load(outdir)
     for ifg_path in process_ifgs:
         ifg = Ifg(ifg_path)
         ifg.open()
-        phase_data = ifg.phase_data
-        bname = basename(ifg_path).split('.')[0]
-        for t in tiles:
-            p_data = phase_data[t.top_left_y:t.bottom_right_y,
-                                t.top_left_x:t.bottom_right_x]
-            phase_file = 'phase_data_{}_{}.npy'.format(bname, t.index)
-            np.save(file=join(outdir, phase_file),
-                    arr=p_data)
+        cube.write(ifg_path, ifg.phase_data)
+        ifg.close()
+    mpiops.comm.barrier()
+
+
+def open_ifg_for_correction(ifg_path, params, readonly=False):
+    """
+    Open an interferogram to be corrected. With fused corrections the phase
+    data are read from the phase cube, including the corrections applied so
+    far, and the corrected phase is written back to the phase cube only.
+
+    :param str ifg_path: Interferogram path
+    :param dict params: Dictionary of configuration parameters
+    :param bool readonly: Open the interferogram read-only when the
+        corrections are not fused, to read the corrected phase only (optional)
+
+    :return: ifg: Interferogram class instance
+    :rtype: Ifg
+    """
+    ifg = Ifg(ifg_path)
+    if not _fused_corrections(params):
+        ifg.open(readonly=readonly)
+        return ifg
+    ifg.open(readonly=True)
+    ifg.defer_writes(PhaseCube.load(params[cf.TMPDIR]))
+    return ifg
+
+
+def write_corrected_ifgs(ifg_paths, params):
+    """
+    Write the corrected phase data and metadata held in the phase cube to the
+    interferograms, with a single write per interferogram. MPI-enabled: each
+    process writes its share of the interferograms.
+
+    :param list ifg_paths: List of interferogram paths
+    :param dict params: Dictionary of configuration parameters
+
+    :return: None, interferograms are updated on disk
+    """
+    if not _fused_corrections(params):
+        return
+    cube = PhaseCube.load(params[cf.TMPDIR])
+    for ifg_path in mpiops.array_split(ifg_paths):
+        pending = cube.pending_meta(ifg_path)
+        if pending is None:  # no corrections applied
+            continue
+        ifg = Ifg(ifg_path)
+        ifg.open(readonly=False)
+        ifg.meta_data.update(pending)
+        ifg.phase_data = cube.read_full(ifg_path)
+        ifg._write_dataset()
         ifg.close()
+        cube.clear_pending(ifg_path)
     mpiops.comm.barrier()
+    log.info('Written corrected interferograms in process {}'.format(
+        mpiops.rank))
+
+
+def _fused_corrections(params):
+    """
+    True if corrections are held in an existing phase cube until written by
+    write_corrected_ifgs
+    """
+    return bool(params and params.get(cf.FUSED_CORRECTIONS)) and \
+        exists(join(params[cf.TMPDIR], PHASE_CUBE_HEADER))
+
+
+def schedule_tiles(tiles, params):
+    """
+    Hand out tiles to the MPI processes on demand using mpiops.schedule,
+    the tiles with the most valid phase values in the phase cube first.
+
+    :param list tiles: List of pyrate.shared.Tile instances
+    :param dict params: Dictionary of configuration parameters
+
+    :return: Tiles to be processed by this process
+    :rtype: generator
+    """
+    costs = mpiops.run_once(_tile_costs, tiles, params[cf.TMPDIR])
+    return mpiops.schedule(tiles, costs)
+
+
+def _tile_costs(tiles, tmpdir):
+    """
+    Valid phase value counts of tiles used as cost estimate, None if there
+    is no phase cube to count them
+    """
+    if not os.path.exists(join(tmpdir, PHASE_CUBE_HEADER)):
+        return None
+    counts = PhaseCube.load(tmpdir).valid_counts()
+    return [counts[t.index] for t in tiles]
 
 
 def get_geotiff_header_info(ifg_path):
@@ -1096,12 +1632,9 @@ def get_geotiff_header_info(ifg_path):
     :return: wkt: GDAL projection information for the data
     :rtype: list
     """
-    ds = gdal.Open(ifg_path)
-    md = ds.GetMetadata()  # get metadata for writing on output tifs
-    gt = ds.GetGeoTransform()  # get geographical bounds of data
-    wkt = ds.GetProjection()  # get projection of data
-    ds = None  # close dataset
-    return gt, md, wkt
+    header = raster_header(ifg_path)
+    # copy the metadata, callers add their own items for the output tifs
+    return header.geotransform, dict(header.meta_data), header.projection
 
 
 def warp_required(xlooks, ylooks, crop):
@@ -21,19 +21,22 @@ and 'tsinvlap.m' contained in the Pirate package.
 # pylint: disable=too-many-locals
 # pylint: disable=too-many-arguments
 import itertools
+import logging
+from collections import OrderedDict
 from numpy import (where, isnan, nan, diff, zeros,
                    float32, cumsum, dot, delete, asarray)
 from numpy.linalg import matrix_rank, pinv, cholesky
 import numpy as np
 from scipy.linalg import qr
-import matplotlib.pyplot as plt
 from joblib import Parallel, delayed
 
-from pyrate.algorithm import master_slave_ids, get_epochs
+from pyrate.algorithm import master_slave_ids, get_epochs, pattern_groups
 from pyrate import config as cf
 from pyrate.config import ConfigException
 from pyrate import mst as mst_module
 
+log = logging.getLogger(__name__)
+
 
 def _time_series_setup(ifgs, mst, params):
     """
@@ -156,11 +159,9 @@ def time_series(ifgs, params, vcmt=None, mst=None):
             for (i, j) in itertools.product(range(nrows), range(ncols))))
         tsvel_matrix = np.reshape(res, newshape=(nrows, ncols, res.shape[1]))
     else:
-        for row in range(nrows):
-            for col in range(ncols):
-                tsvel_matrix[row, col] = _time_series_by_pixel(
-                    row, col, b0_mat, sm_factor, sm_order, ifg_data, mst,
-                    nvelpar, p_thresh, interp, vcmt, ts_method)
+        tsvel_matrix = _time_series_by_pattern(
+            b0_mat, sm_factor, sm_order, ifg_data, mst, nvelpar, p_thresh,
+            interp, vcmt, ts_method, params[cf.TIME_SERIES_CACHE_SIZE])
 
     tsvel_matrix = where(tsvel_matrix == 0, nan, tsvel_matrix)
     # SB: do the span multiplication as a numpy linalg operation, MUCH faster
@@ -188,7 +189,7 @@ def _time_series_by_rows(row, b0_mat, sm_factor, sm_order, ifg_data, mst, ncols,
     return tsvel
 
 
-def _remove_rank_def_rows(b_mat, nvelpar, ifgv, sel):
+def _remove_rank_def_rows(b_mat, nvelpar, sel):
     """
     Remove rank deficient rows of design matrix
     """
@@ -196,9 +197,35 @@ def _remove_rank_def_rows(b_mat, nvelpar, ifgv, sel):
     licols = e_var[matrix_rank(b_mat):nvelpar]
     [rmrow, _] = where(b_mat[:, licols] != 0)
     b_mat = delete(b_mat, rmrow, axis=0)
-    ifgv = delete(ifgv, rmrow)
     sel = delete(sel, rmrow)
-    return b_mat, ifgv, sel, rmrow
+    return b_mat, sel, rmrow
+
+
+def _reduce_network(sel, b0_mat, nvelpar, interp):
+    """
+    Form the design matrix for the selected ifgs and reduce it to
+    the full rank sub-network. Returns None if no network remains.
+    """
+    # make design matrix, b_mat
+    b_mat = b0_mat[sel, :]
+    if interp == 0:
+        # remove rank deficient rows
+        rmrow = asarray([0])  # dummy
+
+        while len(rmrow) > 0:
+            # if b_mat.shape[0] <=1 then we return nans
+            if b_mat.shape[0] > 1:
+                b_mat, sel, rmrow = _remove_rank_def_rows(b_mat, nvelpar, sel)
+            else:
+                return None
+
+        # Some epochs have been deleted; get valid epoch indices
+        velflag = sum(abs(b_mat), 0)
+        # remove corresponding columns in design matrix
+        b_mat = b_mat[:, ~np.isclose(velflag, 0.0)]
+    else:
+        velflag = np.ones(nvelpar)
+    return b_mat, sel, velflag
 
 
 def _time_series_by_pixel(row, col, b0_mat, sm_factor, sm_order, ifg_data, mst,
@@ -209,27 +236,11 @@ def _time_series_by_pixel(row, col, b0_mat, sm_factor, sm_order, ifg_data, mst,
     # check pixel for non-redundant ifgs
     sel = np.nonzero(mst[:, row, col])[0]  # trues in mst are chosen
     if len(sel) >= p_thresh:
+        network = _reduce_network(sel, b0_mat, nvelpar, interp)
+        if network is None:
+            return np.empty(nvelpar) * np.nan
+        b_mat, sel, velflag = network
         ifgv = ifg_data[sel, row, col]
-        # make design matrix, b_mat
-        b_mat = b0_mat[sel, :]
-        if interp == 0:
-            # remove rank deficient rows
-            rmrow = asarray([0])  # dummy
-
-            while len(rmrow) > 0:
-                # if b_mat.shape[0] <=1 then we return nans
-                if b_mat.shape[0] > 1:
-                    b_mat, ifgv, sel, rmrow = _remove_rank_def_rows(
-                        b_mat, nvelpar, ifgv, sel)
-                else:
-                    return np.empty(nvelpar) * np.nan
-
-            # Some epochs have been deleted; get valid epoch indices
-            velflag = sum(abs(b_mat), 0)
-            # remove corresponding columns in design matrix
-            b_mat = b_mat[:, ~np.isclose(velflag, 0.0)]
-        else:
-            velflag = np.ones(nvelpar)
         if method == 1:
             # Use Laplacian smoothing method
             tsvel = _solve_ts_lap(nvelpar, velflag, ifgv, b_mat,
@@ -244,6 +255,131 @@ def _time_series_by_pixel(row, col, b0_mat, sm_factor, sm_order, ifg_data, mst,
         return np.empty(nvelpar) * np.nan
 
 
+def _network_operator(sel, b0_mat, sm_factor, sm_order, nvelpar, interp,
+                      vcmt, method):
+    """
+    Returns (sel, velocity index, operator) for one observation network, where
+    the operator maps the observations of the selected ifgs to the estimated
+    velocities. Returns False if the network is rank deficient throughout.
+    """
+    network = _reduce_network(sel, b0_mat, nvelpar, interp)
+    if network is None:
+        return False
+    b_mat, sel, velflag = network
+    if method == 1:
+        operator = _ts_lap_operator(nvelpar, velflag, b_mat, sm_order,
+                                    sm_factor, sel, vcmt)
+        velindex = ~np.isclose(velflag, 0.0, atol=1e-8)
+    elif method == 2:
+        operator = pinv(b_mat)
+        velindex = velflag != 0
+    else:
+        raise ValueError("Unrecognised time series method")
+    return sel, velindex, operator
+
+
+def _time_series_by_pattern(b0_mat, sm_factor, sm_order, ifg_data, mst,
+                            nvelpar, p_thresh, interp, vcmt, method,
+                            cache_size):
+    """
+    Time series computation by observation pattern. Pixels sharing the same
+    set of valid ifgs are solved together with one matrix multiply, using a
+    least-squares operator that is computed once per distinct network and
+    kept in an LRU cache across calls (e.g. for subsequent tiles).
+    """
+    nifgs, nrows, ncols = ifg_data.shape
+    obs = np.reshape(ifg_data, (nifgs, nrows * ncols))
+    tsvel = np.empty((nrows * ncols, nvelpar), dtype=float32) * np.nan
+
+    _NETWORK_CACHE.configure(cache_size, method, interp, sm_order, sm_factor,
+                             b0_mat, vcmt)
+    hits, misses = _NETWORK_CACHE.hits, _NETWORK_CACHE.misses
+
+    patterns, keys, inverse = pattern_groups(mst)
+    order = np.argsort(inverse, kind='mergesort')
+    groups = np.split(order, np.cumsum(np.bincount(inverse))[:-1])
+    for pattern, key, pix in zip(patterns, keys, groups):
+        sel = np.nonzero(pattern)[0]
+        if len(sel) < p_thresh:
+            continue
+        network = _NETWORK_CACHE.get(key)
+        if network is None:
+            network = _network_operator(sel, b0_mat, sm_factor, sm_order,
+                                        nvelpar, interp, vcmt, method)
+            _NETWORK_CACHE.put(key, network)
+        if network is False:
+            continue
+        sel, velindex, operator = network
+        tsvel[np.ix_(pix, velindex)] = dot(operator, obs[sel][:, pix]).T
+
+    hits = _NETWORK_CACHE.hits - hits
+    misses = _NETWORK_CACHE.misses - misses
+    log.info('Time series solved {} pixels using {} distinct networks; '
+             'network cache hit rate {:.1%} ({} hits, {} misses, cache '
+             'size {}/{})'.format(nrows * ncols, len(keys),
+                                  hits / float(max(hits + misses, 1)),
+                                  hits, misses, len(_NETWORK_CACHE),
+                                  cache_size))
+    return np.reshape(tsvel, (nrows, ncols, nvelpar))
+
+
+class _NetworkCache(object):
+    """
+    LRU-bounded cache of time series least-squares operators, keyed by the
+    packed boolean observation mask. The cache is cleared whenever the
+    inversion settings or the ifg network (design matrix, VCM) change.
+    """
+    def __init__(self):
+        self.maxsize = 0
+        self.context = None
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def configure(self, maxsize, method, interp, sm_order, sm_factor, b0_mat,
+                  vcmt):
+        """
+        Set the cache size and clear the cache if the context has changed
+        """
+        self.maxsize = maxsize
+        vcm = asarray(vcmt).tobytes() if method == 1 else None
+        context = (method, interp, sm_order, sm_factor, b0_mat.shape,
+                   b0_mat.tobytes(), vcm)
+        if context != self.context:
+            self.context = context
+            self._cache.clear()
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    def get(self, key):
+        """
+        Return the cached network for key or None if not cached
+        """
+        if key in self._cache:
+            self.hits += 1
+            network = self._cache.pop(key)
+            self._cache[key] = network  # most recently used
+            return network
+        self.misses += 1
+        return None
+
+    def put(self, key, network):
+        """
+        Add a network to the cache, evicting the least recently used
+        """
+        if self.maxsize < 1:
+            return
+        self._cache[key] = network
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+
+_NETWORK_CACHE = _NetworkCache()
+
+
 def _solve_ts_svd(nvelpar, velflag, ifgv, b_mat):
     """
     Solve the linear least squares system using the SVD method.
@@ -260,6 +396,23 @@ def _solve_ts_lap(nvelpar, velflag, ifgv, mat_b, smorder, smfactor, sel, vcmt):
     Solve the linear least squares system using the Finite Difference
     method using a Laplacian Smoothing operator.
     """
+    operator = _ts_lap_operator(nvelpar, velflag, mat_b, smorder, smfactor,
+                                sel, vcmt)
+
+    # TODO: implement residuals and roughness calculations
+    tsvel = np.empty(nvelpar, dtype=float32) * np.nan
+    tsvel[~np.isclose(velflag, 0.0, atol=1e-8)] = dot(operator, ifgv)
+
+    # TODO: implement uncertainty estimates (tserror) like in Matlab Pirate code
+    return tsvel
+
+
+def _ts_lap_operator(nvelpar, velflag, mat_b, smorder, smfactor, sel, vcmt):
+    """
+    Returns the operator mapping ifg observations to velocities for the
+    Laplacian Smoothing method. The smoothing observations are zero, so only
+    the columns of the weighted pseudo-inverse for the ifgs are needed.
+    """
     # pylint: disable=invalid-name
     # Laplacian observations number
     nlap = nvelpar - smorder
@@ -295,10 +448,6 @@ def _solve_ts_lap(nvelpar, velflag, ifgv, mat_b, smorder, smfactor, sel, vcmt):
     # add laplacian design matrix to existing design matrix
     mat_b = np.concatenate((mat_b, b_lap), axis=0)
 
-    # combine ifg and Laplacian smooth vector
-    v_lap = np.zeros(nlap)
-    obsv = np.concatenate((ifgv, v_lap), axis=0)
-
     # make variance-covariance matrix
     # new covariance matrix, adding the laplacian equations
     m = len(sel)
@@ -311,21 +460,21 @@ def _solve_ts_lap(nvelpar, velflag, ifgv, mat_b, smorder, smfactor, sel, vcmt):
     # we get the lower triangle in numpy, Matlab gives upper triangle
     w = cholesky(pinv(vcm_tmp)).T
     wb = dot(w, mat_b)
-    wl = dot(w, obsv)
-    x = dot(pinv(wb, rcond=1e-8), wl)
-
-    # TODO: implement residuals and roughness calculations
-    tsvel = np.empty(nvelpar, dtype=float32) * np.nan
-    tsvel[~np.isclose(velflag, 0.0, atol=1e-8)] = x[:nvelleft]
-
-    # TODO: implement uncertainty estimates (tserror) like in Matlab Pirate code
-    return tsvel
+    # observation vector is the ifgs followed by zeros for the Laplacian
+    # equations, so only the first m columns of w contribute
+    return dot(pinv(wb, rcond=1e-8), w[:, :m])[:nvelleft]
 
 
 def _plot_timeseries(tsincr, tscum, tsvel, output_dir):  # pragma: no cover
     """
-    A very basic plotting function used in code development
+    A very basic plotting function used in code development. matplotlib is
+    an optional dependency only imported here
     """
+    try:
+        import matplotlib.pyplot as plt
+    except ImportError:
+        raise ImportError('matplotlib needs to be installed in order to '
+                          'plot the time series')
     nvelpar = len(tsincr[0, 0, :])
     for i in range(nvelpar):
 
@@ -86,7 +86,6 @@ setup(
         'PyYAML >= 3.11',
         'netCDF4 == 1.2.6',
         'GDAL == ' + GDAL_VERSION,
-        'matplotlib == 1.5.1',
         'pyproj >= 1.9.5',
         'networkx >= 1.9.1',
         'Pillow >= 2.8.2',
@@ -95,6 +94,7 @@ setup(
         'glob2'
     ],
     extras_require={
+        'plot': ['matplotlib == 1.5.1'],
         'dev': [
             'sphinx',
             'ghp-import',
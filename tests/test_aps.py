@@ -1,5 +1,7 @@
 import os
 import copy
+import shutil
+import tempfile
 from collections import namedtuple
 import scipy.io as sio
 import numpy as np
@@ -9,7 +11,10 @@ from pyrate.algorithm import get_epochs
 from pyrate.aps import temporal_low_pass_filter as tlpfilter
 from pyrate.aps import _slp_filter, spatial_low_pass_filter
 from pyrate.aps import spatio_temporal_filter
+from pyrate.aps import _temporal_low_pass_filter_tiles, \
+    _spatial_low_pass_filter_epochs, _cumulate_epochs, _epoch_span_phase
 from pyrate import config as cf
+from pyrate import shared
 from pyrate.compat import pickle, PY3
 from tests.common import SML_TEST_DIR, TEST_CONF_GAMMA, small_data_setup
 
@@ -52,6 +57,54 @@ def test_tlpfilter_matlab(tlpfilter_method):
     np.testing.assert_almost_equal(tsfilt_incr_matlab,
                                    tsfilt_incr, decimal=4)
 
+@pytest.fixture()
+def aps_tmpdir(request):
+    tmpdir = tempfile.mkdtemp()
+
+    def fin():
+        # intermediate tshp_aps_*/tsincr_aps_* and corrected epoch files
+        shutil.rmtree(tmpdir)
+
+    request.addfinalizer(fin)
+    return tmpdir
+
+
+def test_spatio_temporal_filter_tiles(tlpfilter_method, aps_tmpdir):
+    aps_params = copy.copy(params)
+    aps_params[cf.TLPF_METHOD] = tlpfilter_method
+    aps_params[cf.SLPF_CUTOFF] = 0.5
+    aps_params[cf.TMPDIR] = aps_tmpdir
+    tsincr = tsincr_svd['tsincr'].astype(np.float32)
+    tsincr[3:9, 4:12, 2] = np.nan  # pixels with a different nan pattern
+    tiles = shared.create_tiles(tsincr.shape[:2], nrows=3, ncols=2)
+    for t in tiles:
+        np.save(os.path.join(aps_params[cf.TMPDIR],
+                             'tsincr_aps_{}.npy'.format(t.index)),
+                tsincr[t.top_left_y:t.bottom_right_y,
+                       t.top_left_x:t.bottom_right_x])
+    Ifg = namedtuple('Ifg', 'x_centre, y_centre, x_size, y_size, shape')
+    ifg = Ifg(x_size=xpsize, y_size=ypsize, shape=tsincr.shape[:2],
+              x_centre=tsincr.shape[1] // 2, y_centre=tsincr.shape[0] // 2)
+
+    _temporal_low_pass_filter_tiles(aps_params, ifgs_pk, tiles)
+    _spatial_low_pass_filter_epochs(ifg, aps_params, tiles, tsincr.shape[2])
+
+    ts_hp = tsincr - tlpfilter(tsincr, epochlist, aps_params)
+    expected = tsincr - spatial_low_pass_filter(ts_hp, ifg, aps_params)
+    for i in range(tsincr.shape[2]):
+        np.testing.assert_array_almost_equal(
+            np.load(os.path.join(aps_params[cf.TMPDIR],
+                                 'tsincr_aps_corrected_{}.npy'.format(i))),
+            expected[:, :, i], decimal=4)
+
+    # interferograms from the cumulative epochs, across and clear of the nans
+    _cumulate_epochs(aps_params, tsincr.shape[2])
+    for master, slave in [(0, 1), (0, tsincr.shape[2]), (1, 3), (3, 6)]:
+        np.testing.assert_array_almost_equal(
+            _epoch_span_phase(aps_params[cf.TMPDIR], master, slave),
+            np.sum(expected[:, :, master:slave], axis=2), decimal=4)
+
+
 tsincr = tsincr_svd['tsincr']
 
 params[cf.TLPF_METHOD] = 3
@@ -90,6 +143,28 @@ def test_slpfilter_matlab(slpfilter_method):
     np.testing.assert_array_almost_equal(ts_aps, ts_aps_m, decimal=4)
 
 
+@pytest.mark.parametrize('shape', [(40, 30), (41, 31)])
+def test_slp_filter_rfft(slpfilter_method, shape):
+    # reference: full complex fft with a centred (shifted) transfer function
+    phase = np.random.RandomState(3).randn(*shape)
+    rows, cols = shape
+    xx, yy = np.meshgrid(range(cols), range(rows))
+    dist = np.sqrt(((xx - cols // 2) * xpsize) ** 2 +
+                   ((yy - rows // 2) * ypsize) ** 2) / 1e3
+    cutoff = 0.5
+    if slpfilter_method == 1:
+        H = 1. / (1 + ((dist / cutoff) ** (2 * params[cf.SLPF_ORDER])))
+    else:
+        H = np.exp(-(dist ** 2) / (2 * cutoff ** 2))
+    expected = np.real(np.fft.ifft2(np.fft.ifftshift(
+        np.fft.fftshift(np.fft.fft2(phase)) * H)))
+    slp_params = copy.copy(params)
+    slp_params[cf.SLPF_METHOD] = slpfilter_method
+    np.testing.assert_array_almost_equal(
+        _slp_filter(phase, cutoff, rows, cols, xpsize, ypsize, slp_params),
+        expected)
+
+
 def test_slpfilter_accumulated(slpfilter_method):
     ts_aps_before = copy.copy(ts_hp_before_slpfilter)
     params[cf.SLPF_METHOD] = slpfilter_method
@@ -173,7 +248,7 @@ def test_spatio_temporal_filter():
         np.testing.assert_array_almost_equal(arr, ifg_out[:, :, i], decimal=3)
 
 
-@pytest.fixture(params=['cubic', 'linear', 'nearest'])
+@pytest.fixture(params=['cubic', 'linear', 'nearest', 'edt'])
 def interp_method(request):
     return request.param
 
@@ -190,3 +265,33 @@ def test_interpolate_nans(interp_method):
     np.testing.assert_array_almost_equal(a[~np.isnan(a_copy)],
                                          a_copy[~np.isnan(a_copy)],
                                          decimal=4)
+
+
+def test_interpolate_nans_reuse_triangulation(interp_method):
+    from pyrate.aps import _interpolate_nans
+    from scipy.interpolate import griddata
+    rng = np.random.RandomState(4)
+    a = rng.randn(20, 15, 3)
+    a[rng.rand(20, 15) < 0.3] = np.nan  # same mask in every epoch
+    a[5, 5, 1] = np.nan  # apart from one
+    filled = a.copy()
+    _interpolate_nans(filled, method=interp_method)
+    rows, cols = np.indices(a.shape[:2])
+    for i in range(a.shape[2]):
+        nans = np.isnan(a[:, :, i])
+        valid = (rows[~nans], cols[~nans])
+        if interp_method == 'edt':
+            # the nearest valid pixel, ties may be broken either way
+            dist = np.sqrt((rows[nans][:, np.newaxis] - valid[0]) ** 2 +
+                           (cols[nans][:, np.newaxis] - valid[1]) ** 2)
+            nearest = dist == dist.min(axis=1)[:, np.newaxis]
+            values = a[:, :, i][~nans]
+            for j, v in enumerate(filled[:, :, i][nans]):
+                assert v in values[nearest[j]]
+            continue
+        expected = a[:, :, i].copy()
+        expected[nans] = griddata(valid, expected[~nans],
+                                  (rows[nans], cols[nans]),
+                                  method=interp_method)
+        expected[np.isnan(expected)] = 0
+        np.testing.assert_array_almost_equal(filled[:, :, i], expected)
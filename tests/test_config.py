@@ -212,5 +212,47 @@ class TestOneIncidenceOrElevationMap(unittest.TestCase):
                           config.get_config_params, self.conf_file)
 
 
+class IncrementalConfigTest(unittest.TestCase):
+    """
+    Tests the corrections incremental processing is rejected with
+    """
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.conf_file = join(self.base_dir, 'incremental.conf')
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def make_input_files(self, **options):
+        with open(TEST_CONF_GAMMA) as f:
+            text = f.read()
+        with open(self.conf_file, 'w') as conf:
+            conf.write(text)
+            # later options override those of the test config
+            conf.write('{}: {}\n'.format(config.OUT_DIR, self.base_dir))
+            for k, v in options.items():
+                conf.write('{}: {}\n'.format(k, v))
+
+    def test_incremental_without_aps(self):
+        self.make_input_files(**{config.INCREMENTAL: 1, config.APSEST: 0})
+        params = config.get_config_params(self.conf_file)
+        self.assertEqual(params[config.INCREMENTAL], 1)
+
+    def test_appending_ifg_with_aps_rejected(self):
+        # the APS filter of an appended ifg changes the APS correction of
+        # every ifg of the stack
+        self.make_input_files(**{config.INCREMENTAL: 1, config.APSEST: 1})
+        self.assertRaises(config.ConfigException,
+                          config.get_config_params, self.conf_file)
+
+    def test_network_orbital_rejected(self):
+        self.make_input_files(**{config.INCREMENTAL: 1, config.APSEST: 0,
+                                 config.ORBITAL_FIT: 1,
+                                 config.ORBITAL_FIT_METHOD: 2})
+        self.assertRaises(config.ConfigException,
+                          config.get_config_params, self.conf_file)
+
+
 if __name__ == "__main__":
     unittest.main()
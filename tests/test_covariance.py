@@ -29,7 +29,9 @@ from pyrate import config as cf
 from pyrate import ref_phs_est as rpe
 from pyrate import shared
 from pyrate.scripts import run_pyrate, run_prepifg
-from pyrate.covariance import cvd, get_vcmt, RDist
+from pyrate.covariance import cvd, cvd_batch, cvd_from_phase, get_vcmt, RDist
+from pyrate.covariance import fit_alpha, _autocovariance, _get_autogrid
+from pyrate.covariance import DISTFACT
 from pyrate import ifgconstants as ifc
 import pyrate.orbital
 from tests import common
@@ -92,6 +94,114 @@ class CovarianceTests(unittest.TestCase):
         # Discrepancies observed in distance calculations.
         assert_array_almost_equal(act_alpha, exp_alpha, decimal=1)
 
+    def test_covariance_batch(self):
+        exp = [cvd(i, self.params, self.r_dist, calc_alpha=True)
+               for i in self.ifgs]
+        self.params[cf.PARALLEL] = 1
+        self.params[cf.PROCESSES] = 4
+        act = cvd_batch(self.ifgs, self.params, self.r_dist, calc_alpha=True)
+        assert_array_almost_equal(np.array(act), np.array(exp))
+
+    def test_covariance_alpha_methods(self):
+        # Gauss-Newton vs the reference Nelder-Mead alpha fit
+        exp = [cvd(i, self.params, self.r_dist, calc_alpha=True)
+               for i in self.ifgs]
+        self.params[cf.COV_ALPHA_METHOD] = 2
+        act = [cvd(i, self.params, self.r_dist, calc_alpha=True)
+               for i in self.ifgs]
+        act_batch = cvd_batch(self.ifgs, self.params, self.r_dist,
+                              calc_alpha=True)
+        exp, act, act_batch = (np.array(e) for e in (exp, act, act_batch))
+        assert_array_almost_equal(act[:, 0], exp[:, 0])
+        np.testing.assert_allclose(act[:, 1], exp[:, 1], rtol=1e-4)
+        assert_array_almost_equal(act_batch, act)
+
+
+class _GeometryIfg(object):
+
+    def __init__(self, shape):
+        self.shape = shape
+        self.y_centre, self.x_centre = shape[0] // 2, shape[1] // 2
+        self.x_size, self.y_size = 90.0, 80.0
+
+
+class RadialBinsTests(unittest.TestCase):
+    """
+    Tests the cached radial bins, and the bincount radial average against
+    the per bin mean it replaced
+    """
+
+    def test_radial_average(self):
+        rng = np.random.RandomState(1)
+        ifg = _GeometryIfg((41, 57))
+        phase = rng.normal(size=ifg.shape).astype(np.float32)
+        rdist = RDist(ifg)
+        r_dist, rbins = rdist(), rdist.bins()
+        self.assertIs(rdist.bins(), rbins)
+        maxvar, alpha = cvd_from_phase(phase, ifg, r_dist, calc_alpha=True)
+        maxvar_b, alpha_b = cvd_from_phase(phase, ifg, r_dist,
+                                           calc_alpha=True, rbins=rbins)
+        self.assertEqual(maxvar, maxvar_b)
+        self.assertEqual(alpha, alpha_b)
+
+        rbin = rbins.rbin
+        for b in range(rbins.maxbin + 1):
+            self.assertEqual(rbins.counts[b], np.sum(rbin == b))
+        self.assertEqual(len(rbin), np.sum(rbins.keep))
+
+    def test_bin_means_equal_per_bin_mean(self):
+        rng = np.random.RandomState(3)
+        ifg = _GeometryIfg((41, 57))
+        phase = rng.normal(size=ifg.shape).astype(np.float32)
+        rdist = RDist(ifg)
+        r_dist = rdist()
+        _, cvdav = _autocovariance(phase, ifg, r_dist, True, False, {},
+                                   None, rdist.bins())
+
+        # previous implementation: a mean over a mask of every bin
+        acg = np.reshape(_get_autogrid(phase), phase.size, order='F')
+        acg = acg[:len(r_dist)]
+        if (ifg.x_centre * ifg.x_size) < (ifg.y_centre * ifg.y_size):
+            maxdist = (ifg.x_centre + 1) * ifg.x_size / DISTFACT
+        else:
+            maxdist = (ifg.y_centre + 1) * ifg.y_size / DISTFACT
+        keep = r_dist < maxdist
+        acg = acg[keep]
+        bin_width = max(ifg.x_size, ifg.y_size) * 2 / DISTFACT
+        rbin = np.ceil(r_dist[keep] / bin_width).astype(int)
+        maxbin = max(rbin) - 1
+        expected = [np.mean(acg[rbin == b]) for b in range(maxbin + 1)]
+
+        np.testing.assert_allclose(cvdav[1], expected, rtol=1e-6)
+        np.testing.assert_allclose(cvdav[0],
+                                   np.arange(maxbin + 1) * bin_width)
+
+
+class AlphaFitTests(unittest.TestCase):
+    """
+    Tests the Gauss-Newton alpha fit against the Nelder-Mead fit
+    """
+
+    def setUp(self):
+        rng = np.random.RandomState(5)
+        self.dist = np.arange(40) * 0.18
+        self.alpha = rng.uniform(0.05, 2, 30)
+        cvdavs = 3 * np.exp(-self.alpha[:, np.newaxis] * self.dist)
+        self.noisy = cvdavs + rng.normal(0, 0.05, cvdavs.shape)
+        self.noisy[:, 0] = 3
+        self.cvdavs = cvdavs
+
+    def test_exact_exponential(self):
+        for method in [1, 2]:
+            np.testing.assert_allclose(
+                fit_alpha(self.dist, self.cvdavs, method), self.alpha,
+                rtol=1e-5)
+
+    def test_gauss_newton_equals_nelder_mead(self):
+        np.testing.assert_allclose(fit_alpha(self.dist, self.noisy, 2),
+                                   fit_alpha(self.dist, self.noisy, 1),
+                                   rtol=1e-4)
+
 
 class VCMTests(unittest.TestCase):
 
@@ -112,6 +222,13 @@ class VCMTests(unittest.TestCase):
         act = get_vcmt(ifgs, maxvar)
         assert_array_almost_equal(act, exp, decimal=3)
 
+    def test_vcm_sparse(self):
+        maxvar = np.arange(1, len(self.ifgs) + 1, dtype=float)
+        dense = get_vcmt(self.ifgs, maxvar)
+        act = get_vcmt(self.ifgs, maxvar, sparse=True)
+        self.assertEqual(act.nnz, np.count_nonzero(dense))
+        assert_array_almost_equal(act.toarray(), dense)
+
     def test_vcm_17ifgs(self):
         # TODO: maxvar should be calculated by vcm.cvd
         maxvar = [2.879, 4.729, 22.891, 4.604, 3.290, 6.923, 2.519, 13.177,
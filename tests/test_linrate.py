@@ -40,7 +40,8 @@ from tests.common import TEST_CONF_ROIPAC, pre_prepare_ifgs
 
 
 def default_params():
-    return {'pthr': 3, 'nsig': 3, 'maxsig': 2, 'parallel': 1, 'processes': 8}
+    return {'pthr': 3, 'nsig': 3, 'maxsig': 2, 'parallel': 1, 'processes': 8,
+            'lrmethod': 1}
 
 
 class SinglePixelIfg(object):
@@ -75,6 +76,54 @@ class LinearRateTests(unittest.TestCase):
         assert_array_almost_equal(error, experr)
         assert_array_almost_equal(samples, expsamp)
 
+    def test_linear_rate_batched(self):
+        # same pixel solved with the batched observation pattern engine
+        vcmt = eye(6, 6)
+        mst = ones((6, 1, 1))
+        mst[4] = 0
+        params = default_params()
+        params[cf.LR_METHOD] = 2
+        params[cf.PARALLEL] = 0
+        rate, error, samples = linear_rate(self.ifgs, params, vcmt, mst)
+        assert_array_almost_equal(rate, array([[5.0]]))
+        assert_array_almost_equal(error, array([[0.836242010007091]]))
+        assert_array_almost_equal(samples, array([[5]]))
+
+
+class BatchedLinearRateTests(unittest.TestCase):
+    """
+    Tests the batched linear rate engine against the pixel-by-pixel engine
+    on a synthetic stack with outliers and varying observation patterns
+    """
+
+    def setUp(self):
+        rng = np.random.RandomState(10)
+        nifgs, rows, cols = 12, 6, 7
+        spans = rng.uniform(0.1, 1.5, nifgs)
+        vel = rng.uniform(-5, 5, (rows, cols))
+        self.ifgs = []
+        for s in spans:
+            ifg = SinglePixelIfg(s, 0)
+            ifg.phase_data = (vel * s + rng.normal(0, 1, (rows, cols))).astype(
+                np.float32)
+            self.ifgs.append(ifg)
+        self.ifgs[3].phase_data[2, 2] = 40  # outlier
+        m = rng.rand(nifgs, nifgs)
+        self.vcmt = m.dot(m.T) / nifgs + eye(nifgs)
+        self.mst = rng.rand(nifgs, rows, cols) > 0.15
+        self.mst[:, :3, :] = True  # many pixels sharing one pattern
+
+    def test_batched_equals_pixel(self):
+        params = default_params()
+        params.update({cf.LR_NSIG: 2, cf.LR_PTHRESH: 5, cf.PARALLEL: 0})
+        expected = linear_rate(self.ifgs, params, self.vcmt, self.mst.copy())
+        for parallel in [0, 1]:
+            params[cf.LR_METHOD] = 2
+            params[cf.PARALLEL] = parallel
+            res = linear_rate(self.ifgs, params, self.vcmt, self.mst.copy())
+            for e, r in zip(expected, res):
+                assert_array_almost_equal(e, r, decimal=4)
+
 
 class MatlabEqualityTest(unittest.TestCase):
     """
@@ -132,6 +181,12 @@ class MatlabEqualityTest(unittest.TestCase):
             tests.common.calculate_linear_rate(ifgs, params, vcmt,
                                                mst_mat=mst_grid)
 
+        params[cf.LR_METHOD] = 2
+        cls.rate_b, cls.error_b, cls.samples_b = \
+            tests.common.calculate_linear_rate(ifgs, params, vcmt,
+                                               mst_mat=mst_grid)
+        params[cf.LR_METHOD] = 1
+
         matlab_linrate_dir = os.path.join(SML_TEST_DIR, 'matlab_linrate')
 
         cls.rate_matlab = np.genfromtxt(
@@ -188,6 +243,17 @@ class MatlabEqualityTest(unittest.TestCase):
         np.testing.assert_array_almost_equal(
             self.samples_2, self.samples_s, decimal=3)
 
+    def test_linrate_batched(self):
+        """
+        batched observation pattern engine vs serial
+        """
+        np.testing.assert_array_almost_equal(
+            self.rate_b, self.rate_s, decimal=3)
+        np.testing.assert_array_almost_equal(
+            self.error_b, self.error_s, decimal=3)
+        np.testing.assert_array_almost_equal(
+            self.samples_b, self.samples_s, decimal=3)
+
     def test_linear_rate(self):
         """
         python vs matlab
@@ -327,6 +327,18 @@ def test_timeseries_linrate_mpi(mpisync, tempdir, modify_config,
         shutil.rmtree(params_old[cf.OUT_DIR])  # remove serial out dir
 
 
+def test_schedule_mpi(mpisync):
+    tasks = list(range(23))
+    costs = np.random.RandomState(5).rand(len(tasks))
+    process_tasks = list(mpiops.schedule(tasks, costs))
+    all_tasks = mpiops.comm.allgather(process_tasks)
+    assert sorted(t for p in all_tasks for t in p) == tasks
+    if mpiops.size == 1:
+        assert process_tasks == list(np.argsort(-costs))
+    else:
+        assert all_tasks[0] == []  # master process only hands out tasks
+
+
 def _tifs_same(dir1, dir2, tif):
     linrate_tif_s = os.path.join(dir1, tif)
     linrate_tif_m = os.path.join(dir2, tif)
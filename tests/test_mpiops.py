@@ -0,0 +1,95 @@
+#   This Python module is part of the PyRate software package.
+#
+#   Copyright 2017 Geoscience Australia
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+'''
+This Python module contains tests for the serial and local communicators
+of the mpiops.py PyRate module. tests/test_mpi.py covers MPI runs.
+'''
+import unittest
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from pyrate import mpiops
+
+
+def _collectives(values):
+    """
+    Exercises the communicator on every process of a local run
+    """
+    rank = mpiops.rank
+    ranks = mpiops.comm.allgather(rank)
+    total = mpiops.comm.allreduce(np.full(3, rank))
+    first = mpiops.run_once(lambda: values[0])
+    mine = mpiops.array_split(values)
+    if rank == 0:
+        received = [mine]
+        for r in range(1, mpiops.size):
+            buf = np.empty(len(mpiops.array_split(values, r)), dtype=int)
+            mpiops.comm.Recv(buf, source=r, tag=r)
+            received.append(buf)
+    else:
+        mpiops.comm.Send(mine, dest=0, tag=rank)
+    scheduled = list(mpiops.schedule(list(values), costs=values))
+    scheduled = sum(mpiops.comm.allgather(scheduled), [])
+    mpiops.comm.barrier()
+    if rank == 0:
+        return ranks, total, first, np.concatenate(received), scheduled
+
+
+def _fail():
+    """
+    Fails on the process of rank 1 only
+    """
+    if mpiops.rank == 1:
+        raise ValueError('failed')
+    mpiops.comm.barrier()
+
+
+@unittest.skipIf(mpiops.size > 1, 'tests of runs without MPI')
+class CommunicatorTests(unittest.TestCase):
+    """
+    Tests the communicators used without MPI
+    """
+
+    def test_serial(self):
+        self.assertIsInstance(mpiops.comm, mpiops.SerialComm)
+        ranks, total, first, received, scheduled = _collectives(
+            np.arange(10))
+        self.assertEqual(ranks, [0])
+        assert_array_equal(total, np.zeros(3))
+        self.assertEqual(first, 0)
+        assert_array_equal(received, np.arange(10))
+        self.assertEqual(scheduled, list(range(9, -1, -1)))
+
+    def test_local(self):
+        ranks, total, first, received, scheduled = mpiops.run_local(
+            3, _collectives, np.arange(10))
+        self.assertEqual(ranks, [0, 1, 2])
+        assert_array_equal(total, np.full(3, 3))
+        self.assertEqual(first, 0)
+        assert_array_equal(received, np.arange(10))
+        # the master process only hands out the tasks
+        self.assertEqual(sorted(scheduled), list(range(10)))
+        self.assertIsInstance(mpiops.comm, mpiops.SerialComm)
+        self.assertEqual(mpiops.size, 1)
+
+    def test_local_failure(self):
+        with self.assertRaises(RuntimeError):
+            mpiops.run_local(2, _fail)
+        self.assertEqual(mpiops.size, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -23,6 +23,7 @@ import shutil
 import subprocess
 import tempfile
 import unittest
+from datetime import date, timedelta
 from itertools import product
 from numpy import empty, array, nan, isnan, sum as nsum
 
@@ -185,6 +186,60 @@ class NetworkxMSTTreeCheck(unittest.TestCase):
         self.assertEqual(2, ntrees)
 
 
+class NumpyMSTTests(unittest.TestCase):
+    """
+    Verifies the NumPy MST engine against the NetworkX engine on a synthetic
+    stack with distinct edge weights and many NaN patterns
+    """
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        dates = [date(2010, 1, 1) + timedelta(days=30 * k) for k in range(9)]
+        pairs = [(m, s) for m, s in product(range(9), range(9))
+                 if m < s and rng.rand() < 0.5]
+        self.ifgs = []
+        for m, s in pairs:
+            phase = rng.normal(size=(20, 25)).astype(np.float32)
+            phase[rng.rand(20, 25) < 0.3] = nan
+            phase[:3, :3] = nan  # all nan pixels
+            self.ifgs.append(SyntheticIfg(dates[m], dates[s], phase, rng.rand()))
+        for i in self.ifgs:
+            i.phase_data[3:6, :] = 1.0  # no nan pixels
+
+    def test_numpy_equals_networkx(self):
+        expected = np.zeros((len(self.ifgs),) + self.ifgs[0].shape, dtype=bool)
+        for y, x, edges in mst.mst_matrix_networkx(self.ifgs):
+            if isinstance(edges, float):  # all nans
+                continue
+            for e in edges:
+                expected[algorithm.ifg_date_index_lookup(self.ifgs, e), y, x] \
+                    = True
+        result = mst.mst_boolean_array(self.ifgs, method=2)
+        np.testing.assert_array_equal(result, expected)
+        self.assertFalse(result[:, :3, :3].any())
+
+    def test_mst_is_tree(self):
+        result = mst.mst_boolean_array(self.ifgs, method=2)
+        nepochs = len(algorithm.get_epochs(self.ifgs)[0].dates)
+        # fully connected pixels give a spanning tree over all epochs
+        self.assertTrue((np.sum(result[:, 3:6, :], axis=0) ==
+                         nepochs - 1).all())
+
+
+class SyntheticIfg(object):
+    """
+    Minimal ifg with dates, phase data and NaN fraction for MST testing
+    """
+
+    def __init__(self, master, slave, phase_data, nan_fraction):
+        self.master = master
+        self.slave = slave
+        self.phase_data = phase_data
+        self.nan_fraction = nan_fraction
+        self.shape = phase_data.shape
+        self.nrows, self.ncols = phase_data.shape
+
+
 class IfgPartTest(unittest.TestCase):
 
     def setUp(self):
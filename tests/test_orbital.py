@@ -33,11 +33,13 @@ from scipy.linalg import lstsq
 
 from .common import small5_mock_ifgs, MockIfg
 from pyrate import algorithm
+from pyrate import orbital
 from pyrate import config as cf
 from pyrate.orbital import INDEPENDENT_METHOD, NETWORK_METHOD, PLANAR, \
     QUADRATIC, PART_CUBIC
 from pyrate.orbital import OrbitalError, _orbital_correction
 from pyrate.orbital import get_design_matrix, get_network_design_matrix
+from pyrate.orbital import get_network_normal_equations
 from pyrate.orbital import _get_num_params, remove_orbital_error
 from pyrate.shared import Ifg
 from pyrate.shared import nanmedian
@@ -250,6 +252,40 @@ class IndependentCorrectionTests(unittest.TestCase):
         self.check_correction(PART_CUBIC, INDEPENDENT_METHOD, True, decimal=1)
 
 
+class _GeometryIfg(object):
+
+    def __init__(self, shape):
+        self.nrows, self.ncols = shape
+        self.num_cells = self.nrows * self.ncols
+        self.x_size, self.y_size = 90.0, 89.5
+
+    @property
+    def shape(self):
+        return self.nrows, self.ncols
+
+
+class IndependentFitTests(unittest.TestCase):
+    """Tests the cached factorisation of the independent method"""
+
+    def test_independent_fit(self):
+        rng = np.random.RandomState(3)
+        ifg = _GeometryIfg((30, 40))
+        for deg, offset in product([PLANAR, QUADRATIC, PART_CUBIC],
+                                   [False, True]):
+            orbital._INDEPENDENT_DM.clear()
+            dm = get_design_matrix(ifg, deg, offset).astype(np.float64)
+            for frac in [0, 0.2, 0.2, 0.8]:
+                phase = rng.normal(size=ifg.num_cells).astype(float32)
+                phase[rng.rand(ifg.num_cells) < frac] = nan
+                valid = ~isnan(phase)
+                exp = lstsq(dm[valid], phase[valid].astype(np.float64))[0]
+                act_dm, act = orbital._independent_fit(ifg, deg, offset,
+                                                       phase)
+                assert_array_equal(act_dm, dm)
+                assert_array_almost_equal(dm.dot(act), dm.dot(exp),
+                                          decimal=8)
+
+
 class ErrorTests(unittest.TestCase):
     """Tests for the networked correction method"""
 
@@ -359,6 +395,18 @@ class NetworkDesignMatrixTests(unittest.TestCase):
         self.assertNotEqual(act.ptp(), 0)
         self.check_equality(ncoef, act, self.ifgs, offset)
 
+    def test_network_normal_equations(self):
+        data = concatenate([i.phase_data.reshape(self.ncells)
+                            for i in self.ifgs])
+        for deg, offset in product([PLANAR, QUADRATIC, PART_CUBIC],
+                                   [False, True]):
+            dm = get_network_design_matrix(self.ifgs, deg, offset)
+            dm = dm[~isnan(data)].astype(np.float64)
+            BTB, BTd = get_network_normal_equations(self.ifgs, deg, offset)
+            np.testing.assert_allclose(BTB, dm.T.dot(dm), rtol=1e-10)
+            np.testing.assert_allclose(BTd, dm.T.dot(data[~isnan(data)]),
+                                       rtol=1e-6)
+
     def check_equality(self, ncoef, dm, ifgs, offset):
         """
         Internal test function to check subsets against network design matrix
@@ -413,7 +461,8 @@ def network_correction(ifgs, deg, off, ml_ifgs=None, tol=1e-6):
         dm = get_network_design_matrix(ifgs, deg, off)[~isnan(data)]
         fd = data[~isnan(data)].reshape((dm.shape[0], 1))
 
-    params = pinv(dm, tol).dot(fd)
+    # the network inversion is solved in double precision
+    params = pinv(dm.astype(np.float64), tol).dot(fd)
     assert params.shape == (dm.shape[1], 1)
 
     # calculate forward correction
@@ -738,5 +738,47 @@ class TestOneIncidenceOrElevationMap(unittest.TestCase):
         self.assertEqual(0, len(inc))
 
 
+class PrepifgManifestTests(unittest.TestCase):
+    """
+    Tests the prepifg work manifest used to skip up to date outputs
+    """
+
+    def setUp(self):
+        self.outdir = tempfile.mkdtemp()
+        self.params = {cf.OUT_DIR: self.outdir}
+        self.inputs = [join(self.outdir, 'ifg_{}.unw'.format(i))
+                       for i in range(3)]
+        self.jobs = [(p.replace('.unw', '.tif'), [p]) for p in self.inputs]
+        for p in self.inputs + [o for o, _ in self.jobs]:
+            with open(p, 'w') as f:
+                f.write(p)
+
+    def tearDown(self):
+        shutil.rmtree(self.outdir)
+
+    def test_up_to_date_outputs_are_skipped(self):
+        manifest = run_prepifg._load_manifest(self.params)
+        self.assertEqual(len(run_prepifg._stale_jobs(manifest, self.jobs,
+                                                     'a')), 3)
+        run_prepifg._update_manifest(manifest, self.jobs, 'a')
+        run_prepifg._save_manifest(self.params, manifest)
+
+        manifest = run_prepifg._load_manifest(self.params)
+        self.assertEqual(run_prepifg._stale_jobs(manifest, self.jobs, 'a'),
+                         [])
+        # changed configuration
+        self.assertEqual(len(run_prepifg._stale_jobs(manifest, self.jobs,
+                                                     'b')), 3)
+        # changed input file
+        with open(self.inputs[1], 'a') as f:
+            f.write('new data')
+        self.assertEqual(run_prepifg._stale_jobs(manifest, self.jobs, 'a'),
+                         [self.jobs[1]])
+        # missing output file
+        os.remove(self.jobs[2][0])
+        self.assertEqual(run_prepifg._stale_jobs(manifest, self.jobs, 'a'),
+                         self.jobs[1:])
+
+
 if __name__ == "__main__":
     unittest.main()
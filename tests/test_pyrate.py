@@ -19,6 +19,7 @@ This Python module contains system integration tests for the PyRate workflow.
 
 import glob
 import os
+import pickle
 import shutil
 import tempfile
 import unittest
@@ -28,6 +29,7 @@ import numpy as np
 import pyrate.shared
 from pyrate import config as cf
 from pyrate import shared, config, prepifg
+from pyrate import ifgconstants as ifc
 from pyrate.scripts import run_pyrate, run_prepifg
 from tests import common
 
@@ -298,6 +300,82 @@ class ParallelPyRateTests(unittest.TestCase):
                                              decimal=4)
 
 
+class FusedCorrectionsPyRateTests(unittest.TestCase):
+    """
+    fused correction pass vs per-correction writes verifying the corrected
+    interferograms and results are equal
+    """
+    # spatio-temporal APS filter
+    apsest = 0
+
+    @classmethod
+    def setUpClass(cls):
+        params = cf.get_config_params(common.TEST_CONF_GAMMA)
+        params[cf.OBS_DIR] = common.SML_TEST_GAMMA
+        params[cf.PROCESSOR] = 1  # gamma
+        params[cf.IFG_FILE_LIST] = os.path.join(
+            common.SML_TEST_GAMMA, 'ifms_17')
+        params[cf.PARALLEL] = 0
+        params[cf.APS_CORRECTION] = False
+        params[cf.APSEST] = cls.apsest
+        xlks, _, crop = cf.transform_params(params)
+        base_unw_paths = cf.original_ifg_paths(params[cf.IFG_FILE_LIST])
+
+        cls.tif_dirs, cls.dest_paths, cls.results = [], [], []
+        for fused in [0, 1]:
+            tif_dir = tempfile.mkdtemp()
+            params[cf.OUT_DIR] = tif_dir
+            params[cf.TMPDIR] = os.path.join(tif_dir, cf.TMPDIR)
+            params[cf.FUSED_CORRECTIONS] = fused
+            dest_paths = cf.get_dest_paths(base_unw_paths, crop, params, xlks)
+            run_prepifg.gamma_prepifg(base_unw_paths, params)
+            cls.results.append(run_pyrate.process_ifgs(dest_paths, params,
+                                                       3, 3))
+            cls.tif_dirs.append(tif_dir)
+            cls.dest_paths.append(dest_paths)
+
+    @classmethod
+    def tearDownClass(cls):
+        for tif_dir in cls.tif_dirs:
+            shutil.rmtree(tif_dir, ignore_errors=True)
+
+    def test_corrected_ifgs_equal(self):
+        ifgs, ifgs_fused = [common.small_data_setup(datafiles=d)
+                            for d in self.dest_paths]
+        for i, f in zip(ifgs, ifgs_fused):
+            np.testing.assert_array_almost_equal(i.phase_data, f.phase_data,
+                                                 decimal=4)
+            md = f.dataset.GetMetadata()
+            for key in ['ORBITAL_ERROR', 'REFERENCE_PHASE', 'APS_ERROR',
+                        'DATA_UNITS']:
+                self.assertEqual(md.get(key),
+                                 i.dataset.GetMetadata().get(key))
+
+    def test_no_pending_corrections(self):
+        tmpdir = os.path.join(self.tif_dirs[1], cf.TMPDIR)
+        self.assertEqual(glob.glob(join(tmpdir, 'phase_cube_pending_*')), [])
+
+    def test_results_equal(self):
+        (refpx, maxvar, vcmt), (refpx_f, maxvar_f, vcmt_f) = self.results
+        np.testing.assert_array_equal(refpx, refpx_f)
+        np.testing.assert_array_almost_equal(maxvar, maxvar_f, decimal=4)
+        np.testing.assert_array_almost_equal(vcmt, vcmt_f, decimal=4)
+
+
+class FusedCorrectionsAPSPyRateTests(FusedCorrectionsPyRateTests):
+    """
+    fused correction pass vs per-correction writes with the APS correction
+    read from and saved to the phase cube
+    """
+    apsest = 1
+
+    def test_aps_corrected(self):
+        for dest_paths in self.dest_paths:
+            for i in common.small_data_setup(datafiles=dest_paths):
+                self.assertEqual(i.dataset.GetMetadata().get(
+                    ifc.PYRATE_APS_ERROR), ifc.APS_REMOVED)
+
+
 class TestPrePrepareIfgs(unittest.TestCase):
 
     @classmethod
@@ -356,5 +434,115 @@ class TestPrePrepareIfgs(unittest.TestCase):
             self.assertDictEqual(i.meta_data, j.meta_data)
 
 
+class IncrementalStateTests(unittest.TestCase):
+    """
+    Tests reuse of per-ifg results of a previous run
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.params = {cf.TMPDIR: self.tmp_dir, cf.NO_DATA_VALUE: 0.0,
+                       cf.NAN_CONVERSION: 1, cf.REFX: 0, cf.REFY: 0,
+                       cf.REFNX: 5, cf.REFNY: 5, cf.REF_CHIP_SIZE: 5,
+                       cf.REF_MIN_FRAC: 0.8}
+        self.paths = []
+        for n in range(3):
+            path = join(self.tmp_dir, 'ifg_{}.tif'.format(n))
+            with open(path, 'wb') as f:
+                f.write(os.urandom(1000))
+            self.paths.append(path)
+        hashes = run_pyrate._ifg_hashes(self.paths)
+        state = {'config': run_pyrate._incremental_config(self.params),
+                 'refpixel': (3, 4),
+                 'ifgs': {hashes[p][1]: {'preread': shared.PrereadIfg(
+                     'old_path', 0.1, None, None, 1.0, 2, 2, {}),
+                                         'maxvar': float(i)}
+                          for i, p in enumerate(self.paths[:2])}}
+        with open(join(self.tmp_dir, run_pyrate.INCREMENTAL_STATE_FILE),
+                  'wb') as f:
+            pickle.dump(state, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_unchanged_ifgs_reused(self):
+        cached = run_pyrate._load_incremental_state(self.paths, self.params)
+        self.assertEqual(sorted(cached['preread']), self.paths[:2])
+        self.assertEqual(cached['preread'][self.paths[1]].path, self.paths[1])
+        self.assertEqual(cached['maxvar'][self.paths[1]], 1.0)
+        self.assertEqual(cached['refpixel'], (3, 4))
+
+    def test_modified_ifg_not_reused(self):
+        with open(self.paths[0], 'ab') as f:
+            f.write(b'0')
+        cached = run_pyrate._load_incremental_state(self.paths, self.params)
+        self.assertEqual(list(cached['preread']), [self.paths[1]])
+
+    def test_unchanged_ifgs_not_rehashed(self):
+        known = run_pyrate._ifg_hashes(self.paths)
+        known[self.paths[1]] = (known[self.paths[1]][0], 'stale')
+        hashes = run_pyrate._ifg_hashes(self.paths, known)
+        self.assertEqual(hashes[self.paths[1]][1], 'stale')
+        with open(self.paths[1], 'ab') as f:
+            f.write(b'0')
+        hashes = run_pyrate._ifg_hashes(self.paths, known)
+        self.assertNotEqual(hashes[self.paths[1]][1], 'stale')
+        self.assertEqual(hashes[self.paths[0]], known[self.paths[0]])
+
+    def test_config_change_invalidates(self):
+        self.params[cf.REFNX] = 10
+        cached = run_pyrate._load_incremental_state(self.paths, self.params)
+        self.assertEqual(cached['preread'], {})
+        self.assertIsNone(cached['refpixel'])
+
+
+class CheckpointTests(unittest.TestCase):
+    """
+    Tests the stage and tile completion records used to resume a run
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.params = {cf.TMPDIR: self.tmp_dir, cf.PARALLEL: 0,
+                       cf.PROCESSES: 8, cf.ORBITAL_FIT: 1}
+        self.paths = ['a.tif', 'b.tif']
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _stage(self, x):
+        self.calls.append(x)
+        return x * 2
+
+    def _checkpoint(self, resume, rows=2):
+        return run_pyrate._Checkpoint(self.paths, self.params, rows, 2,
+                                      resume=resume)
+
+    def test_resume_skips_completed(self):
+        checkpoint = self._checkpoint(resume=False)
+        self.assertEqual(checkpoint.run('stage', self._stage, 3), 6)
+        checkpoint.mark('tiles', 1)
+        # runtime parameters do not invalidate the records
+        self.params[cf.PARALLEL] = 1
+        checkpoint = self._checkpoint(resume=True)
+        self.assertEqual(checkpoint.run('stage', self._stage, 3), 6)
+        self.assertEqual(self.calls, [3])
+        self.assertTrue(checkpoint.done('tiles', 1))
+        self.assertFalse(checkpoint.done('tiles', 0))
+
+    def test_changed_config_invalidates(self):
+        checkpoint = self._checkpoint(resume=False)
+        checkpoint.mark('tiles', 1)
+        self.assertFalse(self._checkpoint(resume=True, rows=3).done('tiles', 1))
+        self.params[cf.ORBITAL_FIT] = 0
+        self.assertFalse(self._checkpoint(resume=True).done('tiles', 1))
+
+    def test_no_resume_clears_records(self):
+        self._checkpoint(resume=False).mark('tiles', 1)
+        self._checkpoint(resume=False)
+        self.assertFalse(self._checkpoint(resume=True).done('tiles', 1))
+
+
 if __name__ == "__main__":
     unittest.main()
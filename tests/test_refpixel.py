@@ -20,10 +20,13 @@ import copy
 import unittest
 import tempfile
 import shutil
+from itertools import product
+import numpy as np
 from numpy import nan, mean, std, isnan
 
 from pyrate import config as cf
-from pyrate.refpixel import ref_pixel, _step
+from pyrate.refpixel import ref_pixel, _step, ref_pixel_sums, \
+    ref_pixel_means, ref_pixel_setup
 from pyrate.scripts import run_pyrate
 from tests.common import TEST_CONF_ROIPAC
 from tests.common import small_data_setup, MockIfg, small_ifg_file_list
@@ -195,6 +198,86 @@ class ReferencePixelTests(unittest.TestCase):
         self.assertEqual(res, exp_refpx)
 
 
+class RefPixelSumsTests(unittest.TestCase):
+    """
+    Tests the summed-area table chip statistics against direct computation
+    """
+
+    def setUp(self):
+        rs = np.random.RandomState(5)
+        self.data = []
+        for _ in range(6):
+            d = (rs.randn(40, 50) * 10 + 500).astype(np.float32)
+            d[rs.rand(40, 50) < 0.15] = nan
+            self.data.append(d)
+        self.data[2][:12, :12] = nan
+        self.half_patch_size = 3
+        self.thresh = 0.7 * 7 * 7
+        self.grid = list(product(range(3, 37, 2), range(3, 47, 2)))
+
+    def _expected_means(self, data):
+        hp = self.half_patch_size
+        means = []
+        for y, x in self.grid:
+            chips = [d[y - hp:y + hp + 1, x - hp:x + hp + 1] for d in data]
+            if all(np.sum(~isnan(c)) > self.thresh for c in chips):
+                means.append(mean([std(c[~isnan(c)].astype(np.float64))
+                                   for c in chips]))
+            else:
+                means.append(nan)
+        return np.array(means)
+
+    def test_mean_sds(self):
+        sd_sum, n_invalid = ref_pixel_sums(self.data, self.grid,
+                                           self.half_patch_size,
+                                           self.thresh, {})
+        res = ref_pixel_means(sd_sum, n_invalid, len(self.data))
+        exp = self._expected_means(self.data)
+        np.testing.assert_array_equal(isnan(res), isnan(exp))
+        self.assertTrue(isnan(res).any() and not isnan(res).all())
+        np.testing.assert_allclose(res, exp, rtol=1e-9)
+
+    def test_grid_inside_image(self):
+        # the tables are cropped to the chips of the grid
+        self.grid = list(product(range(10, 25, 3), range(15, 30, 4)))
+        sd_sum, n_invalid = ref_pixel_sums(self.data, self.grid,
+                                           self.half_patch_size,
+                                           self.thresh, {})
+        res = ref_pixel_means(sd_sum, n_invalid, len(self.data))
+        np.testing.assert_allclose(res, self._expected_means(self.data),
+                                   rtol=1e-9)
+
+    def test_ifg_paths_equal_phase_data(self):
+        # paths are opened, nan and mm converted as by the workflow
+        ifgs = small_data_setup()
+        params = {cf.NO_DATA_VALUE: 0.0, cf.REFNX: REFNX, cf.REFNY: REFNY,
+                  cf.REF_CHIP_SIZE: CHIPSIZE, cf.REF_MIN_FRAC: MIN_FRAC}
+        half_patch_size, thresh, grid = ref_pixel_setup(ifgs, params)
+        data = []
+        for i in ifgs:
+            i.convert_to_nans()
+            i.convert_to_mm()
+            data.append(i.phase_data)
+        sd_sum, n_invalid = ref_pixel_sums(data, grid, half_patch_size,
+                                           thresh, params)
+        sd_sum_p, n_invalid_p = ref_pixel_sums(small_ifg_file_list(), grid,
+                                               half_patch_size, thresh,
+                                               params)
+        self.assertTrue(np.any(sd_sum > 0))
+        np.testing.assert_allclose(sd_sum_p, sd_sum)
+        np.testing.assert_array_equal(n_invalid_p, n_invalid)
+
+    def test_partial_sums_add_up(self):
+        # sums of ifg subsets, as on separate MPI processes, combine exactly
+        args = (self.grid, self.half_patch_size, self.thresh, {})
+        sd_sum, n_invalid = ref_pixel_sums(self.data, *args)
+        parts = [ref_pixel_sums(self.data[:4], *args),
+                 ref_pixel_sums(self.data[4:], *args),
+                 ref_pixel_sums([], *args)]
+        np.testing.assert_allclose(sum(p[0] for p in parts), sd_sum)
+        np.testing.assert_array_equal(sum(p[1] for p in parts), n_invalid)
+
+
 def _expected_ref_pixel(ifgs, cs):
     """Helper function for finding reference pixel when refnx/y=2"""
 
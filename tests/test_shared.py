@@ -491,6 +491,169 @@ class WriteUnwTest(unittest.TestCase):
                     geotif_or_data=g, dest_unw=dest_unw, ifg_proc=0)
 
 
+class PhaseCubeTests(unittest.TestCase):
+    """Tests for the memory-mapped phase cube."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rng = np.random.RandomState(1)
+        self.data = rng.rand(5, 23, 17).astype(np.float32)
+        self.paths = [join('/some/dir', 'ifg_{}.tif'.format(i))
+                      for i in range(5)]
+        self.tiles = shared.create_tiles((23, 17), nrows=3, ncols=2)
+        cube = shared.PhaseCube.create(self.tmpdir, self.paths, self.tiles)
+        for p, d in zip(self.paths, self.data):
+            cube.write(p, d)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_tiles(self):
+        cube = shared.PhaseCube.load(self.tmpdir)
+        for t in self.tiles:
+            tile_data = cube.tile_data(t)
+            for i, p in enumerate(self.paths):
+                exp = self.data[i, t.top_left_y:t.bottom_right_y,
+                                t.top_left_x:t.bottom_right_x]
+                assert_array_equal(cube.read(p, t), exp)
+                assert_array_equal(tile_data[i], exp)
+
+    def test_write_in_place(self):
+        cube = shared.PhaseCube.load(self.tmpdir)
+        self.assertTrue(self.paths[2] in cube)
+        self.assertFalse('/some/dir/other.tif' in cube)
+        new = self.data[2] * 2
+        new[0, 0] = nan
+        cube.write(self.paths[2], new)
+        t = self.tiles[0]
+        assert_array_equal(cube.read(self.paths[2], t),
+                           new[t.top_left_y:t.bottom_right_y,
+                               t.top_left_x:t.bottom_right_x])
+        # copy-on-write reads do not modify the cube on disk
+        cube.read(self.paths[1], t)[:] = 0
+        assert_array_equal(cube.read(self.paths[1], t),
+                           self.data[1, t.top_left_y:t.bottom_right_y,
+                                     t.top_left_x:t.bottom_right_x])
+
+    def test_pending_corrections(self):
+        cube = shared.PhaseCube.load(self.tmpdir)
+        assert_array_equal(cube.read_full(self.paths[3]), self.data[3])
+        self.assertIsNone(cube.pending_meta(self.paths[3]))
+        cube.write(self.paths[3], self.data[3] + 1,
+                   meta_data={'ORBITAL_ERROR': 'REMOVED'})
+        assert_array_equal(cube.read_full(self.paths[3]), self.data[3] + 1)
+        self.assertEqual(cube.pending_meta(self.paths[3]),
+                         {'ORBITAL_ERROR': 'REMOVED'})
+        # a new cube holds no corrections
+        shared.PhaseCube.create(self.tmpdir, self.paths, self.tiles)
+        self.assertIsNone(cube.pending_meta(self.paths[3]))
+
+    def test_schedule_tiles_by_valid_count(self):
+        data = self.data.copy()
+        data[:, :8, :] = nan  # first row of tiles has no valid data
+        data[1:, 8:16, :9] = nan
+        cube = shared.PhaseCube.create(self.tmpdir, self.paths, self.tiles)
+        for p, d in zip(self.paths, data):
+            cube.write(p, d)
+        counts = [np.count_nonzero(~np.isnan(
+            data[:, t.top_left_y:t.bottom_right_y,
+                 t.top_left_x:t.bottom_right_x])) for t in self.tiles]
+        assert_array_equal(shared.PhaseCube.load(self.tmpdir).valid_counts(),
+                           counts)
+        tiles = list(shared.schedule_tiles(self.tiles,
+                                           {cf.TMPDIR: self.tmpdir}))
+        self.assertEqual([t.index for t in tiles], [3, 4, 5, 2, 0, 1])
+
+
+class RasterHeaderTests(unittest.TestCase):
+    """Tests for the persistent raster header index."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = join(self.tmpdir, 'geo_060619-061002_unw.tif')
+        shutil.copy(join(SML_TEST_TIF, 'geo_060619-061002_unw.tif'),
+                    self.path)
+        self.dem_path = SML_TEST_DEM_TIF
+        self.index_dir = join(self.tmpdir, cf.TMPDIR)
+        os.mkdir(self.index_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_header_equals_raster(self):
+        ifg = Ifg(self.path)
+        ifg.open(readonly=True)
+        header = shared.raster_header(self.path)
+        for a in ['nrows', 'ncols', 'shape', 'num_cells', 'x_step', 'y_step',
+                  'x_first', 'y_first', 'x_last', 'y_last', 'x_size',
+                  'y_size', 'x_centre', 'y_centre', 'master', 'slave',
+                  'time_span', 'wavelength']:
+            self.assertEqual(getattr(header, a), getattr(ifg, a), a)
+        self.assertEqual(header.meta_data, ifg.meta_data)
+        self.assertEqual(tuple(header.geotransform),
+                         ifg.dataset.GetGeoTransform())
+        dem = DEM(self.dem_path)
+        dem.open()
+        dem_header = shared.raster_header(self.dem_path, self.index_dir)
+        self.assertEqual(dem_header.shape, dem.shape)
+        self.assertFalse(hasattr(dem_header, 'master'))
+
+    def test_index_saved_and_invalidated(self):
+        header = shared.raster_header(self.path)
+        index_path = join(self.index_dir, shared.HEADER_INDEX)
+        self.assertTrue(exists(index_path))
+        # a new process loads the headers from the index file
+        shared._HEADER_INDICES.clear()
+        self.assertEqual(shared.raster_header(self.path).stamp, header.stamp)
+        # the header of a modified raster is read again
+        ifg = Ifg(self.path)
+        ifg.open(readonly=False)
+        ifg.meta_data[ifc.PYRATE_ORBITAL_ERROR] = ifc.ORB_REMOVED
+        ifg.write_modified_phase()
+        ifg.close()
+        self.assertEqual(shared.raster_header(self.path).meta_data[
+            ifc.PYRATE_ORBITAL_ERROR], ifc.ORB_REMOVED)
+
+
+class AutoTileLayoutTests(unittest.TestCase):
+    """Tests memory-budgeted choice of the tile layout."""
+
+    def test_tiles_fit_budget(self):
+        shape, nifgs, nepochs = (1000, 700), 60, 30
+        pixel_bytes = 2 * nifgs * 4 + nifgs + 3 * (nepochs - 1) * 4
+        for memory in [0.5, 5, 20, 50]:
+            rows, cols = shared.auto_tile_layout(shape, nifgs, nepochs, memory)
+            tiles = shared.create_tiles(shape, rows, cols)
+            largest = max((t.bottom_right_y - t.top_left_y) *
+                          (t.bottom_right_x - t.top_left_x) for t in tiles)
+            self.assertLessEqual(largest * pixel_bytes, memory * 2**20)
+            if cols > 1:
+                self.assertEqual(rows, shape[0])
+
+    def test_large_budget_single_tile(self):
+        self.assertEqual(shared.auto_tile_layout((100, 80), 20, 10, 1000),
+                         (1, 1))
+
+
+class WriteUnwBlockTest(unittest.TestCase):
+    """Tests block-wise writing of GAMMA unw files from numpy arrays."""
+
+    def test_unw_from_data_in_blocks(self):
+        data = np.random.RandomState(2).rand(31, 7)
+        temp_unw = tempfile.mktemp(suffix='.unw')
+        block_bytes = shared.BLOCK_BYTES
+        shared.BLOCK_BYTES = 100  # force several row blocks
+        try:
+            shared.write_unw_from_data_or_geotiff(geotif_or_data=data,
+                                                  dest_unw=temp_unw,
+                                                  ifg_proc=1)
+        finally:
+            shared.BLOCK_BYTES = block_bytes
+        unw = np.fromfile(temp_unw, dtype='>f4').reshape(data.shape)
+        os.remove(temp_unw)
+        assert_array_equal(unw, data.astype(np.float32))
+
+
 class GeodesyTests(unittest.TestCase):
 
     def test_utm_zone(self):
@@ -17,6 +17,7 @@
 This Python module contains tests for the timeseries.py PyRate module.
 """
 from __future__ import print_function
+import itertools
 import os
 import shutil
 import sys
@@ -35,6 +36,7 @@ from pyrate import ref_phs_est as rpe
 from pyrate import shared
 from pyrate import covariance
 from pyrate.scripts import run_pyrate, run_prepifg
+from pyrate import timeseries
 from pyrate.timeseries import time_series
 
 
@@ -46,7 +48,8 @@ def default_params():
             cf.PARALLEL: 0,
             cf.PROCESSES: 1,
             cf.NAN_CONVERSION: 1,
-            cf.NO_DATA_VALUE: 0}
+            cf.NO_DATA_VALUE: 0,
+            cf.TIME_SERIES_CACHE_SIZE: 1000}
 
 
 class SinglePixelIfg(object):
@@ -128,6 +131,64 @@ class TimeSeriesTests(unittest.TestCase):
         assert_array_almost_equal(tscum, expected, decimal=2)
 
 
+class TimeSeriesPatternTests(unittest.TestCase):
+    """
+    Verifies the pattern cached time series inversion against the
+    pixel-by-pixel inversion on a synthetic stack
+    """
+
+    def setUp(self):
+        rng = np.random.RandomState(3)
+        imaster = asarray([0, 0, 1, 1, 2, 2, 3, 4, 0, 3])
+        islave = asarray([1, 3, 2, 3, 4, 5, 5, 5, 2, 4])
+        span = asarray([0.1, 0.5, 0.2, 0.3, 0.2, 0.4])
+        self.nvelpar = len(span)
+        nifgs, nrows, ncols = len(imaster), 5, 6
+        self.b0_mat = np.zeros((nifgs, self.nvelpar))
+        for i, (m, s) in enumerate(zip(imaster, islave)):
+            self.b0_mat[i, m:s] = span[m:s]
+        vel = rng.uniform(-5, 5, (self.nvelpar, nrows, ncols))
+        self.ifg_data = np.einsum('ij,jkl->ikl', self.b0_mat, vel) + \
+            rng.normal(0, 0.1, (nifgs, nrows, ncols))
+        self.mst = rng.rand(nifgs, nrows, ncols) > 0.2
+        self.mst[:, :2, :] = True  # many pixels share the full network
+        self.mst[5:, 4, 5] = False  # rank deficient network
+        m = rng.rand(nifgs, nifgs)
+        self.vcmt = m.dot(m.T) / nifgs + np.eye(nifgs)
+
+    def _by_pixel(self, p_thresh, interp, method):
+        nrows, ncols = self.ifg_data.shape[1:]
+        res = np.empty((nrows, ncols, self.nvelpar))
+        for row in range(nrows):
+            for col in range(ncols):
+                res[row, col] = timeseries._time_series_by_pixel(
+                    row, col, self.b0_mat, 0.5, 2, self.ifg_data, self.mst,
+                    self.nvelpar, p_thresh, interp, self.vcmt, method)
+        return res
+
+    def _by_pattern(self, p_thresh, interp, method, cache_size=100):
+        return timeseries._time_series_by_pattern(
+            self.b0_mat, 0.5, 2, self.ifg_data, self.mst, self.nvelpar,
+            p_thresh, interp, self.vcmt, method, cache_size)
+
+    def test_pattern_equals_pixel(self):
+        for method, interp, p_thresh in itertools.product(
+                [1, 2], [0, 1], [0, 9]):
+            expected = self._by_pixel(p_thresh, interp, method)
+            res = self._by_pattern(p_thresh, interp, method)
+            assert_array_almost_equal(res, expected, decimal=5)
+
+    def test_cache_hits(self):
+        self._by_pattern(0, 0, 2)
+        hits = timeseries._NETWORK_CACHE.hits
+        self._by_pattern(0, 0, 2)
+        self.assertGreater(timeseries._NETWORK_CACHE.hits, hits)
+        self.assertLessEqual(len(timeseries._NETWORK_CACHE), 100)
+        # changing the inversion method invalidates the cached operators
+        self._by_pattern(0, 0, 1, cache_size=0)
+        self.assertEqual(len(timeseries._NETWORK_CACHE), 0)
+
+
 class MatlabTimeSeriesEquality(unittest.TestCase):
     """
     Checks the python function to that of Matlab Pirate ts.m and tsinvlap.m